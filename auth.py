@@ -1,17 +1,96 @@
 # auth.py
+import asyncio
 import bcrypt
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Optional
 
-# In-memory user store for demo; replace with PostgreSQL in production
-users = {}
+from datastore import RedisStore, get_store
 
-def register_user(username: str, password: str) -> bool:
-    if username in users:
+# bcrypt releases the GIL, so a thread pool hashes in parallel
+AUTH_WORKERS = 4
+# Logins allowed to wait for a free worker before new ones are rejected
+AUTH_MAX_QUEUE = 64
+
+class UserStore:
+    """Where password hashes live; the handlers only call get() and add()."""
+
+    async def get(self, username: str) -> Optional[bytes]:
+        """The bcrypt hash for ``username``, or None if there is no such user."""
+        raise NotImplementedError
+
+    async def add(self, username: str, hashed: bytes) -> bool:
+        """Store a new user; False if the name is already taken."""
+        raise NotImplementedError
+
+class MemoryUserStore(UserStore):
+    """In-memory users for a demo or a single process."""
+
+    def __init__(self):
+        self.hashes: Dict[str, bytes] = {}
+
+    async def get(self, username: str) -> Optional[bytes]:
+        return self.hashes.get(username)
+
+    async def add(self, username: str, hashed: bytes) -> bool:
+        return self.hashes.setdefault(username, hashed) is hashed
+
+class RedisUserStore(UserStore):
+    """Users in one Redis hash, shared by every server process."""
+
+    def __init__(self, store: Optional[RedisStore] = None, key: str = 'users'):
+        self.store = store or get_store()
+        self.key = key
+
+    async def get(self, username: str) -> Optional[bytes]:
+        return await self.store.hget(self.key, username)
+
+    async def add(self, username: str, hashed: bytes) -> bool:
+        return bool(await self.store.hsetnx(self.key, username, hashed))
+
+# In-memory for demo; swap with set_user_store() (Redis, or PostgreSQL in production)
+users: UserStore = MemoryUserStore()
+
+def set_user_store(store: UserStore):
+    global users
+    users = store
+
+class AuthBusy(Exception):
+    """Raised when the hashing pool is saturated; the client should retry."""
+
+class AuthPool:
+    """Runs bcrypt off the event loop with a bounded queue."""
+
+    def __init__(self, workers: int = AUTH_WORKERS, max_queue: int = AUTH_MAX_QUEUE):
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='auth')
+        self.max_pending = workers + max_queue
+        self.pending = 0
+
+    async def run(self, func, *args):
+        if self.pending >= self.max_pending:
+            raise AuthBusy()
+        self.pending += 1
+        try:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self.executor, func, *args)
+        finally:
+            self.pending -= 1
+
+auth_pool = AuthPool()
+
+def configure_auth_pool(workers: int = AUTH_WORKERS, max_queue: int = AUTH_MAX_QUEUE):
+    global auth_pool
+    auth_pool.executor.shutdown(wait=False)
+    auth_pool = AuthPool(workers, max_queue)
+
+async def register_user_async(username: str, password: str) -> bool:
+    if await users.get(username) is not None:
         return False
-    hashed = bcrypt.hashpw(password.encode(), bcrypt.gensalt())
-    users[username] = hashed
-    return True
+    hashed = await auth_pool.run(bcrypt.hashpw, password.encode(), bcrypt.gensalt())
+    # Another registration may have won the race while we were hashing
+    return await users.add(username, hashed)
 
-def authenticate_user(username: str, password: str) -> bool:
-    if username not in users:
+async def authenticate_user_async(username: str, password: str) -> bool:
+    hashed = await users.get(username)
+    if hashed is None:
         return False
-    return bcrypt.checkpw(password.encode(), users[username])
+    return await auth_pool.run(bcrypt.checkpw, password.encode(), hashed)
@@ -0,0 +1,104 @@
+# bench_auth.py
+"""Measure event-loop lag during a login burst, before and after the auth pool.
+
+A ticker task sleeps for a fixed interval and records how late it wakes up.
+The same burst of logins is run through bcrypt on the event loop, through
+the pooled authenticate_user_async, and as reconnects that present a
+session token instead of a password; the ticker's lag is reported.
+
+    python bench_auth.py --logins 500 --rounds 10 --workers 4
+"""
+import argparse
+import asyncio
+import statistics
+import time
+import bcrypt
+
+import auth
+import tokens
+
+TICK = 0.005
+
+
+async def measure_lag(stop: asyncio.Event, lags: list):
+    while not stop.is_set():
+        start = time.perf_counter()
+        await asyncio.sleep(TICK)
+        lags.append(time.perf_counter() - start - TICK)
+
+
+async def blocking_login(username, password):
+    # What main.handler used to do: bcrypt directly on the event loop
+    return bcrypt.checkpw(password.encode(), await auth.users.get(username))
+
+
+def token_login(issued):
+    async def login(username, password):
+        # A reconnect: the token from the first login, no password
+        return tokens.verify(issued[username]) is not None
+    return login
+
+
+async def run_burst(login, logins, password):
+    lags = []
+    stop = asyncio.Event()
+    ticker = asyncio.create_task(measure_lag(stop, lags))
+    await asyncio.sleep(TICK * 2)
+
+    start = time.perf_counter()
+    results = await asyncio.gather(
+        *(login(f"user{i}", password) for i in range(logins)),
+        return_exceptions=True
+    )
+    elapsed = time.perf_counter() - start
+
+    stop.set()
+    await ticker
+    ok = sum(1 for r in results if r is True)
+    busy = sum(1 for r in results if isinstance(r, auth.AuthBusy))
+    return elapsed, ok, busy, lags
+
+
+def report(name, elapsed, ok, busy, lags):
+    lags_ms = sorted(lag * 1000 for lag in lags) or [0.0]
+    p99 = lags_ms[min(len(lags_ms) - 1, int(len(lags_ms) * 0.99))]
+    print(f"{name:<10} {elapsed:7.2f}s  ok={ok} rejected={busy}  "
+          f"loop lag mean={statistics.fmean(lags_ms):.1f}ms "
+          f"p99={p99:.1f}ms max={lags_ms[-1]:.1f}ms")
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--logins', type=int, default=500)
+    parser.add_argument('--rounds', type=int, default=10, help='bcrypt cost factor')
+    parser.add_argument('--workers', type=int, default=auth.AUTH_WORKERS)
+    parser.add_argument('--max-queue', type=int, default=None,
+                        help='pool queue limit (default: large enough for the burst)')
+    args = parser.parse_args()
+
+    password = 'hunter2'
+    hashed = bcrypt.hashpw(password.encode(), bcrypt.gensalt(args.rounds))
+    for i in range(args.logins):
+        await auth.users.add(f"user{i}", hashed)
+    issued = {f"user{i}": tokens.issue(f"user{i}") for i in range(args.logins)}
+
+    max_queue = args.logins if args.max_queue is None else args.max_queue
+    auth.configure_auth_pool(args.workers, max_queue)
+
+    report('blocking', *await run_burst(blocking_login, args.logins, password))
+    report('pooled', *await run_burst(auth.authenticate_user_async, args.logins, password))
+    report('token', *await run_burst(token_login(issued), args.logins, password))
+
+    token = issued['user0']
+    start = time.perf_counter()
+    for _ in range(100000):
+        tokens.verify(token)
+    verify_us = (time.perf_counter() - start) / 100000 * 1e6
+    start = time.perf_counter()
+    bcrypt.checkpw(password.encode(), hashed)
+    bcrypt_us = (time.perf_counter() - start) * 1e6
+    print(f"per login: bcrypt {bcrypt_us:,.0f} us, token verify {verify_us:.1f} us")
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -0,0 +1,141 @@
+# bench_cluster.py
+"""Game throughput of cluster.py as the number of workers grows.
+
+Starts the cluster with 1, 2, ... workers, then drives full four-player
+tables from several load processes. Players join rooms by code, so most
+tables span workers and exercise the tunnel. Reports card actions per
+second and the speed-up over one worker.
+
+    python bench_cluster.py --workers 1 2 4 --tables 50 --duration 10
+"""
+import argparse
+import asyncio
+import multiprocessing
+import os
+import signal
+import socket
+import subprocess
+import sys
+import time
+
+import websockets
+
+from loadgen import choose_action
+from protocol import BINARY, BINARY_SUBPROTOCOL
+from statesync import GameView
+
+
+async def player(ws, deadline, counts):
+    view = GameView()
+    acted = -1
+    while time.monotonic() < deadline:
+        try:
+            msg = BINARY.decode(await asyncio.wait_for(ws.recv(), deadline - time.monotonic()))
+        except (asyncio.TimeoutError, websockets.ConnectionClosed):
+            return
+        if msg['type'] == 'game_start':
+            view.seat = msg['seat']
+            view.load_snapshot(msg['seq'], msg['state'], msg['hand'])
+        elif msg['type'] == 'game_update':
+            view.apply(msg['seq'], msg['events'], msg.get('hand'))
+        else:
+            continue
+        if view.state['phase'] == 'match_over':
+            return
+        action = choose_action(view)
+        if action is None or acted == view.seq:
+            continue
+        acted = view.seq
+        await ws.send(BINARY.encode(*action))
+        counts['actions'] += 1
+
+
+async def table(uri, deadline, counts):
+    # Tables are replayed back to back until the time is up
+    while time.monotonic() < deadline:
+        sockets = []
+        try:
+            host = await websockets.connect(uri, subprotocols=[BINARY_SUBPROTOCOL])
+            sockets.append(host)
+            await host.send(BINARY.encode('create_room', {'username': 'host'}))
+            while True:
+                msg = BINARY.decode(await host.recv())
+                if msg['type'] == 'room_joined':
+                    break
+            for i in range(3):
+                ws = await websockets.connect(uri, subprotocols=[BINARY_SUBPROTOCOL])
+                sockets.append(ws)
+                await ws.send(BINARY.encode('join_room', {'username': f'p{i}',
+                                                          'room_code': msg['room_id']}))
+            await asyncio.gather(*(player(ws, deadline, counts) for ws in sockets))
+            counts['tables'] += 1
+        finally:
+            for ws in sockets:
+                await ws.close()
+
+
+def load_process(uri, tables, duration):
+    counts = {'actions': 0, 'tables': 0}
+
+    async def run():
+        deadline = time.monotonic() + duration
+        await asyncio.gather(*(table(uri, deadline, counts) for _ in range(tables)))
+
+    asyncio.run(run())
+    return counts
+
+
+def wait_for_port(port, timeout=10.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=0.2).close()
+            return
+        except OSError:
+            time.sleep(0.1)
+    raise RuntimeError(f"Cluster did not start on port {port}")
+
+
+def measure(workers, args):
+    bus_socket = f"/tmp/hokm-bench-{args.port}.sock"
+    cluster = subprocess.Popen(
+        [sys.executable, 'cluster.py', '--workers', str(workers), '--host', '127.0.0.1',
+         '--port', str(args.port), '--bus-socket', bus_socket],
+        stdout=subprocess.DEVNULL, start_new_session=True,
+    )
+    try:
+        wait_for_port(args.port)
+        time.sleep(0.5)  # let every worker bind
+        uri = f"ws://127.0.0.1:{args.port}"
+        with multiprocessing.Pool(args.load_processes) as pool:
+            start = time.perf_counter()
+            results = pool.starmap(load_process, [(uri, args.tables, args.duration)]
+                                   * args.load_processes)
+            elapsed = time.perf_counter() - start
+    finally:
+        os.killpg(cluster.pid, signal.SIGTERM)
+        cluster.wait()
+    actions = sum(r['actions'] for r in results)
+    tables = sum(r['tables'] for r in results)
+    return actions / elapsed, tables
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4])
+    parser.add_argument('--tables', type=int, default=50, help='concurrent tables per load process')
+    parser.add_argument('--load-processes', type=int, default=4)
+    parser.add_argument('--duration', type=float, default=10.0)
+    parser.add_argument('--port', type=int, default=8790)
+    args = parser.parse_args()
+
+    print(f"{'workers':>8}{'actions/s':>12}{'speed-up':>10}{'tables':>8}")
+    baseline = None
+    for workers in args.workers:
+        rate, tables = measure(workers, args)
+        baseline = baseline or rate
+        print(f"{workers:>8}{rate:>12,.0f}{rate / baseline:>10.2f}{tables:>8}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,56 @@
+# bench_engine.py
+"""Throughput of the engine hot path: legal moves, trick winners, full hands.
+
+    python bench_engine.py --n 1000000
+"""
+import argparse
+import random
+import time
+
+from engine import (
+    SUIT_OF, HokmGame, cards_of, legal_mask, trick_winner
+)
+
+
+def bench(name, func, n):
+    start = time.perf_counter()
+    func(n)
+    elapsed = time.perf_counter() - start
+    print(f"{name:<14} {n / elapsed:>14,.0f} /s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--n', type=int, default=1_000_000)
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+    rng = random.Random(args.seed)
+
+    hands = [rng.getrandbits(52) for _ in range(1024)]
+    leads = [rng.choice((None, 0, 1, 2, 3)) for _ in range(1024)]
+    tricks = [tuple(rng.sample(range(52), 4)) for _ in range(1024)]
+
+    def legal(n):
+        for i in range(n):
+            legal_mask(hands[i & 1023], leads[i & 1023])
+
+    def winners(n):
+        for i in range(n):
+            trick_winner(tricks[i & 1023], i & 3)
+
+    def hands_played(n):
+        for i in range(n):
+            game = HokmGame(seed=i)
+            game.start_hand()
+            game.choose_trump(game.hakem, SUIT_OF[cards_of(game.hands[game.hakem])[0]])
+            while game.phase == 'play':
+                seat = game.turn
+                game.play(seat, cards_of(game.legal_moves(seat))[0])
+
+    bench('legal moves', legal, args.n)
+    bench('trick winners', winners, args.n)
+    bench('hands', hands_played, max(1, args.n // 100))
+
+
+if __name__ == '__main__':
+    main()
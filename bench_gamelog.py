@@ -0,0 +1,101 @@
+# bench_gamelog.py
+"""Game log cost on the request path, flush throughput and rebuild latency.
+
+Plays random legal games, logging every action through GameLog. It then
+rebuilds each game from its latest snapshot plus tail, and again from
+its metadata plus every action (what you would do without snapshots).
+Uses fakeredis unless --redis is given.
+
+    python bench_gamelog.py --games 200
+    python bench_gamelog.py --games 200 --redis redis://localhost:6379/15
+"""
+import argparse
+import asyncio
+import random
+import time
+
+import gamelog
+from datastore import RedisStore
+from engine import CARD_NAMES, SUITS, HokmGame, cards_of
+
+
+def play_logged(log: gamelog.GameLog, key: str, rng: random.Random) -> HokmGame:
+    game = HokmGame(seed=rng.getrandbits(64))
+    log.open(key, game)
+    game.start_hand()
+    log.append(key, None, {'type': 'start_hand'}, game)
+    while game.phase != 'match_over':
+        if game.phase == 'trump':
+            seat, action = game.hakem, {'type': 'choose_trump', 'suit': rng.choice(SUITS)}
+        else:
+            seat = game.turn
+            card = rng.choice(cards_of(game.legal_moves(seat)))
+            action = {'type': 'play_card', 'card': CARD_NAMES[card]}
+        game.apply(seat, action)
+        log.append(key, seat, action, game)
+    return game
+
+
+async def run(args):
+    store = RedisStore(url=args.redis) if args.redis else RedisStore.fake()
+    backend = gamelog.RedisStreamLog(store)
+    # A long interval so the flush is timed on its own below
+    log = gamelog.GameLog(backend, flush_interval=3600, snapshot_every=args.snapshot_every)
+    rng = random.Random(args.seed)
+
+    start = time.perf_counter()
+    games = {f"bench{i}": play_logged(log, f"bench{i}", rng) for i in range(args.games)}
+    played = time.perf_counter() - start
+    actions = sum(1 for record in log.pending if record[0] == 'act')
+
+    # Same games without logging, to isolate the request-path cost
+    rng = random.Random(args.seed)
+    start = time.perf_counter()
+    for i in range(args.games):
+        play_logged(gamelog.GameLog(), f"plain{i}", rng)
+    plain = time.perf_counter() - start
+    print(f"request path  {(played - plain) / actions * 1e6:.2f} us/action logged "
+          f"({actions} actions)")
+
+    records = len(log.pending)
+    start = time.perf_counter()
+    await log.flush()
+    flushed = time.perf_counter() - start
+    print(f"flush         {records / flushed:,.0f} records/s ({records} records, one pipeline)")
+
+    ids = [gid async for gid in backend.games()]
+    for name, with_snapshot in (('snapshot+tail', True), ('full replay', False)):
+        start = time.perf_counter()
+        tail = 0
+        for gid in ids:
+            if with_snapshot:
+                meta, snap, actions_after = await backend.load(gid)
+            else:
+                (meta, actions_after), snap = await backend.read(gid), None
+            tail += len(actions_after)
+            gamelog.replay(meta, snap, actions_after)
+        elapsed = time.perf_counter() - start
+        print(f"{name:<14}{elapsed / len(ids) * 1000:.2f} ms/game "
+              f"(avg {tail / len(ids):.0f} actions replayed)")
+
+    for gid in ids:
+        meta, snap, tail = await backend.load(gid)
+        key = gid.rsplit('-', 1)[0]
+        assert gamelog.replay(meta, snap, tail).to_state() == games[key].to_state()
+    if args.redis:
+        await store.client.flushdb()
+    await store.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--games', type=int, default=200)
+    parser.add_argument('--snapshot-every', type=int, default=gamelog.SNAPSHOT_EVERY)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--redis', default=None, help='use this Redis (it is flushed!)')
+    args = parser.parse_args()
+    asyncio.run(run(args))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,171 @@
+# bench_handoff.py
+"""Drain duration and restore time for a restart with N games in progress.
+
+Fills server.py's tables with N four-human games, each stopped at a
+random point, then runs ``server.drain()`` against a handoff backend.
+After that it starts the way a restarted server does, reserving the
+handed-off codes, and restores every room as its first player would on
+resume. It reports per-room restore latency and the total, against a
+restart that rebuilt every game by replaying its log. Uses fakeredis
+unless --redis is given; --file uses FileHandoff instead.
+
+    python bench_handoff.py --rooms 10000
+    python bench_handoff.py --rooms 10000 --file /tmp/handoff.jsonl
+"""
+import argparse
+import asyncio
+import contextlib
+import io
+import random
+import statistics
+import time
+
+import gamelog
+import handoff
+import server
+from datastore import RedisStore
+from engine import CARD_NAMES, SUITS, HokmGame, cards_of
+from player import Player
+from roomcodes import RoomCodeAllocator
+from statesync import RoomSync
+
+
+class Socket:
+    """Stands in for a websocket; drain() only closes it."""
+
+    async def close(self, code=1000, reason=''):
+        pass
+
+
+def random_game(rng: random.Random) -> HokmGame:
+    game = HokmGame(seed=rng.getrandbits(64))
+    game.start_hand()
+    for _ in range(rng.randrange(200)):
+        if game.phase == 'trump':
+            game.choose_trump(game.hakem, SUITS.index(rng.choice(SUITS)))
+        elif game.phase == 'play':
+            game.play(game.turn, rng.choice(cards_of(game.legal_moves(game.turn))))
+        elif game.phase == 'hand_over':
+            game.start_hand()
+        else:
+            break
+    return game
+
+
+def fill(rooms: int, rng: random.Random):
+    server.room_codes = RoomCodeAllocator(digits=7)
+    for _ in range(rooms):
+        room_code = server.room_codes.allocate()
+        game = random_game(rng)
+        sync = RoomSync()
+        sync.seq = rng.randrange(1, 500)
+        players = server.rooms[room_code] = []
+        for seat in range(4):
+            players.append(Player(player_id=f"p{room_code}-{seat}", wsconnection=Socket(),
+                                  username=f"player{rng.randrange(2000)}",
+                                  current_room=room_code, seat=seat))
+            sync.issue_token(seat, players[seat].username)
+            players[seat].hand = game.hands[seat]
+        server.games[room_code] = game
+        server.room_syncs[room_code] = sync
+
+
+def restart():
+    """Forget everything in memory, as a new process would."""
+    server.draining = False
+    for table in (server.rooms, server.games, server.room_syncs, server.bot_tasks,
+                  server.room_idle_timers):
+        table.clear()
+    server.room_codes = RoomCodeAllocator(digits=7)
+
+
+def percentile(values, q: float) -> float:
+    return sorted(values)[min(len(values) - 1, int(q * len(values)))]
+
+
+async def run(args):
+    if args.file:
+        server.room_handoff = handoff.FileHandoff(args.file)
+    else:
+        store = RedisStore(url=args.redis) if args.redis else RedisStore.fake()
+        server.room_handoff = handoff.RedisHandoff(store)
+    rng = random.Random(args.seed)
+    fill(args.rooms, rng)
+    live = {code: game.to_state() for code, game in server.games.items()}
+    in_progress = sum(1 for game in server.games.values() if game.phase != 'match_over')
+
+    # The server prints a line per room restored; keep that out of the timings
+    output = io.StringIO()
+    with contextlib.redirect_stdout(output):
+        start = time.perf_counter()
+        await server.drain()
+        drained = time.perf_counter() - start
+
+        restart()
+        start = time.perf_counter()
+        await server.load_handoff()
+        startup = time.perf_counter() - start
+
+        latencies = []
+        start = time.perf_counter()
+        for room_code in list(server.handed_off):
+            began = time.perf_counter()
+            await server.restored(room_code)
+            latencies.append(time.perf_counter() - began)
+        restore_all = time.perf_counter() - start
+    assert all(server.games[code].to_state() == live[code] for code in server.games)
+    for timer in server.room_idle_timers.values():
+        timer.cancel()
+
+    # The same games rebuilt from the game log instead: meta, snapshot, tail
+    log = gamelog.GameLog(gamelog.RedisStreamLog(RedisStore.fake()), flush_interval=3600)
+    for i in range(min(args.rooms, args.replayed)):
+        key = f"log{i}"
+        game = HokmGame(seed=rng.getrandbits(64))
+        log.open(key, game)
+        game.start_hand()
+        log.append(key, None, {'type': 'start_hand'}, game)
+        for _ in range(rng.randrange(200)):
+            if game.phase == 'trump':
+                action = {'type': 'choose_trump', 'suit': rng.choice(SUITS)}
+                seat = game.hakem
+            elif game.phase == 'play':
+                card = rng.choice(cards_of(game.legal_moves(game.turn)))
+                action, seat = {'type': 'play_card', 'card': CARD_NAMES[card]}, game.turn
+            else:
+                break
+            game.apply(seat, action)
+            log.append(key, seat, action, game)
+    await log.flush()
+    replayed = []
+    for game_id in list(log.ids.values()):
+        began = time.perf_counter()
+        gamelog.replay(*await log.backend.load(game_id))
+        replayed.append(time.perf_counter() - began)
+
+    print(f"\n{args.rooms} rooms, {in_progress} games in progress, "
+          f"{'file' if args.file else 'redis'} handoff")
+    print(next(line for line in output.getvalue().splitlines() if line.startswith('Drained')))
+    print(f"drain          {drained * 1000:8.1f} ms")
+    print(f"startup        {startup * 1000:8.1f} ms  (reserve {len(latencies)} codes)")
+    print(f"restore p50    {statistics.median(latencies) * 1e6:8.0f} us per room")
+    print(f"restore p99    {percentile(latencies, 0.99) * 1e6:8.0f} us per room")
+    print(f"restore all    {restore_all * 1000:8.1f} ms")
+    print(f"log replay p50 {statistics.median(replayed) * 1e6:8.0f} us per room "
+          f"({len(replayed)} games)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rooms', type=int, default=10000)
+    parser.add_argument('--replayed', type=int, default=1000,
+                        help='games rebuilt from the game log for comparison')
+    parser.add_argument('--redis', default=None)
+    parser.add_argument('--file', default=None)
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+    asyncio.run(run(args))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,232 @@
+# bench_matchmaking.py
+"""Benchmark lobby joins, queue joins and matchmaking ticks against Redis.
+
+Compares the old multi-round-trip code paths with the atomic Lua scripts
+in lobby.py and the first-come-first-served queue script, using many
+concurrent clients (threads, each with its own connection) and reports
+joins per second plus how many rooms ended up overfilled or tables split.
+
+Then it runs the tick-batched Matchmaker (matchmaking.py) with --queued
+players parked in the queue, in rating buckets too far apart to ever
+match, while --rate players a second join with normal ratings for
+--seconds. It reports the tick script's cost at that queue size,
+time-to-match, and Redis round trips per table formed.
+
+    python bench_matchmaking.py --clients 64 --joins 20000
+    python bench_matchmaking.py --fake --joins 2000 --queued 10000
+"""
+import argparse
+import asyncio
+import random
+import threading
+import time
+import redis
+import redis.asyncio
+
+import matchmaking
+from datastore import RedisStore
+from loadgen import percentiles
+from lobby import ASSIGN_PLAYER_LUA, assign_call
+
+TABLE_SIZE = 4
+
+# The previous NetworkManager.handle_queue: push a player and, if a full
+# table is waiting, pop exactly that many players from the head.
+# KEYS[1] = lobby queue, ARGV[1] = player id, ARGV[2] = table size
+ENQUEUE_LUA = """
+local size = tonumber(ARGV[2])
+local queued = redis.call('RPUSH', KEYS[1], ARGV[1])
+if queued < size then
+    return {}
+end
+local players = redis.call('LRANGE', KEYS[1], 0, size - 1)
+redis.call('LTRIM', KEYS[1], size, -1)
+return players
+"""
+
+
+def legacy_assign(client, username):
+    room_code = client.get('bench:current_room_code')
+    if not room_code:
+        room_code = f"{random.randint(1000, 9999)}"
+        client.set('bench:current_room_code', room_code)
+        client.delete(f'room:{room_code}:players')
+    room_code = room_code.decode() if isinstance(room_code, bytes) else room_code
+    players_key = f'room:{room_code}:players'
+    players = client.lrange(players_key, 0, -1)
+    player_number = len(players) + 1
+    client.rpush(players_key, username)
+    if player_number == 4:
+        client.delete('bench:current_room_code')
+    return room_code, player_number
+
+
+def scripted_assign(script, username):
+    keys, args = assign_call(username, key_prefix='bench:')
+    return script(keys=keys, args=args)
+
+
+def legacy_enqueue(client, player_id):
+    client.rpush('bench:lobby', player_id)
+    queue_size = client.llen('bench:lobby')
+    if queue_size >= TABLE_SIZE:
+        return [p for p in (client.lpop('bench:lobby') for _ in range(queue_size)) if p]
+    return []
+
+
+def scripted_enqueue(script, player_id):
+    return script(keys=['bench:lobby'], args=[player_id, TABLE_SIZE])
+
+
+def run(name, make_worker, clients, joins):
+    per_client = joins // clients
+    tables = []
+    lock = threading.Lock()
+
+    def body(idx):
+        join = make_worker()
+        local = []
+        for n in range(per_client):
+            result = join(f"p{idx}-{n}")
+            if result:
+                local.append(result)
+        with lock:
+            tables.extend(local)
+
+    threads = [threading.Thread(target=body, args=(i,)) for i in range(clients)]
+    start = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - start
+    total = per_client * clients
+    print(f"{name:<18} {total / elapsed:>10.0f} joins/s  ({total} joins, {elapsed:.2f}s)")
+    return tables
+
+
+def check_rooms(client):
+    overfilled = 0
+    for key in client.scan_iter('room:*:players'):
+        if client.llen(key) > TABLE_SIZE:
+            overfilled += 1
+    return overfilled
+
+
+async def matchmaker_run(store: RedisStore, queued: int, rate: float, seconds: float):
+    joined, waits = {}, []
+
+    async def on_match(player_ids):
+        now = time.perf_counter()
+        waits.extend(now - joined.pop(pid) for pid in player_ids if pid in joined)
+
+    mm = matchmaking.Matchmaker(on_match, store=store)
+    # Parked players: one per bucket, MAX_WIDEN + 1 buckets apart, never matched
+    gap = (matchmaking.MAX_WIDEN + 1) * matchmaking.BUCKET_WIDTH
+    parked = {f"parked{i}": 100000 + i * gap for i in range(queued)}
+    if parked:
+        await store.hset(matchmaking.RATINGS_KEY, mapping=parked)
+    for name in parked:
+        mm.enqueue(name, name)
+    await mm.tick()
+    for name in parked:
+        mm.cancel(name)  # this process stops waiting for them; Redis keeps them queued
+    mm.leaves.clear()
+
+    rng = random.Random(1)
+    ratings = {f"p{i}": round(rng.gauss(1500, 200)) for i in range(int(rate * seconds))}
+    await store.hset(matchmaking.RATINGS_KEY, mapping=ratings)
+    store.stats.calls.clear()
+    store.stats.total.clear()
+    store.stats.max.clear()
+    ticks, tables = mm.ticks, mm.tables
+    start = time.perf_counter()
+    for n, name in enumerate(ratings):
+        await asyncio.sleep(max(0.0, start + n / rate - time.perf_counter()))
+        joined[name] = time.perf_counter()
+        mm.enqueue(name, name)
+    await asyncio.sleep(matchmaking.TICK * 2)
+    calls = sum(store.stats.calls.values())
+    tick = store.stats.summary().get('MATCHMAKING_TICK', {'avg_ms': 0, 'max_ms': 0})
+    made = mm.tables - tables
+    p = percentiles(waits)
+    print(f"queued {mm.queued:>6} (parked {queued}), {len(ratings)} joins at {rate:g}/s")
+    print(f"{'':<18} ticks {mm.ticks - ticks}, tick script avg {tick['avg_ms']:.2f} ms "
+          f"max {tick['max_ms']:.2f} ms")
+    print(f"{'':<18} tables {made}, time to match p50 {p['p50_ms']:.0f} ms "
+          f"p99 {p['p99_ms']:.0f} ms, still waiting {len(joined)}")
+    print(f"{'':<18} redis round trips per table {calls / max(made, 1):.3f} "
+          f"(first-come-first-served script: 1 per join, {TABLE_SIZE} per table)")
+    mm.waiting.clear()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--host', default='localhost')
+    parser.add_argument('--port', type=int, default=6379)
+    parser.add_argument('--db', type=int, default=15)
+    parser.add_argument('--clients', type=int, default=64)
+    parser.add_argument('--joins', type=int, default=20000)
+    parser.add_argument('--queued', type=int, default=10000,
+                        help='players parked in the matchmaking queue')
+    parser.add_argument('--rate', type=float, default=2000, help='matchmaking joins per second')
+    parser.add_argument('--seconds', type=float, default=5)
+    parser.add_argument('--fake', action='store_true', help='use fakeredis instead of a server')
+    args = parser.parse_args()
+
+    if args.fake:
+        import fakeredis
+        server = fakeredis.FakeServer()
+
+        def connect():
+            return fakeredis.FakeRedis(server=server)
+
+        def connect_async():
+            return fakeredis.FakeAsyncRedis(server=server)
+    else:
+        def connect():
+            return redis.Redis(host=args.host, port=args.port, db=args.db)
+
+        def connect_async():
+            return redis.asyncio.Redis(host=args.host, port=args.port, db=args.db)
+
+    admin = connect()
+
+    def legacy_lobby():
+        client = connect()
+        return lambda username: legacy_assign(client, username)
+
+    def scripted_lobby():
+        script = connect().register_script(ASSIGN_PLAYER_LUA)
+        return lambda username: scripted_assign(script, username)
+
+    def legacy_queue():
+        client = connect()
+        return lambda player_id: legacy_enqueue(client, player_id)
+
+    def scripted_queue():
+        script = connect().register_script(ENQUEUE_LUA)
+        return lambda player_id: scripted_enqueue(script, player_id)
+
+    print("lobby.assign_player_to_room")
+    for name, factory in (('legacy', legacy_lobby), ('lua script', scripted_lobby)):
+        admin.flushdb()
+        run(name, factory, args.clients, args.joins)
+        print(f"{'':<18} overfilled rooms: {check_rooms(admin)}")
+
+    print("first-come-first-served queue")
+    for name, factory in (('legacy', legacy_queue), ('lua script', scripted_queue)):
+        admin.flushdb()
+        tables = run(name, factory, args.clients, args.joins)
+        bad = sum(1 for t in tables if len(t) != TABLE_SIZE)
+        print(f"{'':<18} tables: {len(tables)}, wrong size: {bad}")
+
+    admin.flushdb()
+    print("Matchmaker.tick")
+    asyncio.run(matchmaker_run(RedisStore(client=connect_async()), args.queued,
+                               args.rate, args.seconds))
+    admin.flushdb()
+
+
+if __name__ == '__main__':
+    main()
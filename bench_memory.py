@@ -0,0 +1,107 @@
+# bench_memory.py
+"""Bytes per idle connection and per active table, measured with tracemalloc.
+
+Builds N sessions the way server.py does: a Player per connection with a
+username freshly decoded from a JSON frame, so equal names start out as
+separate strings. It compares the old layout (plain dataclass, runtime
+``current_room`` attribute, names not interned) with the slotted Player.
+Tables add the room list, a dealt HokmGame and the RoomSync with resume
+tokens; the old layout also gives each game its own random.Random.
+Websocket objects are not counted; they are the same either way.
+
+    python bench_memory.py --sessions 10000 100000
+"""
+import argparse
+import gc
+import json
+import random
+import tracemalloc
+import uuid
+from dataclasses import dataclass
+from typing import Optional
+
+from engine import HokmGame
+from player import Player
+from statesync import RoomSync
+
+NAMES = [f"player{i}" for i in range(2000)]  # realistic names repeat a lot
+
+
+@dataclass
+class LegacyPlayer:
+    player_id: str
+    wsconnection: object
+    username: Optional[str] = None
+    currentgame: Optional[str] = None
+    hand: int = 0
+    isready: bool = False
+    is_bot: bool = False
+
+
+def decoded_name(rng) -> str:
+    # json.loads builds a new str per frame, like the real handler
+    return json.loads(json.dumps({'username': rng.choice(NAMES)}))['username']
+
+
+def legacy_session(rng):
+    player = LegacyPlayer(player_id=str(uuid.uuid4()), wsconnection=None,
+                          username=decoded_name(rng))
+    player.current_room = None
+    return player
+
+
+def slotted_session(rng):
+    return Player(player_id=str(uuid.uuid4()), wsconnection=None, username=decoded_name(rng))
+
+
+def build_table(make_session, rng, code, own_rng):
+    players = [make_session(rng) for _ in range(4)]
+    for seat, player in enumerate(players):
+        player.current_room = code
+        if hasattr(player, 'seat'):
+            player.seat = seat
+    game = HokmGame()
+    game.start_hand()
+    for seat, player in enumerate(players):
+        player.hand = game.hands[seat]
+    sync = RoomSync()
+    sync.record([])
+    for seat, player in enumerate(players):
+        sync.issue_token(seat, player.username)
+    if own_rng:
+        # Before, every game carried its own random.Random
+        return players, game, sync, random.Random()
+    return players, game, sync
+
+
+def measure(build, n: int) -> float:
+    """Average traced bytes per object built."""
+    rng = random.Random(0)
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    kept = [build(rng, i) for i in range(n)]
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del kept
+    return (after - before) / n
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sessions', type=int, nargs='+', default=[10000, 100000])
+    args = parser.parse_args()
+
+    print(f"{'sessions':>9}{'kind':>8}{'legacy B':>11}{'slotted B':>11}{'saved':>8}")
+    for n in args.sessions:
+        idle = [measure(lambda rng, i: make(rng), n)
+                for make in (legacy_session, slotted_session)]
+        tables = [measure(lambda rng, i: build_table(make, rng, str(i), own_rng), n // 4)
+                  for make, own_rng in ((legacy_session, True), (slotted_session, False))]
+        for kind, (legacy, slotted) in (('idle', idle), ('table', tables)):
+            print(f"{n:>9}{kind:>8}{legacy:>11,.0f}{slotted:>11,.0f}"
+                  f"{1 - slotted / legacy:>8.0%}")
+
+
+if __name__ == '__main__':
+    main()
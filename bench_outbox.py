@@ -0,0 +1,109 @@
+# bench_outbox.py
+"""Latency for fast players sharing a room with a slow link, and flood cost.
+
+A table of in-process fake sockets: three read instantly and one takes
+--slow-ms to accept each frame (a congested link, where websocket.send
+waits for the buffer to drain). Moves are made every --interval-ms, each
+broadcast as it would be by the server, and the fast sockets record when
+each frame reaches them. "awaited" is the old path, which gathered every
+send before the next move; "outbox" queues frames per connection.
+
+It also feeds one connection a flood of frames and times the handling with
+and without the token bucket in front of the decoder.
+
+    python bench_outbox.py --moves 200 --slow-ms 200
+"""
+import argparse
+import asyncio
+import time
+
+import flowcontrol
+from engine import HokmGame
+from loadgen import percentiles
+from network import NetworkManager
+from protocol import JSON
+
+
+class FakeSocket:
+    subprotocol = None
+    remote_address = ('127.0.0.1', 0)
+
+    def __init__(self, delay: float):
+        self.delay = delay
+        self.received = []  # (perf_counter, seq) per frame
+
+    async def send(self, frame):
+        if self.delay:
+            await asyncio.sleep(self.delay)
+        self.received.append((time.perf_counter(), JSON.decode(frame).get('seq')))
+
+    async def close(self, code=1000, reason=''):
+        pass
+
+
+async def awaited_broadcast(connections, message_type, data, per_recipient):
+    # The previous NetworkManager.broadcast: encode, then wait for every send
+    frames = [JSON.encode(message_type, dict(data, **extra)) for extra in per_recipient]
+    await asyncio.gather(*(ws.send(f) for ws, f in zip(connections, frames)),
+                         return_exceptions=True)
+
+
+async def play(mode: str, moves: int, interval: float, slow: float):
+    sockets = [FakeSocket(0), FakeSocket(0), FakeSocket(0), FakeSocket(slow)]
+    game = HokmGame(seed=1)
+    events = game.start_hand()
+    made = {}
+    start = time.perf_counter()
+    for seq in range(1, moves + 1):
+        # Moves are due on a fixed clock; a late broadcast delays later ones
+        due = start + seq * interval
+        await asyncio.sleep(max(0.0, due - time.perf_counter()))
+        made[seq] = due
+        if mode == 'awaited':
+            await awaited_broadcast(sockets, 'game_update',
+                                    {'room_id': 'bench', 'seq': seq, 'events': events},
+                                    [{'seat': seat} for seat in range(4)])
+        else:
+            await NetworkManager.broadcast_game(sockets, 'bench', game, events, seq)
+    await asyncio.sleep(interval)
+    latencies = [stamp - made[seq] for ws in sockets[:3] for stamp, seq in ws.received]
+    return latencies, len(sockets[0].received), len(sockets[3].received)
+
+
+def flood(frames: int, limited: bool) -> float:
+    frame = JSON.encode('play_card', {'card': 'AS'})
+    bucket = flowcontrol.TokenBucket(rate=flowcontrol.INBOUND_RATE if limited else 0)
+    start = time.perf_counter()
+    for _ in range(frames):
+        if bucket.take():
+            JSON.decode(frame)
+    return (time.perf_counter() - start) / frames
+
+
+async def run(args):
+    interval, slow = args.interval_ms / 1000, args.slow_ms / 1000
+    print(f"{'path':<10}{'fast p50 ms':>12}{'fast p99 ms':>12}{'fast got':>10}{'slow got':>10}")
+    for mode in ('awaited', 'outbox'):
+        flowcontrol.configure(policy=args.policy, limit=args.limit)
+        latencies, fast_got, slow_got = await play(mode, args.moves, interval, slow)
+        p = percentiles(latencies)
+        print(f"{mode:<10}{p['p50_ms']:>12.2f}{p['p99_ms']:>12.2f}"
+              f"{fast_got:>10}{slow_got:>10}")
+    print(f"flood     decode all {flood(args.flood, False) * 1e6:.2f} us/frame, "
+          f"token bucket first {flood(args.flood, True) * 1e6:.2f} us/frame")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--moves', type=int, default=200)
+    parser.add_argument('--interval-ms', type=float, default=20)
+    parser.add_argument('--slow-ms', type=float, default=200)
+    parser.add_argument('--policy', choices=flowcontrol.POLICIES, default=flowcontrol.COALESCE)
+    parser.add_argument('--limit', type=int, default=flowcontrol.OUTBOX_LIMIT)
+    parser.add_argument('--flood', type=int, default=200000)
+    args = parser.parse_args()
+    asyncio.run(run(args))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,70 @@
+# bench_protocol.py
+"""Encode/decode speed and bytes per message for the JSON and binary codecs.
+
+    python bench_protocol.py --n 20000
+"""
+import argparse
+import time
+
+from engine import HokmGame, cards_of, hand_names
+from protocol import BINARY, JSON
+
+
+def sample_messages():
+    game = HokmGame(seed=7)
+    deal = game.start_hand()
+    game.choose_trump(game.hakem, 0)
+    seat = game.turn
+    played = game.play(seat, cards_of(game.legal_moves(seat))[0])
+    names = ['parisa', 'ali', 'sara', 'reza']
+    return {
+        'create_room': {'username': 'parisa'},
+        'join_room': {'username': 'ali', 'room_code': '4821'},
+        'room_joined': {'room_id': '4821', 'player_number': 2, 'total_players': 2},
+        'room_status': {'room_id': '4821', 'total_players': 4, 'usernames': names,
+                        'player_number': 3},
+        'game_start': {'room_id': '4821', 'events': deal, 'state': game.public_state(),
+                       'players': names, 'seat': 1, 'hand': hand_names(game.hands[1])},
+        'game_update': {'room_id': '4821', 'events': played, 'state': game.public_state(),
+                        'seat': 2, 'hand': hand_names(game.hands[2])},
+        'choose_trump': {'suit': 'H'},
+        'play_card': {'card': 'QS'},
+        'error': {'message': 'You must follow suit'},
+    }
+
+
+def rate(func, n):
+    start = time.perf_counter()
+    for _ in range(n):
+        func()
+    return n / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--n', type=int, default=20000)
+    args = parser.parse_args()
+
+    print(f"{'message':<14}{'json B':>8}{'bin B':>8}{'ratio':>7}"
+          f"{'json enc/s':>13}{'bin enc/s':>12}{'json dec/s':>13}{'bin dec/s':>12}")
+    totals = [0, 0]
+    for message_type, data in sample_messages().items():
+        row = []
+        for codec in (JSON, BINARY):
+            frame = codec.encode(message_type, data)
+            assert codec.decode(frame) == dict(type=message_type, **data)
+            row.append((
+                len(frame),
+                rate(lambda: codec.encode(message_type, data), args.n),
+                rate(lambda: codec.decode(frame), args.n),
+            ))
+        (json_len, json_enc, json_dec), (bin_len, bin_enc, bin_dec) = row
+        totals[0] += json_len
+        totals[1] += bin_len
+        print(f"{message_type:<14}{json_len:>8}{bin_len:>8}{json_len / bin_len:>7.1f}"
+              f"{json_enc:>13,.0f}{bin_enc:>12,.0f}{json_dec:>13,.0f}{bin_dec:>12,.0f}")
+    print(f"{'total':<14}{totals[0]:>8}{totals[1]:>8}{totals[0] / totals[1]:>7.1f}")
+
+
+if __name__ == '__main__':
+    main()
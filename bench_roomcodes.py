@@ -0,0 +1,97 @@
+# bench_roomcodes.py
+"""Room code allocate/release cycles and quick-match lookups at high occupancy.
+
+Compares a randint-and-retry loop (the old generator plus the collision
+check it lacked) with RoomCodeAllocator. It also compares a scan over
+``rooms`` with OpenRoomIndex.pick at several occupancy levels.
+
+    python bench_roomcodes.py --cycles 20000
+"""
+import argparse
+import random
+import time
+
+from roomcodes import OpenRoomIndex, RoomCodeAllocator
+
+ROOM_SIZE = 4
+
+
+class RetryAllocator:
+    def __init__(self):
+        self.in_use = set()
+
+    def allocate(self):
+        while True:
+            code = f"{random.randint(1000, 9999)}"
+            if code not in self.in_use:
+                self.in_use.add(code)
+                return code
+
+    def release(self, code):
+        self.in_use.discard(code)
+
+
+def cycle_rate(allocator, occupancy: int, cycles: int) -> float:
+    """Allocate/release pairs per second with ``occupancy`` codes held."""
+    live = [allocator.allocate() for _ in range(occupancy)]
+    start = time.perf_counter()
+    for i in range(cycles):
+        slot = i % len(live)
+        allocator.release(live[slot])
+        live[slot] = allocator.allocate()
+    return cycles / (time.perf_counter() - start)
+
+
+def scan_open(rooms):
+    # What quick match would do without an index
+    best = None
+    for code, players in rooms.items():
+        if len(players) < ROOM_SIZE and (best is None or len(players) > len(rooms[best])):
+            best = code
+    return best
+
+
+def lookup_rates(total_rooms: int, open_fraction: float, lookups: int):
+    rng = random.Random(1)
+    rooms, index = {}, OpenRoomIndex(ROOM_SIZE)
+    for n in range(total_rooms):
+        players = rng.randrange(ROOM_SIZE) if rng.random() < open_fraction else ROOM_SIZE
+        rooms[str(n)] = [None] * players
+        index.update(str(n), players)
+    start = time.perf_counter()
+    for _ in range(lookups):
+        scan_open(rooms)
+    scan = lookups / (time.perf_counter() - start)
+    start = time.perf_counter()
+    for _ in range(lookups):
+        index.pick()
+    indexed = lookups / (time.perf_counter() - start)
+    return scan, indexed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--cycles', type=int, default=20000)
+    parser.add_argument('--lookups', type=int, default=2000)
+    args = parser.parse_args()
+
+    print("allocate+release cycles/s, 4-digit codes (9000)")
+    print(f"{'occupancy':>10}{'retry loop':>14}{'allocator':>14}")
+    for fraction in (0.5, 0.9, 0.99, 0.999):
+        occupancy = int(9000 * fraction)
+        retry = cycle_rate(RetryAllocator(), occupancy, args.cycles)
+        lazy = cycle_rate(RoomCodeAllocator(digits=4), occupancy, args.cycles)
+        print(f"{fraction:>10.1%}{retry:>14,.0f}{lazy:>14,.0f}")
+
+    wide = cycle_rate(RoomCodeAllocator(digits=8), 1_000_000, args.cycles)
+    print(f"\n8-digit codes with 1M held: {wide:,.0f} cycles/s")
+
+    print("\nquick-match lookups/s")
+    print(f"{'rooms':>10}{'open':>8}{'scan':>14}{'index':>14}")
+    for total_rooms in (1000, 10000, 100000):
+        scan, indexed = lookup_rates(total_rooms, 0.1, args.lookups if total_rooms < 100000 else 50)
+        print(f"{total_rooms:>10}{'10%':>8}{scan:>14,.0f}{indexed:>14,.0f}")
+
+
+if __name__ == '__main__':
+    main()
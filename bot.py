@@ -0,0 +1,237 @@
+# bot.py
+"""Server-side Hokm bot using determinized Monte Carlo sampling.
+
+For each decision the bot deals the cards it cannot see to the other seats
+at random (respecting suits they have shown out of), plays every sampled
+world out to the end of the hand with random legal moves, and picks the
+action whose worlds its team won most often. Worlds are simulated in NumPy
+batches until a fixed time budget runs out.
+
+Decisions are CPU bound, so BotPool runs them in worker processes and the
+event loop only ever awaits a future.
+"""
+import asyncio
+import multiprocessing
+import signal
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Optional
+import numpy as np
+
+from engine import (
+    CARD_NAMES, HAND_SIZE, NUM_PLAYERS, STRENGTH, SUITS, TEAM_OF, TRICKS_TO_WIN,
+    HokmGame, cards_of, legal_mask
+)
+
+TIME_BUDGET = 0.05  # seconds per decision
+BATCH_ROWS = 256  # simulated worlds per batch, split across candidate actions
+BOT_WORKERS = 2
+
+STRENGTH_NP = np.array(STRENGTH, dtype=np.int8).reshape(4, 4, 52)  # [trump, lead, card]
+SUIT_OF_NP = np.arange(52) // 13
+SUIT_CARDS_NP = SUIT_OF_NP[None, :] == np.arange(4)[:, None]  # [suit, card]
+
+
+def mask_to_array(mask: int) -> np.ndarray:
+    raw = np.frombuffer(mask.to_bytes(7, 'little'), dtype=np.uint8)
+    return np.unpackbits(raw, bitorder='little')[:52].astype(bool)
+
+
+def bot_view(game: HokmGame, seat: int) -> dict:
+    """Everything ``seat`` is allowed to know, as a picklable dict."""
+    return {
+        'seat': seat,
+        'phase': game.phase,
+        'hand': game.hands[seat],
+        'hakem': game.hakem,
+        'trump': game.trump,
+        'trick': list(game.trick),
+        'trick_leader': game.trick_seats[0] if game.trick_seats else game.turn,
+        'played': game.played,
+        'voids': list(game.voids),
+        'hand_sizes': [h.bit_count() for h in game.hands],
+        'tricks_won': list(game.tricks_won),
+    }
+
+
+def sample_worlds(rng, view: dict, n: int) -> np.ndarray:
+    """Deal the unseen cards to the other seats in ``n`` worlds.
+
+    Returns bool hands of shape (n, 4, 52). Seats that have shown out of a
+    suit get no cards of it unless the deal would otherwise be impossible.
+    """
+    seat = view['seat']
+    hands = np.zeros((n, NUM_PLAYERS, 52), dtype=bool)
+    hands[:, seat] = mask_to_array(view['hand'])
+    seen = view['hand'] | view['played']
+    unseen = np.array([c for c in range(52) if not seen >> c & 1], dtype=np.intp)
+    if not len(unseen):
+        return hands
+
+    taken = np.zeros((n, len(unseen)), dtype=bool)
+    keys = rng.random((n, len(unseen)))
+    others = [s for s in range(NUM_PLAYERS) if s != seat]
+    # Most constrained seats choose first so they are least likely to run dry
+    others.sort(key=lambda s: -view['voids'][s].bit_count())
+    rows = np.arange(n)[:, None]
+    for other in others:
+        count = view['hand_sizes'][other]
+        if not count:
+            continue
+        void_suits = [s for s in range(4) if view['voids'][other] >> s & 1]
+        blocked = np.isin(SUIT_OF_NP[unseen], void_suits)
+        k = keys + blocked * 2.0 + taken * 4.0
+        picks = np.argpartition(k, count - 1, axis=1)[:, :count]
+        taken[rows, picks] = True
+        hands[rows, other, unseen[picks]] = True
+    return hands
+
+
+def rollout(rng, hands: np.ndarray, trump: np.ndarray, leader: np.ndarray,
+            trick: list, first_card: Optional[np.ndarray] = None) -> np.ndarray:
+    """Play every world to the end of the hand with random legal cards.
+
+    ``trump`` and ``leader`` hold one value per world; ``trick`` is the list
+    of cards already on the table (shared by all worlds). Returns tricks
+    taken per team, shape (worlds, 2).
+    """
+    n = hands.shape[0]
+    rows = np.arange(n)
+    tricks = np.zeros((n, 2), dtype=np.int16)
+    table = np.full((n, NUM_PLAYERS), -1, dtype=np.intp)
+    table[:, :len(trick)] = trick
+    position = len(trick)
+    plays = int(hands[0].sum())
+
+    for step in range(plays):
+        seat = (leader + position) % NUM_PLAYERS
+        hand = hands[rows, seat]
+        if step == 0 and first_card is not None:
+            card = first_card
+        else:
+            if position:
+                follow = hand & SUIT_CARDS_NP[SUIT_OF_NP[table[:, 0]]]
+                legal = np.where(follow.any(axis=1)[:, None], follow, hand)
+            else:
+                legal = hand
+            card = np.where(legal, rng.random(legal.shape), -1.0).argmax(axis=1)
+        hands[rows, seat, card] = False
+        table[:, position] = card
+        position += 1
+        if position == NUM_PLAYERS:
+            lead = SUIT_OF_NP[table[:, 0]]
+            strengths = STRENGTH_NP[trump[:, None], lead[:, None], table]
+            leader = (leader + strengths.argmax(axis=1)) % NUM_PLAYERS
+            tricks[rows, leader % 2] += 1
+            position = 0
+    return tricks
+
+
+def score(tricks: np.ndarray, team: int, tricks_won: list) -> np.ndarray:
+    """Hand wins for ``team``, with trick margin as a tie-breaker."""
+    ours = tricks[:, team] + tricks_won[team]
+    theirs = tricks[:, 1 - team] + tricks_won[1 - team]
+    return (ours >= TRICKS_TO_WIN) + 0.01 * (ours - theirs)
+
+
+class Budget:
+    """Stops batching once another batch as long as the last would overrun."""
+
+    def __init__(self, seconds: float):
+        self.last = time.perf_counter()
+        self.deadline = self.last + seconds
+
+    def exhausted(self) -> bool:
+        now = time.perf_counter()
+        batch, self.last = now - self.last, now
+        return now + batch > self.deadline
+
+
+def choose_card(view: dict, budget: float = TIME_BUDGET, rng=None) -> int:
+    rng = rng or np.random.default_rng()
+    clock = Budget(budget)
+    lead = (view['trick'][0] // 13) if view['trick'] else None
+    candidates = cards_of(legal_mask(view['hand'], lead))
+    if len(candidates) == 1:
+        return candidates[0]
+
+    team = TEAM_OF[view['seat']]
+    totals = np.zeros(len(candidates))
+    k = len(candidates)
+    batch = max(1, BATCH_ROWS // k)
+    while True:
+        worlds = sample_worlds(rng, view, batch)
+        # Every candidate is tried in the same sampled worlds
+        hands = np.repeat(worlds, k, axis=0)
+        first = np.tile(np.array(candidates, dtype=np.intp), batch)
+        n = hands.shape[0]
+        tricks = rollout(rng, hands, np.full(n, view['trump']),
+                         np.full(n, view['trick_leader']), view['trick'], first)
+        totals += score(tricks, team, view['tricks_won']).reshape(batch, k).sum(axis=0)
+        if clock.exhausted():
+            break
+    return candidates[int(totals.argmax())]
+
+
+def choose_trump(view: dict, budget: float = TIME_BUDGET, rng=None) -> int:
+    rng = rng or np.random.default_rng()
+    clock = Budget(budget)
+    seat = view['seat']
+    # Before trump the hakem holds five cards and everyone else is still to be dealt
+    deal_view = dict(view, hand_sizes=[HAND_SIZE] * NUM_PLAYERS, played=0,
+                     voids=[0] * NUM_PLAYERS)
+    deal_view['hand_sizes'][seat] = 0
+    team = TEAM_OF[seat]
+    totals = np.zeros(4)
+    batch = BATCH_ROWS // 4
+    while True:
+        worlds = sample_worlds(rng, deal_view, batch)
+        # Whatever the other seats did not get tops the hakem up to thirteen
+        worlds[:, seat] |= ~worlds.any(axis=1)
+
+        hands = np.repeat(worlds, 4, axis=0)
+        trumps = np.tile(np.arange(4), batch)
+        n = hands.shape[0]
+        tricks = rollout(rng, hands, trumps, np.full(n, seat), [])
+        totals += score(tricks, team, [0, 0]).reshape(batch, 4).sum(axis=0)
+        if clock.exhausted():
+            break
+    return int(totals.argmax())
+
+
+def decide(view: dict, budget: float = TIME_BUDGET) -> dict:
+    """Return the client message the bot would send for this view."""
+    if view['phase'] == 'trump':
+        return {'type': 'choose_trump', 'suit': SUITS[choose_trump(view, budget)]}
+    return {'type': 'play_card', 'card': CARD_NAMES[choose_card(view, budget)]}
+
+
+def ignore_interrupt():
+    """Pool processes leave when the pool shuts down, not on a terminal's Ctrl-C."""
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+
+class BotPool:
+    """Runs bot decisions in worker processes, off the event loop."""
+
+    def __init__(self, workers: int = BOT_WORKERS, budget: float = TIME_BUDGET):
+        self.workers = workers
+        self.budget = budget
+        self.executor = None
+
+    async def decide(self, view: dict) -> dict:
+        if self.executor is None:
+            # Not forked from the server: a fork would copy its listening
+            # sockets and any lock another thread holds at that moment
+            method = ('forkserver' if 'forkserver' in multiprocessing.get_all_start_methods()
+                      else 'spawn')
+            self.executor = ProcessPoolExecutor(max_workers=self.workers,
+                                                mp_context=multiprocessing.get_context(method),
+                                                initializer=ignore_interrupt)
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, decide, view, self.budget)
+
+    def shutdown(self):
+        if self.executor is not None:
+            self.executor.shutdown(wait=False, cancel_futures=True)
+            self.executor = None
@@ -1,174 +1,464 @@
 # client.py
+"""Hokm client: an asyncio core for people, bots and load tools, plus a CLI.
+
+HokmClient owns one connection and one task. That task reads every frame
+as it arrives, keeps the seat's GameView current (asking for a ``sync``
+when it sees a gap) and hands each message to the handlers registered
+with ``on()`` and to any ``wait_for()`` callers. Nothing in it blocks, so
+thousands of clients can share one event loop; there are no threads.
+
+When the connection drops the client reconnects by itself, after a full
+jitter exponential backoff (a random wait up to RECONNECT_BASE * 2^n,
+capped at RECONNECT_MAX) so a restarted server is not hit by every client
+at once. n counts failed attempts in a row, and a session dropped within
+HEALTHY_AFTER seconds of the server taking it counts as one. Seated in a
+game it sends ``resume`` with its token and last seq; waiting in a room
+it sends the join again. ``close()`` stops it.
+
+``on_turn`` is called whenever it is this seat's turn to choose trump or
+play; a bot returns the action to send, the CLI prompts the user:
+
+    client = HokmClient(uri, 'bot1', on_turn=lambda c: choose_action(c.view))
+    client.start()
+    await client.create_room()
+
+The CLI reads stdin through the event loop, so room updates and game
+events are printed while a prompt is waiting.
+
+    python client.py [--json] [--uri ws://localhost:8765]
+"""
 import asyncio
-import websockets
-import json
+import os
+import random
 import sys
+from typing import Callable, Dict, List, Optional, Tuple
+
+import websockets
+
+from protocol import JSON_SUBPROTOCOL, SUBPROTOCOLS, codec_for
+from statesync import GameView
 
 SERVER_URI = "ws://localhost:8765"
+RECONNECT_BASE = 0.5  # seconds; the first retry waits up to this long
+RECONNECT_MAX = 30.0  # seconds; the longest a retry waits
+HEALTHY_AFTER = 10.0  # seconds a session must last before failures are forgotten
+POLICY_CLOSE = 1008  # the server closed us on purpose (rate limit): do not come back
 
-class RoomManager:
-    def __init__(self, websocket, username):
-        self.ws = websocket
+
+class HokmClient:
+    def __init__(self, uri: str, username: str, subprotocols: List[str] = SUBPROTOCOLS,
+                 on_turn: Callable[['HokmClient'], Optional[Tuple[str, dict]]] = None,
+                 reconnect: bool = True, max_retries: Optional[int] = None):
+        self.uri = uri
         self.username = username
+        self.subprotocols = list(subprotocols)
+        self.on_turn = on_turn
+        self.reconnect = reconnect
+        self.max_retries = max_retries  # None retries forever
+        self.ws = None
+        self.connected = asyncio.Event()
+        self.closed = False
+        self.task: Optional[asyncio.Task] = None
+        self.handlers: Dict[str, List[Callable]] = {}
+        self.waiters: List[Tuple[Tuple[str, ...], asyncio.Future]] = []
+        # Where we are, to get back there after a reconnect
+        self.entry: Optional[dict] = None  # create_room / join_room last sent
+        self.room_id: Optional[str] = None
+        self.resume_token: Optional[str] = None
+        self.view = GameView()
+        self.acted = -1  # seq of the last state we acted on
+        self.reconnects = 0
+        self.settled: Optional[float] = None  # loop time the server took the session
+
+    def on(self, message_type: str, handler: Callable[[dict], None]):
+        """Call ``handler(message)`` for every message of this type (``'*'``: all)."""
+        self.handlers.setdefault(message_type, []).append(handler)
+
+    async def wait_for(self, *message_types: str) -> dict:
+        """The next message of one of these types."""
+        future = asyncio.get_running_loop().create_future()
+        self.waiters.append((message_types, future))
+        return await future
+
+    def start(self) -> asyncio.Task:
+        if self.task is None:
+            self.task = asyncio.get_running_loop().create_task(self._run())
+        return self.task
+
+    async def close(self):
+        self.closed = True
+        if self.ws is not None:
+            await self.ws.close()
+        if self.task is not None:
+            await asyncio.gather(self.task, return_exceptions=True)
+
+    async def send(self, message_type: str, data: dict = None):
+        """Send once connected; frames sent while reconnecting wait for it."""
+        await self.connected.wait()
+        try:
+            await self.ws.send(codec_for(self.ws).encode(message_type, data or {}))
+        except websockets.ConnectionClosed:
+            pass  # the receive task reconnects and restores the session
+
+    async def create_room(self):
+        await self._enter({'type': 'create_room', 'username': self.username})
+
+    async def join_room(self, room_code: str):
+        await self._enter({'type': 'join_room', 'username': self.username,
+                           'room_code': room_code})
+
+    async def _enter(self, entry: dict):
+        self.entry = entry
+        self.room_id = self.resume_token = None
+        if self.connected.is_set():
+            entry = dict(entry)
+            await self.send(entry.pop('type'), entry)
+        # Otherwise the connection sends it first thing, see _restore()
+
+    # Connection
+
+    async def _run(self):
+        failures = 0  # connections in a row that failed or did not last
+        loop = asyncio.get_running_loop()
+        while not self.closed:
+            try:
+                self.ws = await websockets.connect(self.uri, subprotocols=self.subprotocols)
+            except (OSError, websockets.InvalidHandshake, asyncio.TimeoutError) as e:
+                failures += 1
+                if not await self._backoff(failures, repr(e)):
+                    break
+                continue
+            self.settled = None
+            try:
+                entry = await self._restore()
+                self.connected.set()
+                if self.entry is not entry and self.resume_token is None:
+                    await self._enter(self.entry)  # entered while we were restoring
+                async for frame in self.ws:
+                    await self._receive(codec_for(self.ws).decode(frame))
+            except websockets.ConnectionClosed:
+                pass
+            except ValueError:
+                # A frame we cannot read: start over on a new connection
+                await self.ws.close(1007, 'Malformed message')
+            finally:
+                self.connected.clear()
+            if self.ws.close_code == POLICY_CLOSE or not self.reconnect:
+                self.closed = True
+            if self.closed:
+                break
+            self.reconnects += 1
+            self._dispatch({'type': 'reconnecting', 'code': self.ws.close_code})
+            # Only a session the server took and kept for a while clears the
+            # count, so one that accepts and drops us at once is backed off too
+            if self.settled is not None and loop.time() - self.settled >= HEALTHY_AFTER:
+                failures = 0
+            else:
+                failures += 1
+            # Even a clean drop backs off, so a server shedding load is not
+            # reconnected to in a burst
+            if not await self._backoff(failures, f'closed with {self.ws.close_code}'):
+                break
+        self._dispatch({'type': 'closed'})
+
+    async def _backoff(self, failures: int, reason: str) -> bool:
+        """Wait before the next attempt; False once max_retries is used up."""
+        if not self.reconnect or (self.max_retries is not None
+                                  and failures > self.max_retries):
+            self.closed = True
+            self._dispatch({'type': 'disconnected', 'reason': reason})
+            return False
+        await asyncio.sleep(random.uniform(0, min(RECONNECT_MAX,
+                                                  RECONNECT_BASE * 2 ** failures)))
+        return True
+
+    async def _restore(self) -> Optional[dict]:
+        """First frame on a new connection: take the seat back, or (re-)enter a room.
+
+        Returns the entry that was sent for.
+        """
+        entry = self.entry
+        if self.resume_token is not None:
+            message = {'room_id': self.room_id, 'resume_token': self.resume_token,
+                       'last_seq': self.view.seq}
+            await self.ws.send(codec_for(self.ws).encode('resume', message))
+        elif entry is not None:
+            message = dict(entry)
+            if self.room_id is not None:
+                # Rejoin the room we were waiting in rather than create another
+                message = {'type': 'join_room', 'username': self.username,
+                           'room_code': self.room_id}
+            await self.ws.send(codec_for(self.ws).encode(message.pop('type'), message))
+        return entry
+
+    # Messages
+
+    async def _receive(self, message: dict):
+        kind = message.get('type')
+        if kind in ('room_joined', 'game_start', 'resumed') and self.settled is None:
+            self.settled = asyncio.get_running_loop().time()
+        if kind in ('room_joined', 'room_status'):
+            self.room_id = message.get('room_id', self.room_id)
+        elif kind == 'game_start':
+            self.room_id = message['room_id']
+            self.resume_token = message.get('resume_token', self.resume_token)
+            self.view = GameView(message['seat'])
+            self.acted = -1
+            self.view.load_snapshot(message['seq'], message['state'], message.get('hand'))
+        elif kind == 'game_update':
+            if not self.view.apply(message['seq'], message['events'], message.get('hand')):
+                await self.send('sync', {'last_seq': self.view.seq})
+        elif kind in ('resumed', 'sync'):
+            self.view.seat = message.get('seat', self.view.seat)
+            if 'state' in message:
+                self.view.load_snapshot(message['seq'], message['state'], message.get('hand'))
+            else:
+                for delta in message.get('deltas', ()):
+                    self.view.apply(delta['seq'], delta['events'])
+                if 'hand' in message:
+                    self.view.hand = list(message['hand'])
+        elif kind == 'error' and message.get('message') == 'Session expired.':
+            self.resume_token = None
+        self._dispatch(message)
+        await self._act()
+
+    def _dispatch(self, message: dict):
+        kind = message.get('type')
+        for handler in self.handlers.get(kind, []) + self.handlers.get('*', []):
+            handler(message)
+        if self.waiters:
+            waiting = []
+            for types, future in self.waiters:
+                if future.done():
+                    continue
+                if kind in types:
+                    future.set_result(message)
+                else:
+                    waiting.append((types, future))
+            self.waiters = waiting
+
+    def my_turn(self) -> bool:
+        state = self.view.state
+        return (state.get('turn') == self.view.seat
+                and state.get('phase') in ('trump', 'play') and self.acted != self.view.seq)
+
+    async def _act(self):
+        if self.on_turn is None or not self.my_turn():
+            return
+        action = self.on_turn(self)
+        if action is not None:
+            self.acted = self.view.seq
+            await self.send(*action)
+
+
+# Command line
+
+MENU = object()  # queued instead of a line when the room flow needs the user
 
-    async def show_room_options(self):
+
+class ConsoleInput:
+    """Lines from stdin, read by the event loop rather than a blocking input()."""
+
+    def __init__(self):
+        self.lines: asyncio.Queue = asyncio.Queue()  # str, MENU, or None at the end
+        self.partial = b''
+        loop = asyncio.get_running_loop()
+        try:
+            loop.add_reader(sys.stdin.fileno(), self._readable)
+        except (NotImplementedError, ValueError):
+            # No selector support for stdin (Windows): a reader thread instead
+            loop.run_in_executor(None, self._read_blocking, loop)
+
+    def _readable(self):
+        # os.read, not sys.stdin: its buffer would hide lines from the selector
+        chunk = os.read(sys.stdin.fileno(), 4096)
+        if not chunk:
+            asyncio.get_running_loop().remove_reader(sys.stdin.fileno())
+            if self.partial:
+                self.lines.put_nowait(self.partial.decode(errors='replace'))
+            self.lines.put_nowait(None)
+            return
+        *lines, self.partial = (self.partial + chunk).split(b'\n')
+        for line in lines:
+            self.lines.put_nowait(line.decode(errors='replace').rstrip('\r'))
+
+    def _read_blocking(self, loop):
+        for line in sys.stdin:
+            loop.call_soon_threadsafe(self.lines.put_nowait, line.rstrip('\n'))
+        loop.call_soon_threadsafe(self.lines.put_nowait, None)
+
+    async def ask(self, prompt: str) -> str:
+        print(prompt, end='', flush=True)
+        line = await self.lines.get()
+        while line is MENU:  # already in the menu
+            line = await self.lines.get()
+        if line is None:
+            raise EOFError
+        return line.strip()
+
+
+class RoomManager:
+    def __init__(self, client: HokmClient, console: ConsoleInput):
+        self.client = client
+        self.console = console
+
+    async def ask_room_code(self) -> Optional[str]:
+        # The server's code width is configurable: it checks the code itself
+        room_code = (await self.console.ask("Enter the room code: ")).upper()
+        if not room_code.isalnum():
+            print("Room code must be letters and digits.")
+            return None
+        return room_code
+
+    async def show_room_options(self) -> bool:
+        """Join another room or create one; False if the user chose to exit."""
         while True:
             print("\nWould you like to:")
             print("1. Try another room code")
             print("2. Create a new room")
             print("3. Exit")
-            choice = input("Enter your choice (1-3): ").strip()
+            choice = await self.console.ask("Enter your choice (1-3): ")
             if choice == '1':
-                room_code = input("Enter the 4-character room code: ").strip().upper()
-                if len(room_code) != 4:
-                    print("Room code must be 4 characters.")
+                room_code = await self.ask_room_code()
+                if room_code is None:
                     continue
-                msg = {
-                    "type": "join_room",
-                    "username": self.username,
-                    "room_code": room_code
-                }
-                await self.ws.send(json.dumps(msg))
-                return "join_room", room_code
+                await self.client.join_room(room_code)
+                return True
             elif choice == '2':
-                msg = {
-                    "type": "create_room",
-                    "username": self.username
-                }
-                await self.ws.send(json.dumps(msg))
-                return "create_room", None
+                await self.client.create_room()
+                return True
             elif choice == '3':
                 print("Exiting.")
-                return None, None
+                return False
             else:
                 print("Invalid choice. Please try again.")
 
-    async def handle_room_full(self):
-        print("\nWould you like to:")
-        print("1. Try another room code")
-        print("2. Create a new room")
-        print("3. Exit")
-        choice = input("Enter your choice (1-3): ").strip()
-        if choice == '1':
-            room_code = input("Enter the 4-character room code: ").strip().upper()
-            if len(room_code) != 4:
-                print("Room code must be 4 characters.")
+    async def get_room_code(self) -> bool:
+        has_room = (await self.console.ask("Do you have a room code? (y/n): ")).lower()
+        if has_room == 'y':
+            room_code = await self.ask_room_code()
+            if room_code is None:
                 return await self.show_room_options()
-            msg = {
-                "type": "join_room",
-                "username": self.username,
-                "room_code": room_code
-            }
-            await self.ws.send(json.dumps(msg))
-            return "join_room", room_code
-        elif choice == '2':
-            msg = {
-                "type": "create_room",
-                "username": self.username
-            }
-            await self.ws.send(json.dumps(msg))
-            return "create_room", None
-        elif choice == '3':
-            print("Exiting.")
-            return None, None
+            await self.client.join_room(room_code)
         else:
-            print("Invalid choice. Please try again.")
-            return await self.show_room_options()
+            await self.client.create_room()
+        return True
 
-    async def get_room_code(self):
-        has_room = input("Do you have a room code? (y/n): ").strip().lower()
-        if has_room == 'y':
-            room_code = input("Enter the 4-character room code: ").strip().upper()
-            if len(room_code) != 4:
-                print("Room code must be 4 characters.")
-                return await self.show_room_options()
-            return "join_room", room_code
+
+def print_room_status(data: dict, username: str):
+    print("\nCurrent players in room [{}]:".format(data['room_id']))
+    for idx, name in enumerate(data['usernames']):
+        marker = " (You)" if name == username else ""
+        print(f"Player {idx+1}: {name}{marker}")
+    print(f"Players in room: {data['total_players']}/4\n")
+    waiting = 4 - data['total_players']
+    if waiting > 0:
+        print(f"Waiting for {waiting} other players to join...")
+
+
+def print_events(data: dict):
+    print("  " + ", ".join(
+        f"{e['event']} {e.get('card') or e.get('suit') or e.get('team', '')}".rstrip()
+        for e in data['events']
+    ))
+
+
+class TurnPrompt:
+    """on_turn for a person: tell them once per turn, the reply comes from stdin."""
+
+    def __init__(self):
+        self.prompted = -1
+
+    def __call__(self, client: HokmClient):
+        if self.prompted == client.view.seq:
+            return None
+        self.prompted = client.view.seq
+        state = client.view.state
+        print(f"\nYour hand: {' '.join(client.view.hand)}")
+        if state['phase'] == 'trump':
+            print("You are the hakem. Choose trump (S, H, D or C):")
         else:
-            return "create_room", None
+            print(f"Trump {state['trump']}, on the table: {' '.join(state['trick']) or '-'}. "
+                  "Play a card:")
+        return None
+
+    def again(self):
+        self.prompted = -1
+
 
 async def main():
+    subprotocols = [JSON_SUBPROTOCOL] if "--json" in sys.argv else SUBPROTOCOLS
+    uri = sys.argv[sys.argv.index("--uri") + 1] if "--uri" in sys.argv else SERVER_URI
+    console = ConsoleInput()
     print("Welcome to Hokm!")
-    username = input("Enter your username: ").strip()
+    try:
+        username = await console.ask("Enter your username: ")
+    except EOFError:
+        return
     if not username:
         print("Username cannot be empty.")
         return
 
+    prompt = TurnPrompt()
+    client = HokmClient(uri, username, subprotocols, on_turn=prompt)
+    room_manager = RoomManager(client, console)
+
+    def on_error(data):
+        print("Error:", data.get('message'))
+        if "Room does not exist" in data.get('message', ''):
+            console.lines.put_nowait(MENU)
+        elif client.view.state.get('phase') in ('trump', 'play'):
+            # The move was refused: it is still our turn
+            client.acted = -1
+            prompt.again()
+
+    def on_room_full(data):
+        print(data.get('message'))
+        console.lines.put_nowait(MENU)
+
+    client.on('room_status', lambda data: print_room_status(data, username))
+    client.on('game_start', lambda data: print("Room is full, ready to play!"))
+    client.on('game_update', print_events)
+    client.on('error', on_error)
+    client.on('room_full', on_room_full)
+    client.on('reconnecting', lambda data: print("\nConnection lost, reconnecting..."))
+    client.on('resumed', lambda data: print("Reconnected to your seat."))
+    client.on('disconnected', lambda data: print(
+        "\nCould not connect to server. Please make sure the server is running."))
+    client.on('closed', lambda data: console.lines.put_nowait(None))
+    client.start()
+
     try:
-        async with websockets.connect(SERVER_URI) as ws:
-            room_manager = RoomManager(ws, username)
-            
-            while True:
-                action, room_code = await room_manager.get_room_code()
-                if action is None:
+        if not await room_manager.get_room_code():
+            return
+        while True:
+            line = await console.lines.get()
+            if line is None:
+                return
+            if line is MENU:
+                if not await room_manager.show_room_options():
                     return
-
-                # Send join/create message
-                msg = {
-                    "type": action,
-                    "username": username,
-                }
-                if room_code:
-                    msg["room_code"] = room_code
-                await ws.send(json.dumps(msg))
-
-                while True:
-                    try:
-                        msg = await ws.recv()
-                        data = json.loads(msg)
-                        if data.get('type') == 'room_status':
-                            print("\nCurrent players in room [{}]:".format(data['room_id']))
-                            for idx, name in enumerate(data['usernames']):
-                                marker = " (You)" if name == username else ""
-                                print(f"Player {idx+1}: {name}{marker}")
-                            print(f"Players in room: {data['total_players']}/4\n")
-                            waiting = 4 - data['total_players']
-                            if waiting > 0:
-                                print(f"Waiting for {waiting} other players to join...")
-                        elif data.get('type') == 'game_start':
-                            print("Room is full, ready to play!")
-                        elif data.get('type') == 'error':
-                            print("Error:", data.get('message'))
-                            if "Room does not exist" in data.get('message', ''):
-                                action, room_code = await room_manager.show_room_options()
-                                if action is None:
-                                    return
-                                if action == "create_room":
-                                    msg = {
-                                        "type": action,
-                                        "username": username
-                                    }
-                                    await ws.send(json.dumps(msg))
-                                break
-                        elif data.get('type') == 'room_joined':
-                            pass  # Ignore this message
-                        elif data.get('type') == 'room_full':
-                            print(data.get('message'))
-                            action, room_code = await room_manager.handle_room_full()
-                            if action is None:
-                                return
-                            if action == "create_room":
-                                msg = {
-                                    "type": action,
-                                    "username": username
-                                }
-                                await ws.send(json.dumps(msg))
-                            break
-                        else:
-                            print("Server:", data)
-                    except websockets.ConnectionClosed:
-                        print("\nServer is not available. Please make sure the server is running.")
-                        sys.exit(1)
-                    except websockets.exceptions.ConnectionRefused:
-                        print("\nCould not connect to server. Please make sure the server is running.")
-                        sys.exit(1)
-    except KeyboardInterrupt:
+                continue
+            line = line.strip().upper()
+            if not line or not client.view.state:
+                continue
+            if not client.my_turn():
+                print("Not your turn.")
+                continue
+            client.acted = client.view.seq
+            if client.view.state['phase'] == 'trump':
+                await client.send('choose_trump', {'suit': line})
+            else:
+                await client.send('play_card', {'card': line})
+    except EOFError:
+        pass
+    finally:
         print("\nClient exited.")
-    except websockets.exceptions.ConnectionRefused:
-        print("\nCould not connect to server. Please make sure the server is running.")
-        sys.exit(1)
-    except Exception as e:
-        print(f"\nAn error occurred: {str(e)}")
-        sys.exit(1)
+        await client.close()
+
 
 if __name__ == "__main__":
-    asyncio.run(main())
+    try:
+        asyncio.run(main())
+    except KeyboardInterrupt:
+        print("\nClient exited.")
@@ -0,0 +1,530 @@
+# cluster.py
+"""Run several server workers behind one port with room-affinity routing.
+
+Every worker listens on the same port (SO_REUSEPORT), so the kernel spreads
+connections across them, but each room lives on exactly one worker: the
+one whose id equals ``room_code % total_workers``. When a connection's
+first message joins or resumes a room owned by another worker, the
+accepting worker tunnels the connection to the owner over a message bus.
+The owner then runs the normal ``server.handle_connection`` on a
+RemoteConnection, so broadcasts and game updates reach remote players
+without any change to the game code.
+
+Spectators are not tunnelled: they stay on the worker that accepted them,
+which reports its viewer count to the owner, and the owner relays each
+public frame once per watching worker (see spectators.py).
+
+The bus is either a local unix-socket broker run by the supervisor (one
+host, no dependencies) or Redis pub/sub (several hosts).
+
+SIGTERM or Ctrl-C to the supervisor drains every worker (see handoff.py),
+waiting up to STOP_TIMEOUT, and only then stops the local broker.
+
+    python cluster.py --workers 4 --port 8765
+    python cluster.py --workers 4 --bus redis --first-worker 4 --total-workers 8
+"""
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import signal
+import struct
+import time
+import uuid
+from typing import Callable, Dict
+
+import websockets
+
+import flowcontrol
+import handoff
+import metrics
+import server
+import spectators
+from network import NetworkManager
+from protocol import SUBPROTOCOLS, codec_for
+from timerwheel import IdleTimer
+
+BUS_SOCKET = '/tmp/hokm-bus.sock'
+CHANNEL_PREFIX = 'hokm:worker:'
+STOP_TIMEOUT = 30.0  # seconds workers get to drain on shutdown before they are killed
+
+# Envelope ops
+OP_OPEN, OP_TEXT, OP_BINARY, OP_CLOSE = b'O', b'T', b'B', b'C'
+# Spectator ops; the envelope's connection id is the room code
+OP_WATCH, OP_VIEW = b'W', b'V'  # edge -> owner viewer count, owner -> edge public frame
+
+
+def worker_channel(worker_id: int) -> str:
+    return f"{CHANNEL_PREFIX}{worker_id}"
+
+
+def owner_of(room_code, total_workers: int):
+    """Worker that owns a room, or None if the code is not a room code."""
+    try:
+        return int(room_code) % total_workers
+    except (TypeError, ValueError):
+        return None
+
+
+def pack(op: bytes, conn_id: str, payload: bytes = b'') -> bytes:
+    conn = conn_id.encode()
+    return op + bytes([len(conn)]) + conn + payload
+
+
+def unpack(message: bytes):
+    size = message[1]
+    return message[:1], message[2:2 + size].decode(), message[2 + size:]
+
+
+def frame_envelope(conn_id: str, frame) -> bytes:
+    if isinstance(frame, str):
+        return pack(OP_TEXT, conn_id, frame.encode())
+    return pack(OP_BINARY, conn_id, frame)
+
+
+def close_envelope(conn_id: str, code: int = 1000, reason: str = '') -> bytes:
+    """OP_CLOSE carrying the close code and reason: ``code:u16 reason``."""
+    return pack(OP_CLOSE, conn_id, struct.pack('>H', code) + reason.encode())
+
+
+def close_args(payload: bytes):
+    """Code and reason from an OP_CLOSE payload; a bare close is 1000."""
+    if len(payload) < 2:
+        return 1000, ''
+    return struct.unpack('>H', payload[:2])[0], payload[2:].decode(errors='replace')
+
+
+class LocalBusBroker:
+    """Relays published messages to subscribers over a unix socket.
+
+    Wire frames are ``length:u32 op:u8 channel_len:u8 channel payload`` with
+    op S (subscribe), P (publish) and M (delivered message).
+    """
+
+    def __init__(self, path: str = BUS_SOCKET):
+        self.path = path
+        self.subscribers: Dict[str, set] = {}
+
+    async def serve(self):
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+        return await asyncio.start_unix_server(self._client, path=self.path)
+
+    async def _client(self, reader, writer):
+        channels = []
+        try:
+            while True:
+                header = await reader.readexactly(4)
+                body = await reader.readexactly(struct.unpack('>I', header)[0])
+                op, size = body[:1], body[1]
+                channel = body[2:2 + size].decode()
+                if op == b'S':
+                    self.subscribers.setdefault(channel, set()).add(writer)
+                    channels.append(channel)
+                elif op == b'P':
+                    out = header + b'M' + body[1:]
+                    for subscriber in self.subscribers.get(channel, ()):
+                        subscriber.write(out)
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            for channel in channels:
+                self.subscribers.get(channel, set()).discard(writer)
+            writer.close()
+
+
+class LocalBus:
+    """Bus client for LocalBusBroker."""
+
+    def __init__(self, path: str = BUS_SOCKET):
+        self.path = path
+        self.reader = self.writer = None
+        self.listener = None
+
+    async def start(self, channel: str, handler: Callable[[bytes], None]):
+        self.reader, self.writer = await asyncio.open_unix_connection(self.path)
+        self._write(b'S', channel, b'')
+        self.listener = asyncio.create_task(self._listen(handler))
+
+    def _write(self, op: bytes, channel: str, payload: bytes):
+        name = channel.encode()
+        body = op + bytes([len(name)]) + name + payload
+        self.writer.write(struct.pack('>I', len(body)) + body)
+
+    def publish(self, channel: str, payload: bytes):
+        # Writes are buffered by the transport, so ordering is preserved
+        self._write(b'P', channel, payload)
+
+    async def _listen(self, handler):
+        while True:
+            header = await self.reader.readexactly(4)
+            body = await self.reader.readexactly(struct.unpack('>I', header)[0])
+            size = body[1]
+            handler(body[2 + size:])
+
+    async def close(self):
+        if self.listener:
+            self.listener.cancel()
+        if self.writer:
+            self.writer.close()
+
+
+class RedisBus:
+    """Bus over Redis pub/sub, for workers spread over several hosts."""
+
+    def __init__(self, url: str = None):
+        from datastore import REDIS_URL, RedisStore
+        self.store = RedisStore(url=url or REDIS_URL)
+        self.outgoing = asyncio.Queue()
+        self.tasks = []
+
+    async def start(self, channel: str, handler: Callable[[bytes], None]):
+        self.pubsub = self.store.client.pubsub()
+        await self.pubsub.subscribe(channel)
+        self.tasks = [
+            asyncio.create_task(self._listen(handler)),
+            asyncio.create_task(self._flush()),
+        ]
+
+    def publish(self, channel: str, payload: bytes):
+        self.outgoing.put_nowait((channel, payload))
+
+    async def _flush(self):
+        # One sender keeps order; everything queued meanwhile goes in one pipeline
+        while True:
+            batch = [await self.outgoing.get()]
+            while not self.outgoing.empty():
+                batch.append(self.outgoing.get_nowait())
+            pipe = self.store.pipeline()
+            for channel, payload in batch:
+                pipe.publish(channel, payload)
+            await pipe.execute()
+
+    async def _listen(self, handler):
+        async for message in self.pubsub.listen():
+            if message['type'] == 'message':
+                handler(message['data'])
+
+    async def close(self):
+        for task in self.tasks:
+            task.cancel()
+        await self.store.close()
+
+
+class RemoteConnection:
+    """Websocket stand-in for a client connected to another worker."""
+
+    def __init__(self, node: 'ClusterNode', conn_id: str, reply: str,
+                 subprotocol, remote_address):
+        self.node = node
+        self.conn_id = conn_id
+        self.reply = reply
+        self.subprotocol = subprotocol
+        self.remote_address = tuple(remote_address) if remote_address else None
+        self.incoming = asyncio.Queue()
+        self.closed = False
+
+    def feed(self, frame):
+        self.incoming.put_nowait(frame)
+
+    async def recv(self):
+        frame = await self.incoming.get()
+        if frame is None:
+            self.closed = True
+            raise websockets.ConnectionClosedOK(None, None)
+        return frame
+
+    async def __aiter__(self):
+        try:
+            while True:
+                yield await self.recv()
+        except websockets.ConnectionClosedOK:
+            return
+
+    async def send(self, frame):
+        if self.closed:
+            raise websockets.ConnectionClosedOK(None, None)
+        self.node.bus.publish(self.reply, frame_envelope(self.conn_id, frame))
+
+    async def close(self, code: int = 1000, reason: str = ''):
+        if not self.closed:
+            self.closed = True
+            self.node.bus.publish(self.reply, close_envelope(self.conn_id, code, reason))
+            self.incoming.put_nowait(None)
+
+
+class PrefetchedConnection:
+    """Replays an already-read first frame, then delegates to the websocket."""
+
+    def __init__(self, websocket, first):
+        self._websocket = websocket
+        self._first = first
+
+    def __getattr__(self, name):
+        return getattr(self._websocket, name)
+
+    async def recv(self):
+        if self._first is not None:
+            first, self._first = self._first, None
+            return first
+        return await self._websocket.recv()
+
+
+class ClusterNode:
+    """One worker: serves its own rooms and tunnels the rest to their owners."""
+
+    def __init__(self, worker_id: int, total_workers: int, bus):
+        self.worker_id = worker_id
+        self.total_workers = total_workers
+        self.bus = bus
+        self.remotes: Dict[str, RemoteConnection] = {}  # clients tunnelled to us
+        self.tunnels: Dict[str, flowcontrol.Outbox] = {}  # our clients tunnelled away
+
+    async def start(self):
+        server.configure_worker(self.worker_id, self.total_workers)
+        spectators.relay = self.relay_to_viewers
+        spectators.report = self.report_viewers
+        await self.bus.start(worker_channel(self.worker_id), self.on_bus_message)
+
+    def relay_to_viewers(self, worker: int, payload: bytes):
+        self.bus.publish(worker_channel(worker), pack(OP_VIEW, '', payload))
+
+    def report_viewers(self, room_code: str, count: int, snapshot: bool):
+        owner = owner_of(room_code, self.total_workers)
+        body = json.dumps({'worker': self.worker_id, 'count': count, 'snapshot': snapshot})
+        self.bus.publish(worker_channel(owner), pack(OP_WATCH, room_code, body.encode()))
+
+    async def handle_connection(self, websocket, path=None):
+        # Silent clients are closed here too, before and after routing,
+        # so a tunnel never outlives its client's last frame by much
+        idle = IdleTimer(server.IDLE_TIMEOUT, NetworkManager.evict_idle, websocket)
+        try:
+            first = await websocket.recv()
+            await self.route(websocket, first, path, idle)
+        except websockets.ConnectionClosed:
+            pass
+        finally:
+            idle.cancel()
+
+    async def route(self, websocket, first, path, idle: IdleTimer):
+        owner = self.worker_id
+        try:
+            msg = codec_for(websocket).decode(first)
+        except ValueError:
+            msg = {}
+        if msg.get('type') == 'join_room':
+            owner = owner_of(msg.get('room_code'), self.total_workers)
+        elif msg.get('type') == 'resume':
+            owner = owner_of(msg.get('room_id'), self.total_workers)
+        elif msg.get('type') == 'spectate':
+            room_code = msg.get('room_code')
+            if owner_of(room_code, self.total_workers) not in (None, self.worker_id):
+                # Viewers stay here: the owner relays each frame once per worker, not per viewer
+                idle.cancel()  # watch_room keeps its own
+                metrics.CONNECTIONS.inc()
+                try:
+                    await server.watch_room(websocket, str(room_code), remote=True)
+                finally:
+                    metrics.CONNECTIONS.dec()
+                return
+        if owner is None or owner == self.worker_id:
+            idle.cancel()  # serve_player keeps its own
+            await server.handle_connection(PrefetchedConnection(websocket, first), path)
+        else:
+            idle.touch()
+            await self.tunnel(websocket, first, owner, idle)
+
+    async def tunnel(self, websocket, first, owner: int, idle: IdleTimer):
+        conn_id = f"{self.worker_id}-{uuid.uuid4().hex[:12]}"
+        channel = worker_channel(owner)
+        # Frames from the owner are written through the client's own outbox,
+        # so a slow client here is bounded like a local one
+        self.tunnels[conn_id] = flowcontrol.outbox_for(websocket)
+        header = {
+            'reply': worker_channel(self.worker_id),
+            'subprotocol': websocket.subprotocol,
+            'address': list(websocket.remote_address or ())[:2],
+        }
+        self.bus.publish(channel, pack(OP_OPEN, conn_id, json.dumps(header).encode()))
+        self.bus.publish(channel, frame_envelope(conn_id, first))
+        try:
+            async for frame in websocket:
+                idle.touch()
+                self.bus.publish(channel, frame_envelope(conn_id, frame))
+        except websockets.ConnectionClosed:
+            pass
+        finally:
+            self.bus.publish(channel, close_envelope(conn_id))
+            self.tunnels.pop(conn_id, None)
+
+    def on_bus_message(self, message: bytes):
+        op, conn_id, payload = unpack(message)
+        if op == OP_VIEW:
+            spectators.on_relay(payload)
+            return
+        if op == OP_WATCH:
+            self.on_watch(conn_id, json.loads(payload))
+            return
+        frame = payload.decode() if op == OP_TEXT else payload
+
+        # Owner side: frames from a client connected to another worker
+        if op == OP_OPEN:
+            header = json.loads(payload)
+            remote = RemoteConnection(self, conn_id, header['reply'],
+                                      header['subprotocol'], header['address'])
+            self.remotes[conn_id] = remote
+            task = asyncio.create_task(server.handle_connection(remote, None))
+            task.add_done_callback(lambda _: self._remote_done(remote))
+            return
+        remote = self.remotes.get(conn_id)
+        if remote is not None:
+            remote.feed(None if op == OP_CLOSE else frame)
+            return
+
+        # Edge side: frames for a client connected to us
+        outbox = self.tunnels.get(conn_id)
+        if outbox is not None and op == OP_CLOSE:
+            outbox.close(*close_args(payload))
+        elif outbox is not None:
+            # No message type: the owner already counted the frame
+            outbox.put(None, frame)
+
+    def on_watch(self, room_code: str, watch: dict):
+        """Owner side: another worker's viewer count, maybe asking for a snapshot."""
+        spectators.on_report(room_code, watch['worker'], watch['count'])
+        if not watch['snapshot']:
+            return
+        snapshot = server.spectator_snapshot(room_code)
+        if snapshot is None:
+            payload = spectators.relay_payload(room_code, 'error', {
+                'message': 'Room does not exist. Please check the room code.'
+            }, kind=spectators.SNAPSHOT)
+        else:
+            payload = spectators.relay_payload(room_code, 'spectating', snapshot,
+                                               snapshot['seq'], spectators.SNAPSHOT)
+        self.relay_to_viewers(watch['worker'], payload)
+
+    def _remote_done(self, remote: RemoteConnection):
+        self.remotes.pop(remote.conn_id, None)
+        if not remote.closed:
+            remote.closed = True
+            self.bus.publish(remote.reply, close_envelope(remote.conn_id))
+
+
+async def serve_worker(worker_id: int, total_workers: int, host: str, port: int,
+                       bus_kind: str, bus_path: str, redis_url: str, metrics_port: int = None,
+                       handoff_to: str = None):
+    if metrics_port is not None:
+        # One scrape target per worker
+        await metrics.enable(metrics_port + worker_id)
+    bus = LocalBus(bus_path) if bus_kind == 'local' else RedisBus(redis_url)
+    node = ClusterNode(worker_id, total_workers, bus)
+    await node.start()
+    if handoff_to is not None:
+        # A file per worker; in Redis each worker only restores the rooms it owns
+        server.room_handoff = (handoff.RedisHandoff() if handoff_to == 'redis'
+                               else handoff.FileHandoff(f'{handoff_to}.{worker_id}'))
+        await server.load_handoff()
+    async with websockets.serve(node.handle_connection, host, port,
+                                subprotocols=SUBPROTOCOLS, reuse_port=True,
+                                max_size=flowcontrol.MAX_INBOUND_FRAME) as ws_server:
+        print(f"Worker {worker_id}/{total_workers} (pid {os.getpid()}) on ws://{host}:{port}")
+        await server.stop_requested()
+        await server.drain(ws_server)
+
+
+def run_worker(*args):
+    try:
+        asyncio.run(serve_worker(*args))
+    except KeyboardInterrupt:
+        pass
+
+
+async def serve_broker(path: str):
+    broker = LocalBusBroker(path)
+    async with await broker.serve():
+        await asyncio.Future()
+
+
+def run_broker(path: str):
+    # A terminal's Ctrl-C reaches the whole process group; the supervisor
+    # stops the broker itself once the workers have drained over it
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    asyncio.run(serve_broker(path))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run Hokm server workers with room affinity")
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1,
+                        help='worker processes to start on this host')
+    parser.add_argument('--first-worker', type=int, default=0,
+                        help='id of the first worker on this host')
+    parser.add_argument('--total-workers', type=int, default=None,
+                        help='workers across all hosts (default: --workers)')
+    parser.add_argument('--host', default='0.0.0.0')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--bus', choices=('local', 'redis'), default='local')
+    parser.add_argument('--bus-socket', default=BUS_SOCKET)
+    parser.add_argument('--redis-url', default=None)
+    parser.add_argument('--metrics-port', type=int, default=None,
+                        help='worker N serves metrics on this port + N')
+    parser.add_argument('--handoff', default=None,
+                        help="'redis' or a file prefix to hand games in progress to the next "
+                             "run on SIGTERM (default: off)")
+    args = parser.parse_args()
+    total = args.total_workers or args.workers
+
+    broker = None
+    if args.bus == 'local':
+        if os.path.exists(args.bus_socket):
+            os.unlink(args.bus_socket)
+        broker = multiprocessing.Process(target=run_broker, args=(args.bus_socket,),
+                                         daemon=True)
+        broker.start()
+        while not os.path.exists(args.bus_socket):
+            broker.join(0.05)
+
+    workers = [
+        multiprocessing.Process(target=run_worker, args=(
+            worker_id, total, args.host, args.port, args.bus, args.bus_socket, args.redis_url,
+            args.metrics_port, args.handoff
+        ))
+        for worker_id in range(args.first_worker, args.first_worker + args.workers)
+    ]
+    for worker in workers:
+        worker.start()
+    # SIGTERM stops the supervisor as Ctrl-C does; set after the workers are
+    # forked, so they keep their own handlers
+    signal.signal(signal.SIGTERM, signal.default_int_handler)
+    try:
+        for worker in workers:
+            worker.join()
+    except KeyboardInterrupt:
+        # Ctrl-C in a terminal reached the workers already, SIGTERM did not
+        stop_workers(workers)
+    finally:
+        signal.signal(signal.SIGTERM, signal.SIG_IGN)
+        # Draining workers still close tunnelled connections over the bus
+        deadline = time.monotonic() + STOP_TIMEOUT
+        for worker in workers:
+            worker.join(max(0.0, deadline - time.monotonic()))
+        for worker in workers:
+            if worker.is_alive():
+                print(f"Worker pid {worker.pid} did not drain in {STOP_TIMEOUT:g}s, killing it")
+                worker.kill()
+                worker.join()
+        if broker is not None:
+            broker.terminate()
+            broker.join()
+
+
+def stop_workers(workers):
+    """SIGTERM each worker still running; it drains (see server.drain) and exits."""
+    for worker in workers:
+        if worker.is_alive():
+            worker.terminate()
+
+
+if __name__ == '__main__':
+    main()
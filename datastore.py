@@ -0,0 +1,145 @@
+# datastore.py
+"""Shared asyncio Redis access for the websocket servers.
+
+Every handler goes through one RedisStore so all of them share a single
+bounded connection pool, and every command is timed.
+"""
+import time
+from typing import Dict, Optional
+import redis.asyncio as aioredis
+
+import metrics
+
+REDIS_URL = 'redis://localhost:6379/0'
+MAX_CONNECTIONS = 50
+POOL_TIMEOUT = 5  # seconds to wait for a free connection
+
+
+class CommandStats:
+    """Per-command call count and latency, in seconds."""
+
+    def __init__(self):
+        self.calls: Dict[str, int] = {}
+        self.total: Dict[str, float] = {}
+        self.max: Dict[str, float] = {}
+
+    def record(self, name: str, elapsed: float):
+        metrics.REDIS_SECONDS.observe(elapsed, name)
+        self.calls[name] = self.calls.get(name, 0) + 1
+        self.total[name] = self.total.get(name, 0.0) + elapsed
+        if elapsed > self.max.get(name, 0.0):
+            self.max[name] = elapsed
+
+    def summary(self) -> Dict[str, dict]:
+        return {
+            name: {
+                'calls': calls,
+                'avg_ms': self.total[name] / calls * 1000,
+                'max_ms': self.max[name] * 1000,
+            }
+            for name, calls in self.calls.items()
+        }
+
+
+class TimedPipeline:
+    """Non-transactional pipeline whose execute() is recorded as one command."""
+
+    def __init__(self, pipeline, stats: CommandStats):
+        self._pipeline = pipeline
+        self._stats = stats
+
+    def __getattr__(self, name):
+        command = getattr(self._pipeline, name)
+
+        def queue(*args, **kwargs):
+            command(*args, **kwargs)
+            return self
+        return queue
+
+    async def execute(self):
+        start = time.perf_counter()
+        try:
+            return await self._pipeline.execute()
+        finally:
+            self._stats.record('PIPELINE', time.perf_counter() - start)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        await self._pipeline.reset()
+
+
+class RedisStore:
+    """Async Redis client with a bounded pool and per-command latency.
+
+    Any redis command can be awaited directly on the store
+    (``await store.hgetall(key)``). Commands issued together in one handler
+    should be queued on ``store.pipeline()`` so they cost one round trip.
+    """
+
+    def __init__(self, client=None, url: str = REDIS_URL,
+                 max_connections: int = MAX_CONNECTIONS):
+        if client is None:
+            pool = aioredis.BlockingConnectionPool.from_url(
+                url, max_connections=max_connections, timeout=POOL_TIMEOUT
+            )
+            client = aioredis.Redis(connection_pool=pool)
+        self.client = client
+        self.stats = CommandStats()
+        self._scripts = {}
+
+    @classmethod
+    def fake(cls):
+        """In-process store backed by fakeredis, for tests and benchmarks."""
+        import fakeredis
+        return cls(client=fakeredis.FakeAsyncRedis())
+
+    def __getattr__(self, name):
+        command = getattr(self.client, name)
+
+        async def timed(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return await command(*args, **kwargs)
+            finally:
+                self.stats.record(name.upper(), time.perf_counter() - start)
+        return timed
+
+    def pipeline(self) -> TimedPipeline:
+        return TimedPipeline(self.client.pipeline(transaction=False), self.stats)
+
+    def register_script(self, source: str, name: str = 'EVALSHA'):
+        """Register a Lua script once; calls are timed under ``name``."""
+        if source in self._scripts:
+            return self._scripts[source]
+        script = self.client.register_script(source)
+
+        async def run(keys=(), args=()):
+            start = time.perf_counter()
+            try:
+                return await script(keys=list(keys), args=list(args))
+            finally:
+                self.stats.record(name, time.perf_counter() - start)
+        self._scripts[source] = run
+        return run
+
+    async def close(self):
+        await self.client.aclose()
+
+
+_store: Optional[RedisStore] = None
+
+
+def get_store() -> RedisStore:
+    """Return the process-wide store, creating it on first use."""
+    global _store
+    if _store is None:
+        _store = RedisStore()
+    return _store
+
+
+def set_store(store: RedisStore):
+    """Swap the process-wide store, e.g. for ``RedisStore.fake()`` in tests."""
+    global _store
+    _store = store
@@ -0,0 +1,296 @@
+# engine.py
+"""Hokm rules engine.
+
+Cards are ints 0-51 (``suit * 13 + rank``, rank 0 is a two and 12 an ace)
+and hands are 52-bit int masks, so following suit is a single AND and trick
+winners come from a precomputed strength table instead of comparisons.
+"""
+import random
+from typing import List, Optional
+
+SUITS = 'SHDC'  # spades, hearts, diamonds, clubs
+RANKS = '23456789TJQKA'
+NUM_PLAYERS = 4
+HAND_SIZE = 13
+HAKEM_FIRST_DEAL = 5  # cards the hakem sees before choosing trump
+TRICKS_TO_WIN = 7
+POINTS_TO_WIN = 7
+
+FULL_DECK = (1 << 52) - 1
+SUIT_MASKS = tuple(((1 << 13) - 1) << (13 * s) for s in range(4))
+SUIT_OF = tuple(c // 13 for c in range(52))
+RANK_OF = tuple(c % 13 for c in range(52))
+CARD_NAMES = tuple(RANKS[c % 13] + SUITS[c // 13] for c in range(52))
+CARD_INDEX = {name: c for c, name in enumerate(CARD_NAMES)}
+TEAM_OF = (0, 1, 0, 1)
+
+
+def _build_strength_table():
+    # STRENGTH[(trump * 4 + lead) * 52 + card]: trumps beat the led suit,
+    # which beats everything else. Off-suit discards are 0 and can never win.
+    table = []
+    for trump in range(4):
+        for lead in range(4):
+            for card in range(52):
+                suit, rank = SUIT_OF[card], RANK_OF[card]
+                if suit == trump:
+                    table.append(32 + rank)
+                elif suit == lead:
+                    table.append(16 + rank)
+                else:
+                    table.append(0)
+    return tuple(table)
+
+
+STRENGTH = _build_strength_table()
+
+
+class IllegalMove(ValueError):
+    """The action is not allowed in the current game state."""
+
+
+def card_name(card: int) -> str:
+    return CARD_NAMES[card]
+
+
+def parse_card(name: str) -> int:
+    try:
+        return CARD_INDEX[name.upper()]
+    except (KeyError, AttributeError):
+        raise IllegalMove(f"Unknown card: {name!r}")
+
+
+def parse_suit(name: str) -> int:
+    if not isinstance(name, str) or len(name) != 1 or name.upper() not in SUITS:
+        raise IllegalMove(f"Unknown suit: {name!r}")
+    return SUITS.index(name.upper())
+
+
+def cards_of(mask: int) -> List[int]:
+    """Cards in a mask, lowest first."""
+    cards = []
+    while mask:
+        low = mask & -mask
+        cards.append(low.bit_length() - 1)
+        mask ^= low
+    return cards
+
+
+def mask_of(cards) -> int:
+    mask = 0
+    for card in cards:
+        mask |= 1 << card
+    return mask
+
+
+def hand_names(mask: int) -> List[str]:
+    return [CARD_NAMES[c] for c in cards_of(mask)]
+
+
+def legal_mask(hand: int, lead_suit: Optional[int]) -> int:
+    """Cards that may be played: the led suit if held, otherwise anything."""
+    if lead_suit is None:
+        return hand
+    follow = hand & SUIT_MASKS[lead_suit]
+    return follow or hand
+
+
+def trick_winner(cards, trump: int) -> int:
+    """Index (in play order) of the card that wins a trick."""
+    base = (trump * 4 + SUIT_OF[cards[0]]) * 52
+    best, winner = STRENGTH[base + cards[0]], 0
+    for i in range(1, len(cards)):
+        strength = STRENGTH[base + cards[i]]
+        if strength > best:
+            best, winner = strength, i
+    return winner
+
+
+def hand_points(winning_team: int, losing_tricks: int, hakem_team: int) -> int:
+    """Match points for a finished hand (kot is winning 7-0)."""
+    if losing_tricks:
+        return 1
+    # Kot against the hakem's team is worth more than kot by it
+    return 2 if winning_team == hakem_team else 3
+
+
+def choose_first_hakem(rng: random.Random) -> int:
+    """Deal cards face up one at a time; the first player to get an ace is hakem."""
+    deck = list(range(52))
+    rng.shuffle(deck)
+    for i, card in enumerate(deck):
+        if RANK_OF[card] == 12:
+            return i % NUM_PLAYERS
+    return 0
+
+
+_seeds = random.SystemRandom()
+
+# Fields that fully describe a game, see to_state()
+STATE_FIELDS = ('seed', 'hakem', 'trump', 'hands', 'deck', 'phase', 'turn', 'trick',
+                'trick_seats', 'played', 'voids', 'tricks_won', 'scores', 'hand_number')
+
+
+class HokmGame:
+    """One Hokm match between teams (0, 2) and (1, 3).
+
+    Actions return a list of JSON-ready event dicts describing what
+    happened, which the servers forward to clients as ``game_update``.
+
+    Every shuffle is derived from ``seed`` and the hand number, so a game
+    is reproducible from its seed and the actions applied to it (see
+    gamelog.py) without keeping a Random per game.
+    """
+
+    __slots__ = STATE_FIELDS
+
+    def __init__(self, hakem: Optional[int] = None, seed=None):
+        self.seed = _seeds.getrandbits(64) if seed is None else seed
+        self.hakem = choose_first_hakem(self._rng('hakem')) if hakem is None else hakem
+        self.trump: Optional[int] = None
+        self.hands = [0] * NUM_PLAYERS
+        self.deck: List[int] = []
+        self.phase = 'new'  # trump -> play -> ... -> match_over
+        self.turn = self.hakem
+        self.trick: List[int] = []
+        self.trick_seats: List[int] = []
+        self.played = 0  # cards played this hand
+        self.voids = [0] * NUM_PLAYERS  # 4-bit masks of suits a seat has shown out of
+        self.tricks_won = [0, 0]
+        self.scores = [0, 0]
+        self.hand_number = 0
+
+    @property
+    def lead_suit(self) -> Optional[int]:
+        return SUIT_OF[self.trick[0]] if self.trick else None
+
+    def start_hand(self) -> List[dict]:
+        """Shuffle and give the hakem the first five cards."""
+        if self.phase not in ('new', 'hand_over'):
+            raise IllegalMove("Hand already in progress")
+        self.deck = list(range(52))
+        self._rng(self.hand_number + 1).shuffle(self.deck)
+        self.hands = [0] * NUM_PLAYERS
+        self.hands[self.hakem] = mask_of(self.deck[:HAKEM_FIRST_DEAL])
+        self.trump = None
+        self.trick, self.trick_seats = [], []
+        self.played = 0
+        self.voids = [0] * NUM_PLAYERS
+        self.tricks_won = [0, 0]
+        self.turn = self.hakem
+        self.phase = 'trump'
+        self.hand_number += 1
+        return [{'event': 'deal', 'hand_number': self.hand_number, 'hakem': self.hakem}]
+
+    def choose_trump(self, seat: int, suit: int) -> List[dict]:
+        if self.phase != 'trump':
+            raise IllegalMove("Trump cannot be chosen now")
+        if seat != self.hakem:
+            raise IllegalMove("Only the hakem chooses trump")
+        self.trump = suit
+        # Deal the rest: eight more to the hakem, thirteen to everyone else
+        rest = iter(self.deck[HAKEM_FIRST_DEAL:])
+        for s in range(NUM_PLAYERS):
+            needed = HAND_SIZE - self.hands[s].bit_count()
+            for _ in range(needed):
+                self.hands[s] |= 1 << next(rest)
+        self.deck = []
+        self.phase = 'play'
+        return [{'event': 'trump', 'seat': seat, 'suit': SUITS[suit]}]
+
+    def legal_moves(self, seat: int) -> int:
+        if self.phase != 'play' or seat != self.turn:
+            return 0
+        trick = self.trick
+        return legal_mask(self.hands[seat], SUIT_OF[trick[0]] if trick else None)
+
+    def play(self, seat: int, card: int) -> List[dict]:
+        if self.phase != 'play':
+            raise IllegalMove("Cards cannot be played now")
+        if seat != self.turn:
+            raise IllegalMove("Not your turn")
+        hand, bit, trick = self.hands[seat], 1 << card, self.trick
+        if not hand & bit:
+            raise IllegalMove("You do not hold that card")
+        if trick and SUIT_OF[card] != SUIT_OF[trick[0]]:
+            lead = SUIT_OF[trick[0]]
+            if hand & SUIT_MASKS[lead]:
+                raise IllegalMove("You must follow suit")
+            self.voids[seat] |= 1 << lead
+
+        self.hands[seat] = hand ^ bit
+        self.played |= bit
+        trick.append(card)
+        self.trick_seats.append(seat)
+        events = [{'event': 'card_played', 'seat': seat, 'card': CARD_NAMES[card]}]
+
+        if len(trick) < NUM_PLAYERS:
+            self.turn = (seat + 1) % NUM_PLAYERS
+            return events
+
+        winner = self.trick_seats[trick_winner(trick, self.trump)]
+        team = TEAM_OF[winner]
+        self.tricks_won[team] += 1
+        self.trick, self.trick_seats = [], []
+        self.turn = winner
+        events.append({'event': 'trick_won', 'seat': winner,
+                       'tricks': list(self.tricks_won)})
+        if self.tricks_won[team] == TRICKS_TO_WIN:
+            events.extend(self._finish_hand(team))
+        return events
+
+    def _finish_hand(self, team: int) -> List[dict]:
+        hakem_team = TEAM_OF[self.hakem]
+        points = hand_points(team, self.tricks_won[1 - team], hakem_team)
+        self.scores[team] += points
+        events = [{'event': 'hand_won', 'team': team, 'points': points,
+                   'scores': list(self.scores)}]
+        if self.scores[team] >= POINTS_TO_WIN:
+            self.phase = 'match_over'
+            events.append({'event': 'match_won', 'team': team})
+            return events
+        # The hakem keeps the deal while their team wins, otherwise it passes on
+        if team != hakem_team:
+            self.hakem = (self.hakem + 1) % NUM_PLAYERS
+        self.phase = 'hand_over'
+        events.extend(self.start_hand())
+        return events
+
+    def apply(self, seat: int, data: dict) -> List[dict]:
+        """Apply a client ``choose_trump`` or ``play_card`` message."""
+        msg_type = data.get('type')
+        if msg_type == 'choose_trump':
+            return self.choose_trump(seat, parse_suit(data.get('suit')))
+        if msg_type == 'play_card':
+            return self.play(seat, parse_card(data.get('card')))
+        raise IllegalMove(f"Unknown game action: {msg_type!r}")
+
+    def _rng(self, purpose) -> random.Random:
+        # String seeds are hashed with SHA-512, the same on every run
+        return random.Random(f"{self.seed}:{purpose}")
+
+    def to_state(self) -> dict:
+        """Complete JSON-ready state, for snapshots."""
+        state = {name: getattr(self, name) for name in STATE_FIELDS}
+        for name in ('hands', 'deck', 'trick', 'trick_seats', 'voids', 'tricks_won', 'scores'):
+            state[name] = list(state[name])
+        return state
+
+    @classmethod
+    def from_state(cls, state: dict) -> 'HokmGame':
+        game = cls.__new__(cls)
+        for name in STATE_FIELDS:
+            value = state[name]
+            setattr(game, name, list(value) if isinstance(value, list) else value)
+        return game
+
+    def public_state(self) -> dict:
+        return {
+            'phase': self.phase,
+            'hakem': self.hakem,
+            'trump': SUITS[self.trump] if self.trump is not None else None,
+            'turn': self.turn,
+            'trick': [CARD_NAMES[c] for c in self.trick],
+            'tricks': list(self.tricks_won),
+            'scores': list(self.scores),
+        }
@@ -0,0 +1,209 @@
+# flowcontrol.py
+"""Per-connection outbound queues and inbound rate limits.
+
+Outbound: every frame for a websocket goes through its Outbox, a bounded
+queue written by its own writer task, so a broadcast never waits for the
+slowest socket in a room. The writer task only exists while frames are
+queued. When a queue is full the outbox applies its policy:
+
+    drop        discard the new frame; game deltas are numbered, so the
+                client notices the gap on the next one and asks for a sync
+    coalesce    as drop, but a queued status frame (room_status) is first
+                replaced in place by a newer one of the same type
+    disconnect  close the connection; the client can resume its seat
+
+Inbound: a TokenBucket per connection is charged for every frame before
+it is decoded, so a flood costs a subtraction per frame, not a parse.
+"""
+import asyncio
+import time
+import weakref
+from collections import deque
+from typing import Optional
+
+import websockets
+
+import metrics
+
+DROP, COALESCE, DISCONNECT = 'drop', 'coalesce', 'disconnect'
+POLICIES = (DROP, COALESCE, DISCONNECT)
+COALESCED_TYPES = frozenset({'room_status'})  # each one supersedes the last
+OUTBOX_LIMIT = 64  # frames queued per connection
+OUTBOX_POLICY = COALESCE
+INBOUND_RATE = 20.0  # frames per second, refilled continuously
+INBOUND_BURST = 40
+MAX_STRIKES = 200  # frames over the limit in a row before the connection is closed
+MAX_INBOUND_FRAME = 4096  # bytes; every client message is far smaller
+FLUSH_TIMEOUT = 5.0  # seconds a finished handler waits for its last frames
+
+_closing = set()  # close tasks started by outboxes, kept referenced
+_outboxes: 'weakref.WeakKeyDictionary[object, Outbox]' = weakref.WeakKeyDictionary()
+
+
+def configure(policy: str = None, limit: int = None, rate: float = None, burst: int = None):
+    """Change the defaults for connections opened from now on."""
+    global OUTBOX_POLICY, OUTBOX_LIMIT, INBOUND_RATE, INBOUND_BURST
+    if policy is not None:
+        if policy not in POLICIES:
+            raise ValueError(f"Unknown outbox policy: {policy!r}")
+        OUTBOX_POLICY = policy
+    if limit is not None:
+        OUTBOX_LIMIT = limit
+    if rate is not None:
+        INBOUND_RATE = rate
+    if burst is not None:
+        INBOUND_BURST = burst
+
+
+class FrameDropped(Exception):
+    """A frame was not queued: the outbox was full or the connection closed."""
+
+
+class Outbox:
+    __slots__ = ('websocket_ref', 'limit', 'policy', 'queue', 'latest', 'task', 'closed',
+                 'close_args')
+
+    def __init__(self, websocket, limit: int = None, policy: str = None):
+        # Weak, or the registry entry would keep its own key alive
+        self.websocket_ref = weakref.ref(websocket)
+        self.limit = limit or OUTBOX_LIMIT
+        self.policy = policy or OUTBOX_POLICY
+        self.queue = deque()  # [message_type, frame] entries
+        self.latest = {}  # coalesced type -> its queued entry
+        self.task: Optional[asyncio.Task] = None
+        self.closed = False
+        self.close_args = None
+
+    def __len__(self):
+        return len(self.queue)
+
+    def put(self, message_type: Optional[str], frame) -> Optional[str]:
+        """Queue a frame; returns None, or why it was not queued.
+
+        ``message_type`` labels the metrics; None is for frames relayed
+        from another worker, which that worker already counted.
+        """
+        if self.closed:
+            return 'connection closed'
+        if self.policy == COALESCE and message_type in COALESCED_TYPES:
+            entry = self.latest.get(message_type)
+            if entry is not None:
+                entry[1] = frame
+                metrics.OUTBOX_DROPS.inc('coalesced')
+                return None
+        if len(self.queue) >= self.limit:
+            if self.policy == DISCONNECT:
+                metrics.OUTBOX_DROPS.inc('disconnected', 1 + len(self.queue))
+                self.queue.clear()
+                self.latest.clear()
+                self.close(1013, 'Too slow to keep up', now=True)
+                return 'disconnected, too slow'
+            metrics.OUTBOX_DROPS.inc('dropped')
+            return 'outbox full'
+        entry = [message_type, frame]
+        self.queue.append(entry)
+        if message_type in COALESCED_TYPES:
+            self.latest[message_type] = entry
+        self._wake()
+        return None
+
+    def close(self, code: int = 1000, reason: str = '', now: bool = False):
+        """Close the websocket after the frames already queued are written.
+
+        With ``now`` the close starts at once, even while the writer is
+        stuck on a socket that stopped reading.
+        """
+        if self.closed:
+            return
+        self.closed = True
+        websocket = self.websocket_ref()
+        if now and websocket is not None:
+            task = asyncio.get_running_loop().create_task(websocket.close(code, reason))
+            _closing.add(task)
+            task.add_done_callback(_closing.discard)
+            return
+        self.close_args = (code, reason)
+        self._wake()
+
+    def _wake(self):
+        if self.task is None:
+            self.task = asyncio.get_running_loop().create_task(self._run())
+
+    async def _run(self):
+        websocket = self.websocket_ref()
+        if websocket is None:
+            self.task = None
+            return
+        try:
+            while self.queue:
+                entry = self.queue.popleft()
+                message_type, frame = entry
+                if self.latest.get(message_type) is entry:
+                    del self.latest[message_type]
+                try:
+                    await websocket.send(frame)
+                except websockets.ConnectionClosed:
+                    if message_type is not None:
+                        metrics.SEND_FAILURES.inc(message_type, 1 + len(self.queue))
+                    self.closed = True
+                    self.queue.clear()
+                    self.latest.clear()
+                    return
+                if message_type is not None:
+                    metrics.FRAMES_SENT.inc(message_type)
+            if self.close_args is not None:
+                close_args, self.close_args = self.close_args, None
+                await websocket.close(*close_args)
+        finally:
+            self.task = None
+
+
+def outbox_for(websocket) -> Outbox:
+    """The websocket's outbox, created on first use with the current defaults."""
+    outbox = _outboxes.get(websocket)
+    if outbox is None:
+        outbox = _outboxes[websocket] = Outbox(websocket)
+    return outbox
+
+
+async def flush(websocket, timeout: float = FLUSH_TIMEOUT):
+    """Wait until the frames queued for ``websocket`` are written, or ``timeout``.
+
+    A handler returning closes its websocket at once, so one that ends with
+    an error frame calls this first or the client never sees the frame.
+    """
+    outbox = _outboxes.get(websocket)
+    if outbox is not None and outbox.task is not None:
+        await asyncio.wait({outbox.task}, timeout=timeout)
+
+
+def queued_frames() -> dict:
+    """Frames waiting in all outboxes, for the metrics gauge."""
+    sizes = [len(outbox) for outbox in list(_outboxes.values())]
+    return {'total': sum(sizes), 'max': max(sizes, default=0)}
+
+
+class TokenBucket:
+    """Allows ``rate`` frames a second on average and bursts of ``burst``."""
+
+    __slots__ = ('rate', 'burst', 'tokens', 'stamp', 'strikes')
+
+    def __init__(self, rate: float = None, burst: int = None):
+        self.rate = INBOUND_RATE if rate is None else rate
+        self.burst = INBOUND_BURST if burst is None else burst
+        self.tokens = float(self.burst)
+        self.stamp = time.monotonic()
+        self.strikes = 0  # frames refused since the last one allowed
+
+    def take(self) -> bool:
+        if self.rate <= 0:
+            return True  # unlimited
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.stamp) * self.rate)
+        self.stamp = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            self.strikes = 0
+            return True
+        self.strikes += 1
+        return False
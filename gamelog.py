@@ -0,0 +1,310 @@
+# gamelog.py
+"""Append-only game log: metadata, every action, and periodic snapshots.
+
+A game is fully described by its seed and starting hakem plus the actions
+applied to it (see HokmGame), so the log stores exactly that. Every
+SNAPSHOT_EVERY actions it also stores a full ``to_state()`` snapshot, so
+a game is rebuilt from the latest snapshot plus the short tail after it.
+
+Writes are write-behind: GameLog only appends to an in-memory batch and a
+background task hands the batch to the backend every FLUSH_INTERVAL, in
+one pipeline or one file write. Backends:
+
+    RedisStreamLog  game:<id>:meta hash, game:<id>:log stream (entry id
+                    0-<n> for action n, value is seat + binary frame),
+                    game:<id>:snap string; keys expire ACTIVE_TTL after
+                    the last snapshot and FINISHED_TTL after the end
+    FileLog         one JSON line per record in daily files, for a single
+                    node or offline analysis; old files are deleted by
+                    cleanup()
+
+``python gamelog.py dump`` prints whole games as JSON lines.
+"""
+import argparse
+import asyncio
+import json
+import os
+import time
+import uuid
+from typing import AsyncIterator, List, Optional, Tuple
+
+from datastore import RedisStore, get_store
+from engine import HokmGame
+from protocol import BINARY
+
+FLUSH_INTERVAL = 0.05  # seconds between write-behind flushes
+SNAPSHOT_EVERY = 64  # actions between snapshots
+ACTIVE_TTL = 7 * 24 * 3600
+FINISHED_TTL = 24 * 3600
+NO_SEAT = 0xFF  # seat byte for actions that belong to no seat (start_hand)
+ACTION_FIELDS = ('suit', 'card')
+
+
+def clean_action(action: dict) -> dict:
+    """Only the fields the engine reads, whatever else the client sent."""
+    clean = {'type': action.get('type')}
+    clean.update((k, action[k]) for k in ACTION_FIELDS if k in action)
+    return clean
+
+
+def apply_action(game: HokmGame, seat: Optional[int], action: dict):
+    if action['type'] == 'start_hand':
+        return game.start_hand()
+    return game.apply(seat, action)
+
+
+def replay(meta: dict, snapshot: Optional[dict], actions: List[Tuple]) -> HokmGame:
+    """Rebuild a game from its snapshot (or metadata) and the actions after it."""
+    if snapshot is not None:
+        game = HokmGame.from_state(snapshot)
+    else:
+        game = HokmGame(hakem=meta['hakem'], seed=meta['seed'])
+    for _, seat, action in actions:
+        apply_action(game, seat, action)
+    return game
+
+
+class RedisStreamLog:
+    def __init__(self, store: Optional[RedisStore] = None):
+        self.store = store or get_store()
+
+    @staticmethod
+    def keys(game_id: str) -> Tuple[str, str, str]:
+        return f'game:{game_id}:meta', f'game:{game_id}:log', f'game:{game_id}:snap'
+
+    async def write(self, batch: List[tuple]):
+        pipe = self.store.pipeline()
+        for op, game_id, *args in batch:
+            meta_key, log_key, snap_key = self.keys(game_id)
+            if op == 'meta':
+                pipe.hset(meta_key, mapping={k: json.dumps(v) for k, v in args[0].items()})
+                pipe.expire(meta_key, ACTIVE_TTL)
+            elif op == 'act':
+                n, seat, action = args
+                fields = dict(action)
+                frame = BINARY.encode(fields.pop('type'), fields)
+                seat_byte = bytes([NO_SEAT if seat is None else seat])
+                pipe.xadd(log_key, {'a': seat_byte + frame}, id=f'0-{n}')
+            elif op == 'snap':
+                n, state = args
+                pipe.set(snap_key, json.dumps({'n': n, 'state': state}), ex=ACTIVE_TTL)
+                pipe.expire(meta_key, ACTIVE_TTL)
+                pipe.expire(log_key, ACTIVE_TTL)
+            elif op == 'finish':
+                pipe.hset(meta_key, 'finished', json.dumps(args[0]))
+                for key in (meta_key, log_key, snap_key):
+                    pipe.expire(key, FINISHED_TTL)
+        await pipe.execute()
+
+    async def _actions(self, log_key: str, after: int) -> List[tuple]:
+        entries = await self.store.xrange(log_key, min=f'(0-{after}' if after else '-')
+        actions = []
+        for entry_id, fields in entries:
+            raw = fields[b'a']
+            seat = None if raw[0] == NO_SEAT else raw[0]
+            actions.append((int(entry_id.split(b'-')[1]), seat, BINARY.decode(raw[1:])))
+        return actions
+
+    async def load(self, game_id: str) -> Tuple[dict, Optional[dict], List[tuple]]:
+        """Metadata, latest snapshot and the actions after it."""
+        meta_key, log_key, snap_key = self.keys(game_id)
+        pipe = self.store.pipeline()
+        pipe.hgetall(meta_key)
+        pipe.get(snap_key)
+        raw_meta, raw_snap = await pipe.execute()
+        if not raw_meta:
+            raise KeyError(game_id)
+        meta = {k.decode(): json.loads(v) for k, v in raw_meta.items()}
+        snap = json.loads(raw_snap) if raw_snap else None
+        after = snap['n'] if snap else 0
+        return meta, snap and snap['state'], await self._actions(log_key, after)
+
+    async def read(self, game_id: str) -> Tuple[dict, List[tuple]]:
+        """Metadata and every action, for analysis."""
+        meta_key, log_key, _ = self.keys(game_id)
+        raw_meta = await self.store.hgetall(meta_key)
+        meta = {k.decode(): json.loads(v) for k, v in raw_meta.items()}
+        return meta, await self._actions(log_key, 0)
+
+    async def games(self) -> AsyncIterator[str]:
+        async for key in self.store.client.scan_iter(match='game:*:meta', count=1000):
+            yield key.decode()[len('game:'):-len(':meta')]
+
+
+class FileLog:
+    def __init__(self, directory: str = 'gamelogs'):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self) -> str:
+        day = time.strftime('%Y%m%d', time.gmtime())
+        return os.path.join(self.directory, f'games-{day}.jsonl')
+
+    def _files(self) -> List[str]:
+        return sorted(
+            os.path.join(self.directory, name) for name in os.listdir(self.directory)
+            if name.startswith('games-') and name.endswith('.jsonl')
+        )
+
+    def _write_sync(self, lines: List[str]):
+        with open(self._path(), 'a') as f:
+            f.write(''.join(lines))
+
+    async def write(self, batch: List[tuple]):
+        lines = []
+        for op, game_id, *args in batch:
+            record = {'op': op, 'game': game_id}
+            if op == 'meta':
+                record['meta'] = args[0]
+            elif op == 'act':
+                record['n'], record['seat'], record['action'] = args
+            elif op == 'snap':
+                record['n'], record['state'] = args
+            elif op == 'finish':
+                record['result'] = args[0]
+            lines.append(json.dumps(record, separators=(',', ':')) + '\n')
+        await asyncio.get_running_loop().run_in_executor(None, self._write_sync, lines)
+
+    def _records(self, game_id: str = None):
+        for path in self._files():
+            with open(path) as f:
+                for line in f:
+                    record = json.loads(line)
+                    if game_id is None or record['game'] == game_id:
+                        yield record
+
+    async def load(self, game_id: str) -> Tuple[dict, Optional[dict], List[tuple]]:
+        # Scans the files: fine for a single node, use Redis for fast failover
+        meta, snap, tail = None, None, []
+        for record in self._records(game_id):
+            if record['op'] == 'meta':
+                meta = record['meta']
+            elif record['op'] == 'snap':
+                snap, tail = record, []
+            elif record['op'] == 'act':
+                tail.append((record['n'], record['seat'], record['action']))
+        if meta is None:
+            raise KeyError(game_id)
+        return meta, snap and snap['state'], tail
+
+    async def read(self, game_id: str) -> Tuple[dict, List[tuple]]:
+        meta, actions = {}, []
+        for record in self._records(game_id):
+            if record['op'] == 'meta':
+                meta.update(record['meta'])
+            elif record['op'] == 'finish':
+                meta['finished'] = record['result']
+            elif record['op'] == 'act':
+                actions.append((record['n'], record['seat'], record['action']))
+        return meta, actions
+
+    async def games(self) -> AsyncIterator[str]:
+        seen = set()
+        for record in self._records():
+            if record['op'] == 'meta' and record['game'] not in seen:
+                seen.add(record['game'])
+                yield record['game']
+
+    def cleanup(self, max_age: float = FINISHED_TTL):
+        """Delete daily files older than ``max_age`` seconds."""
+        cutoff = time.time() - max_age
+        for path in self._files():
+            if os.path.getmtime(path) < cutoff:
+                os.remove(path)
+
+
+class GameLog:
+    """Write-behind front end; with no backend every call is a no-op.
+
+    Callers refer to games by their own key (a room code); each open()
+    starts a new log under a fresh game id, so reused room codes never mix.
+    """
+
+    def __init__(self, backend=None, flush_interval: float = FLUSH_INTERVAL,
+                 snapshot_every: int = SNAPSHOT_EVERY):
+        self.backend = backend
+        self.flush_interval = flush_interval
+        self.snapshot_every = snapshot_every
+        self.pending: List[tuple] = []
+        self.ids = {}  # key -> game id
+        self.counts = {}  # game id -> actions logged
+        self.task = None
+
+    def _queue(self, record: tuple):
+        self.pending.append(record)
+        if self.task is None or self.task.done():
+            self.task = asyncio.get_running_loop().create_task(self._run())
+
+    def open(self, key: str, game: Optional[HokmGame] = None, **meta) -> Optional[str]:
+        if self.backend is None:
+            return None
+        game_id = f"{key}-{uuid.uuid4().hex[:8]}"
+        self.ids[key] = game_id
+        self.counts[game_id] = 0
+        meta['started'] = time.time()
+        if game is not None:
+            meta.update(seed=game.seed, hakem=game.hakem)
+        self._queue(('meta', game_id, meta))
+        return game_id
+
+    def append(self, key: str, seat: Optional[int], action: dict, game: HokmGame):
+        """Log an action that was just applied to ``game``."""
+        game_id = self.ids.get(key)
+        if game_id is None:
+            return
+        n = self.counts[game_id] = self.counts[game_id] + 1
+        self._queue(('act', game_id, n, seat, clean_action(action)))
+        if n % self.snapshot_every == 0:
+            self._queue(('snap', game_id, n, game.to_state()))
+        if game.phase == 'match_over':
+            self.finish(key, {'scores': list(game.scores)})
+
+    def finish(self, key: str, result: dict = None):
+        """Mark a game over (or abandoned) so its keys expire sooner."""
+        game_id = self.ids.pop(key, None)
+        if game_id is None:
+            return
+        self.counts.pop(game_id, None)
+        self._queue(('finish', game_id, result or {'abandoned': True}))
+
+    async def flush(self):
+        batch, self.pending = self.pending, []
+        if not batch:
+            return
+        try:
+            await self.backend.write(batch)
+        except Exception as e:
+            # Keep the batch and retry on the next tick
+            print(f"Game log write failed ({len(batch)} records): {e!r}")
+            self.pending[:0] = batch
+
+    async def _run(self):
+        while self.pending:
+            await asyncio.sleep(self.flush_interval)
+            await self.flush()
+
+
+async def dump(backend, game_id: Optional[str]):
+    ids = [game_id] if game_id else [g async for g in backend.games()]
+    for gid in ids:
+        meta, actions = await backend.read(gid)
+        print(json.dumps({'game': gid, 'meta': meta, 'actions': actions}))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Read game logs in bulk")
+    parser.add_argument('command', choices=('dump', 'cleanup'))
+    parser.add_argument('game_id', nargs='?', default=None)
+    parser.add_argument('--dir', default=None, help='read a FileLog directory instead of Redis')
+    args = parser.parse_args()
+    backend = FileLog(args.dir) if args.dir else RedisStreamLog()
+    if args.command == 'cleanup':
+        if not args.dir:
+            parser.error('Redis keys expire by themselves; cleanup needs --dir')
+        backend.cleanup()
+    else:
+        asyncio.run(dump(backend, args.game_id))
+
+
+if __name__ == '__main__':
+    main()
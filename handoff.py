@@ -0,0 +1,117 @@
+# handoff.py
+"""Room snapshots that carry games in progress across a restart.
+
+On SIGTERM or Ctrl-C the server drains (see ``server.drain``). It stops
+taking new rooms, snapshots every game still in progress in one pass,
+writes the snapshots here and closes each connection with 1012 (service
+restart). Clients then reconnect with their resume token. After the
+restart nothing is rebuilt up front. The handed-off room codes are only
+reserved, and a room is restored from its snapshot when the first of its
+players resumes. Seats whose players have not come back yet are played
+by bots, as for any disconnect.
+
+A snapshot is what the server keeps in memory and nothing more:
+``HokmGame.to_state()``, the room's sequence number and resume tokens,
+who sits where, and the game log position so logging carries on under
+the same game id. The replay buffer is not kept, so the first sync
+after a restore is a full snapshot.
+
+Backends, as in gamelog.py:
+
+    RedisHandoff    one hash, handoff:rooms, room code -> snapshot JSON;
+                    expires HANDOFF_TTL after the last drain
+    FileHandoff     one JSON line per room in a local file, for a single
+                    node; read once at startup, then deleted
+"""
+import asyncio
+import json
+import os
+import time
+from typing import Dict, List, Optional
+
+from datastore import RedisStore, get_store
+from engine import HokmGame
+from statesync import RoomSync
+
+HANDOFF_KEY = 'handoff:rooms'
+HANDOFF_TTL = 600  # seconds a snapshot waits for its players to come back
+
+
+def snapshot_room(game: HokmGame, sync: RoomSync, players: list,
+                  log_id: Optional[str] = None, logged: int = 0) -> str:
+    return json.dumps({
+        'game': game.to_state(),
+        'seq': sync.seq,
+        'tokens': sync.tokens,
+        'players': [[p.username, p.is_bot] for p in players],
+        'log': [log_id, logged] if log_id else None,
+    }, separators=(',', ':'))
+
+
+def load_room(raw) -> dict:
+    """Decode a snapshot; the game and sync come back ready to use."""
+    snapshot = json.loads(raw)
+    sync = RoomSync()
+    sync.seq = snapshot['seq']
+    sync.tokens = {token: tuple(claim) for token, claim in snapshot['tokens'].items()}
+    snapshot['game'] = HokmGame.from_state(snapshot['game'])
+    snapshot['sync'] = sync
+    return snapshot
+
+
+class RedisHandoff:
+    def __init__(self, store: Optional[RedisStore] = None):
+        self.store = store or get_store()
+
+    async def save(self, snapshots: Dict[str, str]):
+        if not snapshots:
+            return
+        pipe = self.store.pipeline()
+        pipe.hset(HANDOFF_KEY, mapping=snapshots)
+        pipe.expire(HANDOFF_KEY, HANDOFF_TTL)
+        await pipe.execute()
+
+    async def codes(self) -> List[str]:
+        return [code.decode() for code in await self.store.hkeys(HANDOFF_KEY)]
+
+    async def take(self, room_code: str) -> Optional[bytes]:
+        """The room's snapshot, removed so it is restored only once."""
+        pipe = self.store.pipeline()
+        pipe.hget(HANDOFF_KEY, room_code)
+        pipe.hdel(HANDOFF_KEY, room_code)
+        raw, _ = await pipe.execute()
+        return raw
+
+
+class FileHandoff:
+    def __init__(self, path: str = 'handoff.jsonl'):
+        self.path = path
+        self.rooms: Dict[str, str] = {}
+
+    def _write_sync(self, lines: List[str]):
+        # Written aside and renamed, so a crash mid-write leaves no half file
+        with open(self.path + '.tmp', 'w') as f:
+            f.write(''.join(lines))
+        os.replace(self.path + '.tmp', self.path)
+
+    async def save(self, snapshots: Dict[str, str]):
+        lines = [f'{json.dumps(code)}\t{raw}\n' for code, raw in snapshots.items()]
+        await asyncio.get_running_loop().run_in_executor(None, self._write_sync, lines)
+
+    def _read_sync(self):
+        try:
+            if time.time() - os.path.getmtime(self.path) < HANDOFF_TTL:
+                with open(self.path) as f:
+                    for line in f:
+                        code, raw = line.split('\t', 1)
+                        self.rooms[json.loads(code)] = raw
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
+
+    async def codes(self) -> List[str]:
+        await asyncio.get_running_loop().run_in_executor(None, self._read_sync)
+        return list(self.rooms)
+
+    async def take(self, room_code: str) -> Optional[str]:
+        return self.rooms.pop(room_code, None)
@@ -0,0 +1,328 @@
+# loadgen.py
+"""Headless load generator for the Hokm websocket server.
+
+Opens many simulated players that follow the real protocol: one player
+per table sends create_room, the other three join_room with the code it
+gets back, and everyone waits for game_start. With ``--play`` the tables
+then play cards (first legal card, spades as trump) until the match ends
+or the time is up.
+
+Reports connection rate, join-to-game_start latency percentiles,
+messages per second, and the server's memory growth when its pid is
+known. ``--output`` writes the same report as JSON so runs can be compared.
+Simulated players act far faster than people, so start the server with
+``--inbound-rate 0`` when measuring with ``--play``.
+
+    python loadgen.py --players 2000 --output run.json
+    python loadgen.py --players 400 --play 30 --spawn "python server.py --inbound-rate 0"
+"""
+import argparse
+import asyncio
+import json
+import os
+import resource
+import shlex
+import subprocess
+import time
+from typing import List, Optional
+
+import websockets
+
+from protocol import BINARY, BINARY_SUBPROTOCOL, JSON, JSON_SUBPROTOCOL
+from statesync import GameView
+
+TABLE_SIZE = 4
+ENCODINGS = {'binary': (BINARY, BINARY_SUBPROTOCOL), 'json': (JSON, JSON_SUBPROTOCOL)}
+
+
+def percentiles(samples: List[float]) -> dict:
+    if not samples:
+        return {}
+    ordered = sorted(samples)
+    pick = lambda q: ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+    return {
+        'count': len(ordered),
+        'p50_ms': pick(0.50) * 1000,
+        'p90_ms': pick(0.90) * 1000,
+        'p99_ms': pick(0.99) * 1000,
+        'max_ms': ordered[-1] * 1000,
+    }
+
+
+def tree_rss(pid: int) -> Optional[int]:
+    """Resident memory in bytes of ``pid`` and all its descendants (Linux)."""
+    children = {}
+    for entry in os.listdir('/proc'):
+        if entry.isdigit():
+            try:
+                with open(f'/proc/{entry}/stat') as f:
+                    ppid = int(f.read().rsplit(')', 1)[1].split()[1])
+            except (OSError, IndexError, ValueError):
+                continue
+            children.setdefault(ppid, []).append(int(entry))
+    total, stack = 0, [pid]
+    while stack:
+        current = stack.pop()
+        try:
+            with open(f'/proc/{current}/statm') as f:
+                total += int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+        except OSError:
+            if current == pid:
+                return None
+        stack.extend(children.get(current, ()))
+    return total
+
+
+def choose_action(view: GameView):
+    """The message this seat sends next, or None if it is not its turn."""
+    state = view.state
+    if state.get('turn') != view.seat:
+        return None
+    if state['phase'] == 'trump':
+        return 'choose_trump', {'suit': 'S'}
+    if state['phase'] == 'play' and view.hand:
+        lead = state['trick'][0][-1] if state['trick'] else None
+        follow = [c for c in view.hand if c[-1] == lead]
+        return 'play_card', {'card': (follow or view.hand)[0]}
+    return None
+
+
+class Stats:
+    def __init__(self):
+        self.connected = 0
+        self.connect_errors = 0
+        self.connect_times: List[float] = []
+        self.first_connect: Optional[float] = None
+        self.last_connect: Optional[float] = None
+        self.join_latencies: List[float] = []
+        self.sent = 0
+        self.received = 0
+        self.actions = 0
+        self.games_started = 0
+        self.games_finished = 0
+        self.errors = 0
+
+
+class SimPlayer:
+    """One simulated client connection."""
+
+    def __init__(self, uri: str, encoding: str, stats: Stats, name: str):
+        self.uri = uri
+        self.codec, self.subprotocol = ENCODINGS[encoding]
+        self.stats = stats
+        self.name = name
+        self.ws = None
+        self.view = GameView()
+        self.acted = -1  # seq of the last state this seat acted on
+
+    async def connect(self):
+        start = time.perf_counter()
+        try:
+            self.ws = await websockets.connect(self.uri, subprotocols=[self.subprotocol],
+                                               max_queue=None)
+        except (OSError, websockets.InvalidHandshake, asyncio.TimeoutError):
+            self.stats.connect_errors += 1
+            raise
+        end = time.perf_counter()
+        self.stats.connect_times.append(end - start)
+        self.stats.connected += 1
+        if self.stats.first_connect is None or start < self.stats.first_connect:
+            self.stats.first_connect = start
+        self.stats.last_connect = end
+
+    async def send(self, message_type: str, data: dict):
+        await self.ws.send(self.codec.encode(message_type, data))
+        self.stats.sent += 1
+
+    async def recv(self) -> dict:
+        msg = self.codec.decode(await self.ws.recv())
+        self.stats.received += 1
+        if msg['type'] == 'error':
+            self.stats.errors += 1
+        return msg
+
+    async def wait_for(self, *message_types: str) -> dict:
+        while True:
+            msg = await self.recv()
+            if msg['type'] in message_types:
+                return msg
+
+    async def enter(self, message_type: str, data: dict) -> float:
+        """Send create_room or join_room; returns when it was sent."""
+        start = time.perf_counter()
+        await self.send(message_type, dict(data, username=self.name))
+        joined = await self.wait_for('room_joined', 'room_full')
+        if joined['type'] == 'room_full':
+            raise RuntimeError(f"{self.name}: room {data.get('room_code')} was full")
+        self.room_id = joined['room_id']
+        return start
+
+    async def until_game_start(self, start: float):
+        msg = await self.wait_for('game_start')
+        self.stats.join_latencies.append(time.perf_counter() - start)
+        self.view.seat = msg['seat']
+        self.view.load_snapshot(msg['seq'], msg['state'], msg['hand'])
+        await self.act()
+
+    async def act(self):
+        action = choose_action(self.view)
+        if action and self.acted != self.view.seq:
+            self.acted = self.view.seq
+            await self.send(*action)
+            self.stats.actions += 1
+
+    async def play(self) -> bool:
+        """Play until the match is over; True if it finished."""
+        while True:
+            msg = await self.recv()
+            if msg['type'] != 'game_update':
+                continue
+            self.view.apply(msg['seq'], msg['events'], msg.get('hand'))
+            if self.view.state['phase'] == 'match_over':
+                return True
+            await self.act()
+
+    async def close(self):
+        if self.ws is not None:
+            await self.ws.close()
+
+
+async def run_table(index: int, args, stats: Stats, connect_gate: asyncio.Semaphore,
+                    deadline: float):
+    players = [SimPlayer(args.uri, args.encoding, stats, f"load{index}-{seat}")
+               for seat in range(TABLE_SIZE)]
+    try:
+        for p in players:
+            async with connect_gate:
+                await p.connect()
+        host, guests = players[0], players[1:]
+        starts = [await host.enter('create_room', {})]
+        for guest in guests:
+            starts.append(await guest.enter('join_room', {'room_code': host.room_id}))
+        await asyncio.gather(*(p.until_game_start(s) for p, s in zip(players, starts)))
+        stats.games_started += 1
+        if args.play:
+            remaining = deadline - time.monotonic()
+            try:
+                await asyncio.wait_for(asyncio.gather(*(p.play() for p in players)), remaining)
+                stats.games_finished += 1
+            except asyncio.TimeoutError:
+                pass
+    except (OSError, websockets.WebSocketException, asyncio.TimeoutError, RuntimeError) as e:
+        if args.verbose:
+            print(f"table {index}: {e!r}")
+    finally:
+        await asyncio.gather(*(p.close() for p in players), return_exceptions=True)
+
+
+async def run(args) -> dict:
+    stats = Stats()
+    gate = asyncio.Semaphore(args.connect_concurrency)
+    tables = args.players // TABLE_SIZE
+    rss_before = tree_rss(args.server_pid) if args.server_pid else None
+    start = time.perf_counter()
+    deadline = time.monotonic() + args.play
+    await asyncio.gather(*(run_table(i, args, stats, gate, deadline) for i in range(tables)))
+    elapsed = time.perf_counter() - start
+    rss_after = tree_rss(args.server_pid) if args.server_pid else None
+
+    connect_span = (stats.last_connect - stats.first_connect) if stats.connected else 0
+    report = {
+        'config': {
+            'uri': args.uri, 'players': tables * TABLE_SIZE, 'encoding': args.encoding,
+            'connect_concurrency': args.connect_concurrency, 'play_seconds': args.play,
+        },
+        'elapsed_s': elapsed,
+        'connections': {
+            'opened': stats.connected,
+            'errors': stats.connect_errors,
+            'per_s': stats.connected / connect_span if connect_span else None,
+            'latency': percentiles(stats.connect_times),
+        },
+        'join_to_game_start': percentiles(stats.join_latencies),
+        'messages': {
+            'sent': stats.sent,
+            'received': stats.received,
+            'per_s': (stats.sent + stats.received) / elapsed,
+            'errors': stats.errors,
+        },
+        'games': {
+            'started': stats.games_started,
+            'finished': stats.games_finished,
+            'actions': stats.actions,
+        },
+        'server_rss': {
+            'before_bytes': rss_before,
+            'after_bytes': rss_after,
+            'growth_bytes': rss_after - rss_before if rss_before and rss_after else None,
+        },
+    }
+    return report
+
+
+def print_report(report: dict):
+    conn = report['connections']
+    join = report['join_to_game_start']
+    msgs = report['messages']
+    rate = f"{conn['per_s']:,.0f}/s" if conn['per_s'] else 'n/a'
+    print(f"connections   {conn['opened']} opened, {conn['errors']} failed, {rate}")
+    if join:
+        print(f"join->start   p50 {join['p50_ms']:.1f} ms  p90 {join['p90_ms']:.1f} ms  "
+              f"p99 {join['p99_ms']:.1f} ms  max {join['max_ms']:.1f} ms")
+    print(f"messages      {msgs['sent']} sent, {msgs['received']} received, "
+          f"{msgs['per_s']:,.0f}/s, {msgs['errors']} errors")
+    games = report['games']
+    print(f"games         {games['started']} started, {games['finished']} finished, "
+          f"{games['actions']} actions")
+    rss = report['server_rss']
+    if rss['growth_bytes'] is not None:
+        print(f"server rss    {rss['before_bytes'] / 2**20:.1f} MiB -> "
+              f"{rss['after_bytes'] / 2**20:.1f} MiB "
+              f"(+{rss['growth_bytes'] / 2**20:.1f} MiB)")
+
+
+def raise_file_limit():
+    # Every simulated player holds a socket
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if soft < hard:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--uri', default='ws://localhost:8765')
+    parser.add_argument('--players', type=int, default=400, help='rounded down to whole tables')
+    parser.add_argument('--encoding', choices=sorted(ENCODINGS), default='binary')
+    parser.add_argument('--connect-concurrency', type=int, default=100,
+                        help='connections opened at the same time')
+    parser.add_argument('--play', type=float, default=0.0,
+                        help='seconds to keep playing after game_start (0: stop there)')
+    parser.add_argument('--server-pid', type=int, default=None,
+                        help='measure memory of this process and its children')
+    parser.add_argument('--spawn', default=None,
+                        help='command that starts the server; implies --server-pid')
+    parser.add_argument('--output', default=None, help='write the report as JSON')
+    parser.add_argument('--verbose', action='store_true')
+    args = parser.parse_args()
+    raise_file_limit()
+
+    server = None
+    if args.spawn:
+        server = subprocess.Popen(shlex.split(args.spawn), stdout=subprocess.DEVNULL)
+        args.server_pid = server.pid
+        time.sleep(2)  # let the server bind
+    try:
+        report = asyncio.run(run(args))
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait()
+
+    print_report(report)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
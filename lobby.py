@@ -1,33 +1,152 @@
 # lobby.py
 import random
-import redis
 import json
+import time
+from typing import List, Tuple
+from datastore import get_store
+from roomcodes import ROOM_CODE_DIGITS
 
-redis_client = redis.Redis(host='localhost', port=6379, db=0)
+FULL_ROOM_TTL = 15 * 60  # seconds a full room keeps its player list and code
 
-def generate_room_code() -> str:
-    # 4-digit room code, zero-padded
-    return f"{random.randint(1000, 9999)}"
+# Find or create the open room, append the player and close the room when
+# it reaches 4 players, all in one atomic round trip. New rooms draw their
+# code with the same lazy Fisher-Yates shuffle as roomcodes.py, kept in
+# Redis, so a code is never handed out while its room is live. A full room
+# keeps its player list for FULL_ROOM_TTL, then its code goes back on the
+# free list (or sooner, through release_room). Free codes are reused once
+# the fresh ones run out.
+# KEYS[1] = current_room_code, KEYS[2] = codes drawn, KEYS[3] = shuffle
+# swaps, KEYS[4] = free codes, KEYS[5] = full rooms by expiry (ms)
+# ARGV[1] = username, ARGV[2] = random integer, ARGV[3] = first code,
+# ARGV[4] = number of codes, ARGV[5] = now (ms), ARGV[6] = full room TTL (ms)
+ASSIGN_PLAYER_LUA = """
+local now = tonumber(ARGV[5])
+local room_code = redis.call('GET', KEYS[1])
+if not room_code then
+    local size = tonumber(ARGV[4])
+    local drawn = tonumber(redis.call('GET', KEYS[2]) or '0')
+    if drawn < size then
+        local last = size - drawn - 1
+        local i = tonumber(ARGV[2]) % (last + 1)
+        local index = redis.call('HGET', KEYS[3], i) or i
+        redis.call('HSET', KEYS[3], i, redis.call('HGET', KEYS[3], last) or last)
+        redis.call('HDEL', KEYS[3], last)
+        redis.call('INCR', KEYS[2])
+        room_code = tostring(tonumber(ARGV[3]) + tonumber(index))
+    else
+        -- Full rooms past their TTL give their codes back first
+        for _, code in ipairs(redis.call('ZRANGEBYSCORE', KEYS[5], '-inf', now, 'LIMIT', 0, 100)) do
+            redis.call('ZREM', KEYS[5], code)
+            redis.call('RPUSH', KEYS[4], code)
+        end
+        room_code = redis.call('LPOP', KEYS[4])
+        if not room_code then
+            return redis.error_reply('all room codes are in use')
+        end
+    end
+    -- A reused code may still have its old player list
+    redis.call('DEL', 'room:' .. room_code .. ':players', 'room:' .. room_code .. ':left')
+    redis.call('SET', KEYS[1], room_code)
+end
+local players_key = 'room:' .. room_code .. ':players'
+local player_number = redis.call('RPUSH', players_key, ARGV[1])
+if player_number >= 4 then
+    -- Room is full, reset for next game
+    redis.call('DEL', KEYS[1])
+    redis.call('PEXPIRE', players_key, ARGV[6])
+    redis.call('ZADD', KEYS[5], now + tonumber(ARGV[6]), room_code)
+end
+return {room_code, player_number}
+"""
+# The shuffle state is kept per code width, so changing HOKM_ROOM_CODE_DIGITS
+# starts a fresh code space instead of reading the old one's
+CODE_SPACE = f'room_codes:{ROOM_CODE_DIGITS}'
+ROOM_CODE_KEYS = ['current_room_code', f'{CODE_SPACE}:drawn', f'{CODE_SPACE}:swaps',
+                  f'{CODE_SPACE}:free', f'{CODE_SPACE}:cooling']
 
-def assign_player_to_room(username: str) -> tuple[str, int]:
-    # Find or create a room with <4 players
-    room_code = redis_client.get('current_room_code')
-    if not room_code:
-        room_code = generate_room_code()
-        redis_client.set('current_room_code', room_code)
-        redis_client.delete(f'room:{room_code}:players')
+# Give a room's code back at once. Only a code still held (full and not yet
+# expired, or the room being filled) goes on the free list, so releasing a
+# room twice never hands its code out twice.
+# KEYS[1] = current_room_code, KEYS[2] = free codes, KEYS[3] = full rooms
+# ARGV[1] = room code
+RELEASE_ROOM_LUA = """
+local held = redis.call('ZREM', KEYS[3], ARGV[1]) == 1
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    redis.call('DEL', KEYS[1])
+    held = true
+end
+redis.call('DEL', 'room:' .. ARGV[1] .. ':players', 'room:' .. ARGV[1] .. ':left')
+if held then
+    redis.call('RPUSH', KEYS[2], ARGV[1])
+end
+return held and 1 or 0
+"""
+# Take a player out of their lobby room when their connection ends. A room
+# still filling loses the player and is closed once empty (abandoned); a
+# full room counts the players gone and is done once all are (finished).
+# Either way its code is left on the full rooms set, due now, and 1 tells
+# the caller to hand it back with release_room; if that never happens the
+# assign script reclaims it like any expired room.
+# KEYS[1] = current_room_code, KEYS[2] = full rooms by expiry (ms)
+# ARGV[1] = room code, ARGV[2] = username, ARGV[3] = now (ms)
+LEAVE_ROOM_LUA = """
+local players_key = 'room:' .. ARGV[1] .. ':players'
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    redis.call('LREM', players_key, 1, ARGV[2])
+    if redis.call('LLEN', players_key) > 0 then
+        return 0
+    end
+    redis.call('DEL', KEYS[1])
+    redis.call('ZADD', KEYS[2], ARGV[3], ARGV[1])
+    return 1
+end
+if not redis.call('ZSCORE', KEYS[2], ARGV[1]) then
+    return 0  -- released already
+end
+local left_key = 'room:' .. ARGV[1] .. ':left'
+local left = redis.call('INCR', left_key)
+redis.call('PEXPIRE', left_key, math.max(redis.call('PTTL', players_key), 1))
+if left < redis.call('LLEN', players_key) then
+    return 0
+end
+redis.call('ZADD', KEYS[2], ARGV[3], ARGV[1])
+return 1
+"""
+FIRST_CODE = 10 ** (ROOM_CODE_DIGITS - 1)
+CODE_COUNT = 9 * FIRST_CODE
+
+def assign_call(username: str, key_prefix: str = '') -> Tuple[List[str], list]:
+    """Keys and arguments for ASSIGN_PLAYER_LUA; benchmarks prefix the keys."""
+    keys = [key_prefix + key for key in ROOM_CODE_KEYS]
+    return keys, [username, random.getrandbits(48), FIRST_CODE, CODE_COUNT,
+                  int(time.time() * 1000), int(FULL_ROOM_TTL * 1000)]
 
+async def assign_player_to_room(username: str) -> tuple[str, int]:
+    # Find or create a room with <4 players
+    assign_player = get_store().register_script(ASSIGN_PLAYER_LUA, 'ASSIGN_PLAYER')
+    keys, args = assign_call(username)
+    room_code, player_number = await assign_player(keys=keys, args=args)
     room_code = room_code.decode() if isinstance(room_code, bytes) else room_code
-    players_key = f'room:{room_code}:players'
-    players = redis_client.lrange(players_key, 0, -1)
-    player_number = len(players) + 1
+    return room_code, int(player_number)
+
+async def release_room(room_code: str) -> bool:
+    """Forget a finished room now instead of after FULL_ROOM_TTL; False if already gone."""
+    release = get_store().register_script(RELEASE_ROOM_LUA, 'RELEASE_ROOM')
+    released = await release(
+        keys=['current_room_code', f'{CODE_SPACE}:free', f'{CODE_SPACE}:cooling'],
+        args=[room_code]
+    )
+    return bool(released)
 
-    redis_client.rpush(players_key, username)
-    if player_number == 4:
-        # Room is full, reset for next game
-        redis_client.delete('current_room_code')
-    return room_code, player_number
+async def leave_room(room_code: str, username: str) -> bool:
+    """Take a player out of their room; True if that gave the room's code back."""
+    leave = get_store().register_script(LEAVE_ROOM_LUA, 'LEAVE_ROOM')
+    done = await leave(
+        keys=['current_room_code', f'{CODE_SPACE}:cooling'],
+        args=[room_code, username, int(time.time() * 1000)]
+    )
+    return bool(done) and await release_room(room_code)
 
-def get_room_players(room_code: str):
+async def get_room_players(room_code: str) -> List[str]:
     players_key = f'room:{room_code}:players'
-    return [p.decode() for p in redis_client.lrange(players_key, 0, -1)]
+    return [p.decode() for p in await get_store().lrange(players_key, 0, -1)]
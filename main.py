@@ -1,9 +1,30 @@
 # main.py
 import asyncio
+import os
+import signal
+import time
 import websockets
 import json
-from auth import register_user, authenticate_user
-from lobby import assign_player_to_room, get_room_players
+import tokens
+from auth import AuthBusy, register_user_async, authenticate_user_async
+from lobby import assign_player_to_room, get_room_players, leave_room
+
+DRAIN_TIMEOUT = 10  # seconds requests in flight get to finish on SIGTERM
+LOBBY_POLL = 1.0  # seconds between checks of a waiting player's room
+
+async def wait_until_full(websocket, room_code):
+    """The room's players once it has 4, or None if the client left first."""
+    closed = asyncio.ensure_future(websocket.wait_closed())
+    try:
+        while True:
+            players = await get_room_players(room_code)
+            if len(players) >= 4:
+                return players
+            done, _ = await asyncio.wait({closed}, timeout=LOBBY_POLL)
+            if done:
+                return None
+    finally:
+        closed.cancel()
 
 async def handler(websocket, path):
     # Step 1: Authentication
@@ -14,36 +35,99 @@ async def handler(websocket, path):
     password = data.get('password')
 
     if action == 'register':
-        if register_user(username, password):
-            await websocket.send(json.dumps({'status': 'success', 'msg': 'Registered!'}))
+        try:
+            registered = await register_user_async(username, password)
+        except AuthBusy:
+            await websocket.send(json.dumps({'status': 'error', 'msg': 'Server busy, try again'}))
+            return
+        if registered:
+            await websocket.send(json.dumps({'status': 'success', 'msg': 'Registered!',
+                                             'token': tokens.issue(username)}))
         else:
             await websocket.send(json.dumps({'status': 'error', 'msg': 'Username exists'}))
         return
 
+    if action == 'login' and 'token' in data:
+        # A session token from an earlier login: checked locally, no bcrypt
+        session = tokens.verify(data['token'])
+        if session:
+            await websocket.send(json.dumps({'status': 'success', 'msg': 'Login successful',
+                                             'username': session.username}))
+        else:
+            await websocket.send(json.dumps({'status': 'error', 'msg': 'Session expired'}))
+        return
+
     if action == 'login':
-        if authenticate_user(username, password):
-            await websocket.send(json.dumps({'status': 'success', 'msg': 'Login successful'}))
+        try:
+            authenticated = await authenticate_user_async(username, password)
+        except AuthBusy:
+            await websocket.send(json.dumps({'status': 'error', 'msg': 'Server busy, try again'}))
+            return
+        if authenticated:
+            await websocket.send(json.dumps({'status': 'success', 'msg': 'Login successful',
+                                             'token': tokens.issue(username)}))
         else:
             await websocket.send(json.dumps({'status': 'error', 'msg': 'Invalid credentials'}))
         return
 
+    if action == 'logout':
+        tokens.signer.revoke(data.get('token'))
+        await websocket.send(json.dumps({'status': 'success', 'msg': 'Logged out'}))
+        return
+
     # Step 2: Lobby assignment (after login)
     if action == 'join_lobby':
-        room_code, player_number = assign_player_to_room(username)
-        await websocket.send(json.dumps({
-            'status': 'joined',
-            'room_code': room_code,
-            'player_number': player_number,
-            'msg': f"Player {player_number}: {username} entered the room [{room_code}]"
-        }))
-        if player_number == 4:
-            players = get_room_players(room_code)
-            print(f"Room {room_code} is full, ready to play... Players: {players}")
+        session = tokens.verify(data.get('token'))
+        if session is None:
+            await websocket.send(json.dumps({'status': 'error', 'msg': 'Log in first'}))
+            return
+        username = session.username
+        room_code, player_number = await assign_player_to_room(username)
+        # The player holds the connection until the room is full; leaving
+        # earlier gives up the seat, and the last one out frees the code
+        try:
+            await websocket.send(json.dumps({
+                'status': 'joined',
+                'room_code': room_code,
+                'player_number': player_number,
+                'msg': f"Player {player_number}: {username} entered the room [{room_code}]"
+            }))
+            players = await wait_until_full(websocket, room_code)
+            if players is None:
+                return
+            if player_number == 4:
+                print(f"Room {room_code} is full, ready to play... Players: {players}")
+            await websocket.send(json.dumps({
+                'status': 'ready',
+                'room_code': room_code,
+                'players': players,
+                'msg': f"Room [{room_code}] is full, ready to play"
+            }))
+        except websockets.ConnectionClosed:
+            pass
+        finally:
+            if await leave_room(room_code, username):
+                print(f"Room {room_code} closed, code released")
 
 async def main():
+    if tokens.KEYS_ENV not in os.environ:
+        print(f"{tokens.KEYS_ENV} is not set: session tokens will not survive a restart")
     print("Starting Hokm WebSocket server on ws://0.0.0.0:8765")
-    async with websockets.serve(handler, "0.0.0.0", 8765):
-        await asyncio.Future()  # Run forever
+    async with websockets.serve(handler, "0.0.0.0", 8765) as ws_server:
+        stop = asyncio.Event()
+        for sig in (signal.SIGTERM, signal.SIGINT):
+            asyncio.get_running_loop().add_signal_handler(sig, stop.set)
+        await stop.wait()
+        # Lobby rooms live in Redis already: only requests in flight and
+        # players waiting for their room to fill need to finish
+        started = time.perf_counter()
+        ws_server.close(close_connections=False)
+        try:
+            await asyncio.wait_for(asyncio.shield(ws_server.wait_closed()), DRAIN_TIMEOUT)
+        except asyncio.TimeoutError:
+            await asyncio.gather(*(ws.close(1012, 'Server restarting')
+                                   for ws in ws_server.websockets), return_exceptions=True)
+        print(f"Drained in {(time.perf_counter() - started) * 1000:.0f} ms")
 
 if __name__ == "__main__":
     asyncio.run(main())
@@ -0,0 +1,359 @@
+# matchmaking.py
+"""Rating-bucketed matchmaking, matched in batched ticks.
+
+Players wait in one Redis sorted set per game type, ordered by rating
+bucket (``rating // BUCKET_WIDTH``) and, within a bucket, by the time they
+joined. Every TICK seconds the Matchmaker sends everything that happened
+locally since the last tick (joins, leaves, finished games) to Redis in a
+single script call, which also forms the tables. So a tick is one round
+trip however many players joined or matched in it.
+
+Tables are formed from players next to each other in that order. A table
+is taken if its spread of buckets is within the window of its longest
+waiting player: 0 (one bucket) at first, widening by a bucket every
+WIDEN_AFTER seconds up to MAX_WIDEN buckets.
+
+A tick does not read the whole queue. It reads SEEK_SPAN places either side
+of each player who just joined, where new tables are likely, and a window of
+SCAN_WINDOW places that moves through the queue tick by tick, for players
+whose window has widened since. So a tick costs O(joins * SEEK_SPAN +
+SCAN_WINDOW) however long the queue is, and a waiting player is looked at
+again at least every ``queue length / SCAN_WINDOW`` ticks.
+
+Several processes share the queue, but a table is only formed from one
+process's players, since a game is played where its players' sockets
+are. Any tick may form it: a table for another process is pushed to that
+process's mailbox list, and its next tick takes it along with its own.
+A table that comes back with a player who cancelled in the meantime is
+not seated; the others are queued again at their old place.
+
+Ratings are Elo, kept per username in the ``ratings`` hash; a team's
+rating is its players' mean. ``record_result()`` only queues the update,
+and the next tick applies it, so finishing a game costs no round trip.
+Players without a username play at DEFAULT_RATING and are not rated.
+"""
+import asyncio
+import time
+import uuid
+from typing import Awaitable, Callable, Dict, List, Optional, Set, Tuple
+
+import metrics
+from datastore import RedisStore, get_store
+
+TICK = 0.1  # seconds between matchmaking rounds
+BUCKET_WIDTH = 50  # rating points per bucket
+WIDEN_AFTER = 5.0  # seconds of waiting per extra bucket of spread allowed
+MAX_WIDEN = 8  # buckets
+DEFAULT_RATING = 1500
+ELO_K = 32
+RATINGS_KEY = 'ratings'
+MAILBOX_TTL = 60.0  # seconds a table formed for another process waits for it
+SEEK_SPAN = 64  # queue places looked at either side of a player who just joined
+SCAN_WINDOW = 1024  # queue places each tick sweeps for players already waiting
+
+# A queued player's score: bucket * 2^42 + join time in ms. Exact as a
+# double, so one ZRANGE gives bucket order with joins in order inside it.
+BUCKET_SPAN = 2 ** 42
+
+# KEYS[1] = queue, KEYS[2] = ratings, KEYS[3] = this process's mailbox,
+# KEYS[4] = where the sweep got to
+# ARGV = now ms, table size, bucket width, widen ms, max widen, default
+# rating, K, mailbox ttl ms, seek span, scan window, joins, leaves, results,
+# then per join (member,
+# username, join ms), the leaving members, and per result (winner count,
+# loser count, winner names..., loser names...). A member is
+# "<process>:<player id>"; another process's mailbox is KEYS[1]:matched:<process>.
+# Returns the queue length left, then this process's matched members,
+# table by table: those formed now, then those other processes formed for it
+TICK_LUA = """
+local queue, ratings, mailbox, cursor_key = KEYS[1], KEYS[2], KEYS[3], KEYS[4]
+local now, size, width = tonumber(ARGV[1]), tonumber(ARGV[2]), tonumber(ARGV[3])
+local widen_ms, max_widen = tonumber(ARGV[4]), tonumber(ARGV[5])
+local default, k, mailbox_ttl = tonumber(ARGV[6]), tonumber(ARGV[7]), tonumber(ARGV[8])
+local seek, scan = tonumber(ARGV[9]), tonumber(ARGV[10])
+local joins, leaves, results = tonumber(ARGV[11]), tonumber(ARGV[12]), tonumber(ARGV[13])
+local span = 4398046511104  -- BUCKET_SPAN
+local i = 14
+
+local function team_rating(from, count)
+    local total = 0
+    for j = from, from + count - 1 do
+        total = total + tonumber(redis.call('HGET', ratings, ARGV[j]) or default)
+    end
+    return total / count
+end
+
+-- Results first, so players coming back to the queue join at their new rating
+for _ = 1, results do
+    local won, lost = tonumber(ARGV[i]), tonumber(ARGV[i + 1])
+    local winners, losers = i + 2, i + 2 + won
+    local expected = 1 / (1 + 10 ^ ((team_rating(losers, lost) - team_rating(winners, won)) / 400))
+    local delta = k * (1 - expected)
+    for j = winners, losers - 1 do
+        redis.call('HSET', ratings, ARGV[j], tonumber(redis.call('HGET', ratings, ARGV[j]) or default) + delta)
+    end
+    for j = losers, losers + lost - 1 do
+        redis.call('HSET', ratings, ARGV[j], tonumber(redis.call('HGET', ratings, ARGV[j]) or default) - delta)
+    end
+    i = losers + lost
+end
+
+local joined = {}
+for _ = 1, joins do
+    joined[#joined + 1] = ARGV[i]
+    local rating = default
+    if ARGV[i + 1] ~= '' then
+        rating = tonumber(redis.call('HGET', ratings, ARGV[i + 1]) or default)
+    end
+    local bucket = math.max(0, math.floor(rating / width))
+    redis.call('ZADD', queue, 'NX', string.format('%d', bucket * span + tonumber(ARGV[i + 2])), ARGV[i])
+    i = i + 3
+end
+for _ = 1, leaves do
+    redis.call('ZREM', queue, ARGV[i])
+    i = i + 1
+end
+
+-- The windows read this tick, by rank: the sweep's, then one around each
+-- player who joined, merged where they touch
+local count = redis.call('ZCARD', queue)
+local cursor = tonumber(redis.call('GET', cursor_key) or '0')
+if cursor >= count then
+    cursor = 0
+end
+local windows = {{cursor, cursor + scan - 1}}
+for _, member in ipairs(joined) do
+    local rank = redis.call('ZRANK', queue, member)
+    if rank then
+        windows[#windows + 1] = {math.max(0, rank - seek), rank + seek}
+    end
+end
+table.sort(windows, function(a, b) return a[1] < b[1] end)
+local merged = {}
+for _, window in ipairs(windows) do
+    local last = merged[#merged]
+    if last and window[1] <= last[2] + 1 then
+        last[2] = math.max(last[2], window[2])
+    else
+        merged[#merged + 1] = {window[1], window[2]}
+    end
+end
+
+-- In each window, each process's players in queue order: a table is only
+-- formed from one process's players, since a game is played where its
+-- sockets are
+local own = string.match(mailbox, '[^:]*$')
+local matched = {0}
+local removed = {}
+local shift = 0  -- players removed ahead of the sweep's next start
+local tables_for, order = {}, {}
+for _, window in ipairs(merged) do
+    local entries = redis.call('ZRANGE', queue, window[1], window[2], 'WITHSCORES')
+    local nodes, nodes_order = {}, {}
+    for j = 1, #entries / 2 do
+        local node = string.match(entries[2 * j - 1], '^[^:]*')
+        if nodes[node] == nil then
+            nodes[node] = {}
+            nodes_order[#nodes_order + 1] = node
+        end
+        local members = nodes[node]
+        members[#members + 1] = j
+    end
+    for _, node in ipairs(nodes_order) do
+        local members = nodes[node]
+        if tables_for[node] == nil then
+            tables_for[node] = {}
+            order[#order + 1] = node
+        end
+        local tables = tables_for[node]
+        local first = 1
+        while first + size - 1 <= #members do
+            local last = first + size - 1
+            local low = math.floor(tonumber(entries[2 * members[first]]) / span)
+            local oldest = now
+            for j = first, last do
+                oldest = math.min(oldest, tonumber(entries[2 * members[j]]) % span)
+            end
+            local spread = math.floor(tonumber(entries[2 * members[last]]) / span) - low
+            if spread <= math.min(max_widen, math.floor((now - oldest) / widen_ms)) then
+                for j = first, last do
+                    tables[#tables + 1] = entries[2 * members[j] - 1]
+                    removed[#removed + 1] = entries[2 * members[j] - 1]
+                    if window[1] + members[j] - 1 < cursor + scan - seek then
+                        shift = shift + 1
+                    end
+                end
+                first = last + 1
+            else
+                first = first + 1
+            end
+        end
+    end
+end
+-- The next sweep overlaps this one by the seek span, for tables across the edge
+local next_cursor = math.max(cursor + 1, cursor + scan - seek - shift)
+if next_cursor >= count - #removed then
+    next_cursor = 0
+end
+redis.call('SET', cursor_key, next_cursor)
+
+for _, node in ipairs(order) do
+    local tables = tables_for[node]
+    if node == own then
+        for j = 1, #tables do
+            matched[#matched + 1] = tables[j]
+        end
+    elseif #tables > 0 then
+        -- Handed to the owner, which takes them on its next tick
+        local theirs = queue .. ':matched:' .. node
+        for j = 1, #tables, 1000 do
+            redis.call('RPUSH', theirs, unpack(tables, j, math.min(j + 999, #tables)))
+        end
+        redis.call('PEXPIRE', theirs, mailbox_ttl)
+    end
+end
+-- ZREM in slices: unpack() is limited by the Lua stack
+for j = 1, #removed, 1000 do
+    redis.call('ZREM', queue, unpack(removed, j, math.min(j + 999, #removed)))
+end
+
+local delivered = redis.call('LRANGE', mailbox, 0, -1)
+if #delivered > 0 then
+    redis.call('DEL', mailbox)
+    for j = 1, #delivered do
+        matched[#matched + 1] = delivered[j]
+    end
+end
+matched[1] = count - #removed
+return matched
+"""
+
+MATCH_SECONDS = metrics.Histogram(
+    'hokm_matchmaking_wait_seconds', 'Time from join_queue to a table, by game type.',
+    'game_type', buckets=(0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+)
+QUEUED = metrics.Gauge('hokm_matchmaking_queued', 'Players waiting in the queue.', 'game_type')
+TICKS = metrics.Counter('hokm_matchmaking_ticks_total',
+                        'Matchmaking rounds, one Redis round trip each.', 'game_type')
+TABLES = metrics.Counter('hokm_matchmaking_tables_total', 'Tables formed.', 'game_type')
+
+
+class Matchmaker:
+    """Queue for one game type; calls ``on_match(player_ids)`` per table formed."""
+
+    def __init__(self, on_match: Callable[[List[str]], Awaitable[None]],
+                 game_type: str = '4p', table_size: int = 4,
+                 store: Optional[RedisStore] = None, tick: float = TICK):
+        self.on_match = on_match
+        self.game_type = game_type
+        self.table_size = table_size
+        self.store = store or get_store()
+        self.tick_interval = tick
+        self.key = f'matchmaking:{game_type}'
+        # This process's players are queued as "<node>:<player id>"
+        self.node = uuid.uuid4().hex[:12]
+        self.mailbox = f'{self.key}:matched:{self.node}'
+        self.cursor_key = f'{self.key}:cursor'
+        self.script = self.store.register_script(TICK_LUA, 'MATCHMAKING_TICK')
+        # Since the last tick
+        self.joins: Dict[str, Tuple[str, int]] = {}  # player id -> (username, join ms)
+        self.leaves: Set[str] = set()
+        self.results: List[Tuple[List[str], List[str]]] = []
+        # player id -> (perf_counter at join, username, join ms)
+        self.waiting: Dict[str, Tuple[float, str, int]] = {}
+        self.queued = 0  # players in the Redis queue after the last tick
+        self.ticks = 0
+        self.tables = 0
+        self.task: Optional[asyncio.Task] = None
+
+    def enqueue(self, player_id: str, username: Optional[str] = None):
+        if player_id in self.waiting:
+            return
+        self.leaves.discard(player_id)
+        self.joins[player_id] = (username or '', int(time.time() * 1000))
+        self.waiting[player_id] = (time.perf_counter(), *self.joins[player_id])
+        self._wake()
+
+    def cancel(self, player_id: str):
+        if self.waiting.pop(player_id, None) is None:
+            return
+        if self.joins.pop(player_id, None) is None:
+            self.leaves.add(player_id)  # already in Redis
+            self._wake()
+
+    def record_result(self, winners: List[str], losers: List[str]):
+        """Rate a finished game by username; applied on the next tick."""
+        if winners and losers:
+            self.results.append((winners, losers))
+            self._wake()
+
+    def _wake(self):
+        if self.task is None:
+            self.task = asyncio.get_running_loop().create_task(self._run())
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        try:
+            # Ticks stop once nobody here is waiting and nothing is left to send
+            while self.waiting or self.leaves or self.results:
+                due = loop.time() + self.tick_interval
+                await self.tick()
+                await asyncio.sleep(max(0.0, due - loop.time()))
+        finally:
+            self.task = None
+
+    def _tick_args(self) -> list:
+        args = [int(time.time() * 1000), self.table_size, BUCKET_WIDTH,
+                int(WIDEN_AFTER * 1000), MAX_WIDEN, DEFAULT_RATING, ELO_K,
+                int(MAILBOX_TTL * 1000), SEEK_SPAN, SCAN_WINDOW,
+                len(self.joins), len(self.leaves), len(self.results)]
+        for player_id, (username, joined) in self.joins.items():
+            args += (f'{self.node}:{player_id}', username, joined)
+        args.extend(f'{self.node}:{player_id}' for player_id in self.leaves)
+        for winners, losers in self.results:
+            args += (len(winners), len(losers), *winners, *losers)
+        return args
+
+    async def tick(self) -> List[List[str]]:
+        """One round trip: send what changed, get back the tables formed."""
+        args = self._tick_args()
+        joins, leaves, results = self.joins, self.leaves, self.results
+        self.joins, self.leaves, self.results = {}, set(), []
+        try:
+            reply = await self.script(keys=[self.key, RATINGS_KEY, self.mailbox, self.cursor_key],
+                                      args=args)
+        except Exception as e:
+            # The script did nothing; keep it all and retry on the next tick
+            print(f"Matchmaking tick failed ({self.game_type}): {e!r}")
+            joins.update(self.joins)
+            self.joins = joins
+            self.leaves |= leaves - set(joins)
+            self.results[:0] = results
+            return []
+        self.ticks += 1
+        TICKS.inc(self.game_type)
+        self.queued = int(reply[0])
+        QUEUED.set(self.queued, self.game_type)
+        ids = [(p.decode() if isinstance(p, bytes) else p).split(':', 1)[1] for p in reply[1:]]
+        tables = []
+        for i in range(0, len(ids), self.table_size):
+            table = ids[i:i + self.table_size]
+            if all(player_id in self.waiting for player_id in table):
+                tables.append(table)
+                continue
+            # Someone left while the script ran: the rest go back in the queue
+            # at their old place instead of being seated with a missing player
+            for player_id in table:
+                self.leaves.discard(player_id)  # already out of Redis
+                if player_id in self.waiting:
+                    self.joins[player_id] = self.waiting[player_id][1:]
+        now = time.perf_counter()
+        for table in tables:
+            for player_id in table:
+                self.joins.pop(player_id, None)  # left and came back mid-tick
+                MATCH_SECONDS.observe(now - self.waiting.pop(player_id)[0], self.game_type)
+        self.tables += len(tables)
+        TABLES.inc(self.game_type, len(tables))
+        for table in tables:
+            await self.on_match(table)
+        return tables
@@ -0,0 +1,309 @@
+# metrics.py
+"""Counters, latency histograms and gauges, exported as Prometheus text.
+
+Metrics are off until ``enable()`` is called. While off, every
+instrumentation call returns after a single flag check, so call sites
+need no ``if`` of their own. Message handlers are wrapped in
+``with metrics.timed(msg_type):``; other hot paths time themselves:
+
+    started = metrics.start()
+    ...
+    BOT_SECONDS.observe_since(started)
+
+``enable(port)`` also serves ``/metrics`` on a side HTTP port and starts
+an event-loop lag monitor. ``profile_handler(name, rate)`` samples a
+fraction of one handler's calls under cProfile; ``/profile`` shows the
+accumulated top functions.
+"""
+import asyncio
+import bisect
+import cProfile
+import io
+import pstats
+import random
+import time
+from typing import Callable, Dict, List, Optional, Tuple
+
+from protocol import TYPE_IDS
+
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+LOOP_LAG_INTERVAL = 0.25  # seconds between event-loop lag probes
+
+enabled = False
+_registry: List['_Metric'] = []
+_background = []  # lag monitor task and HTTP server, kept referenced
+
+
+def start() -> Optional[float]:
+    """Timestamp for ``observe_since``, or None while metrics are off."""
+    return time.perf_counter() if enabled else None
+
+
+def _label_text(label_name: Optional[str], label) -> str:
+    if label_name is None or label is None:
+        return ''
+    value = str(label).replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n')
+    return f'{{{label_name}="{value}"}}'
+
+
+class _Metric:
+    kind = ''
+
+    def __init__(self, name: str, help: str, label: Optional[str] = None):
+        self.name = name
+        self.help = help
+        self.label = label
+        _registry.append(self)
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        lines.extend(self.samples())
+        return lines
+
+    def samples(self) -> List[str]:
+        raise NotImplementedError
+
+
+class Counter(_Metric):
+    kind = 'counter'
+
+    def __init__(self, name: str, help: str, label: Optional[str] = None):
+        super().__init__(name, help, label)
+        self.values: Dict[object, float] = {}
+
+    def inc(self, label=None, amount: float = 1):
+        if enabled:
+            self.values[label] = self.values.get(label, 0) + amount
+
+    def samples(self) -> List[str]:
+        return [f"{self.name}{_label_text(self.label, k)} {v}" for k, v in self.values.items()]
+
+
+class Gauge(_Metric):
+    """A value set by the code, or read from ``callback`` at scrape time."""
+
+    kind = 'gauge'
+
+    def __init__(self, name: str, help: str, label: Optional[str] = None,
+                 callback: Callable[[], Dict[object, float]] = None):
+        super().__init__(name, help, label)
+        self.values: Dict[object, float] = {}
+        self.callback = callback
+
+    def set(self, value: float, label=None):
+        if enabled:
+            self.values[label] = value
+
+    def inc(self, label=None, amount: float = 1):
+        if enabled:
+            self.values[label] = self.values.get(label, 0) + amount
+
+    def dec(self, label=None, amount: float = 1):
+        self.inc(label, -amount)
+
+    def samples(self) -> List[str]:
+        values = self.callback() if self.callback else self.values
+        return [f"{self.name}{_label_text(self.label, k)} {v}" for k, v in values.items()]
+
+
+class Histogram(_Metric):
+    kind = 'histogram'
+
+    def __init__(self, name: str, help: str, label: Optional[str] = None,
+                 buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        super().__init__(name, help, label)
+        self.buckets = buckets
+        self.series: Dict[object, list] = {}  # label -> [counts..., sum, count]
+
+    def observe(self, value: float, label=None):
+        if not enabled:
+            return
+        series = self.series.get(label)
+        if series is None:
+            series = self.series[label] = [0] * (len(self.buckets) + 2)
+        series[bisect.bisect_left(self.buckets, value)] += 1
+        series[-2] += value
+        series[-1] += 1
+
+    def observe_since(self, started: Optional[float], label=None):
+        if started is not None:
+            self.observe(time.perf_counter() - started, label)
+
+    def samples(self) -> List[str]:
+        lines = []
+        for label, series in self.series.items():
+            base = _label_text(self.label, label)[1:-1]
+            sep = ',' if base else ''
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), series):
+                cumulative += count
+                le = '+Inf' if bound == float('inf') else repr(bound)
+                lines.append(f'{self.name}_bucket{{{base}{sep}le="{le}"}} {cumulative}')
+            labels = _label_text(self.label, label)
+            lines.append(f"{self.name}_sum{labels} {series[-2]}")
+            lines.append(f"{self.name}_count{labels} {series[-1]}")
+        return lines
+
+
+# Shared by server.py, network.py, flowcontrol.py and datastore.py
+MESSAGES = Counter('hokm_messages_total', 'Client messages handled, by type.', 'type')
+MESSAGE_SECONDS = Histogram('hokm_message_seconds', 'Time to handle a client message.', 'type')
+MALFORMED = Counter('hokm_malformed_messages_total', 'Frames that failed to decode.')
+FRAMES_SENT = Counter('hokm_frames_sent_total', 'Frames sent to clients, by message type.', 'type')
+SEND_FAILURES = Counter('hokm_send_failures_total', 'Frames that could not be sent.', 'type')
+OUTBOX_DROPS = Counter('hokm_outbox_drops_total',
+                       'Frames not sent because a client fell behind, by outcome.', 'outcome')
+RATE_LIMITED = Counter('hokm_rate_limited_total', 'Inbound frames refused by the rate limit.')
+CONNECTIONS = Gauge('hokm_connections', 'Open client connections.')
+LOOP_LAG = Histogram('hokm_event_loop_lag_seconds', 'How late the event loop ran a timer.')
+REDIS_SECONDS = Histogram('hokm_redis_command_seconds', 'Redis command latency.', 'command')
+BOT_SECONDS = Histogram('hokm_bot_decision_seconds', 'Time for a bot decision, including the pool.')
+
+
+class _Timed:
+    """Counts, times and maybe profiles one handler call."""
+
+    __slots__ = ('label', 'started', 'profile')
+
+    def __init__(self, label):
+        self.label = label
+
+    def __enter__(self):
+        self.started = start()
+        self.profile = profiler.begin(self.label)
+        return self
+
+    def __exit__(self, *exc):
+        profiler.end(self.profile)
+        MESSAGES.inc(self.label)
+        MESSAGE_SECONDS.observe_since(self.started, self.label)
+
+
+class _NotTimed:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        pass
+
+
+_NOT_TIMED = _NotTimed()
+
+
+def timed(message_type: str):
+    """Context manager around a message handler: ``with metrics.timed(t):``."""
+    if not enabled and message_type != profiler.handler:
+        return _NOT_TIMED
+    # Clients choose the type, so unknown ones share a label
+    if not isinstance(message_type, str) or message_type not in TYPE_IDS:
+        message_type = 'other'
+    return _Timed(message_type)
+
+
+def render() -> str:
+    lines = []
+    for metric in _registry:
+        lines.extend(metric.render())
+    return '\n'.join(lines) + '\n'
+
+
+async def monitor_loop_lag(interval: float = LOOP_LAG_INTERVAL):
+    """Sleep repeatedly and record how much later than asked each wakeup was."""
+    loop = asyncio.get_running_loop()
+    while True:
+        expected = loop.time() + interval
+        await asyncio.sleep(interval)
+        LOOP_LAG.observe(max(0.0, loop.time() - expected))
+
+
+class _Profiler:
+    """Profiles a random sample of calls to one named handler."""
+
+    def __init__(self):
+        self.handler: Optional[str] = None
+        self.rate = 0.0
+        self.active = False
+        self.samples = 0
+        self.stats: Optional[pstats.Stats] = None
+
+    def begin(self, name: str) -> Optional[cProfile.Profile]:
+        # Only one profiler can run at a time, and while it does it also
+        # sees whatever other tasks the handler yields to
+        if name != self.handler or self.active or random.random() >= self.rate:
+            return None
+        self.active = True
+        profile = cProfile.Profile()
+        profile.enable()
+        return profile
+
+    def end(self, profile: Optional[cProfile.Profile]):
+        if profile is None:
+            return
+        profile.disable()
+        self.active = False
+        self.samples += 1
+        if self.stats is None:
+            self.stats = pstats.Stats(profile)
+        else:
+            self.stats.add(profile)
+
+    def report(self, limit: int = 40) -> str:
+        if self.stats is None:
+            return f"No samples of {self.handler!r} yet\n"
+        out = io.StringIO()
+        self.stats.stream = out
+        print(f"{self.samples} sampled calls of {self.handler!r}", file=out)
+        self.stats.sort_stats('cumulative').print_stats(limit)
+        return out.getvalue()
+
+
+profiler = _Profiler()
+
+
+def profile_handler(name: Optional[str], rate: float = 0.01):
+    """Profile about ``rate`` of the calls to handler ``name`` (None: off)."""
+    profiler.handler = name
+    profiler.rate = rate
+    profiler.stats = None
+    profiler.samples = 0
+
+
+async def _http(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+    try:
+        request = await reader.readline()
+        while (await reader.readline()).strip():
+            pass  # headers are not needed
+        path = request.split()[1].decode() if len(request.split()) > 1 else '/'
+        if path == '/metrics':
+            status, body = '200 OK', render()
+        elif path == '/profile':
+            status, body = '200 OK', profiler.report()
+        else:
+            status, body = '404 Not Found', 'Try /metrics or /profile\n'
+        payload = body.encode()
+        writer.write(
+            f"HTTP/1.1 {status}\r\nContent-Type: text/plain; version=0.0.4\r\n"
+            f"Content-Length: {len(payload)}\r\nConnection: close\r\n\r\n".encode() + payload
+        )
+        await writer.drain()
+    except (ConnectionError, asyncio.IncompleteReadError):
+        pass
+    finally:
+        writer.close()
+
+
+async def enable(port: Optional[int] = None, host: str = '0.0.0.0'):
+    """Start collecting; with a port, also serve /metrics and /profile."""
+    global enabled
+    enabled = True
+    _background.append(asyncio.create_task(monitor_loop_lag()))
+    if port is not None:
+        _background.append(await asyncio.start_server(_http, host, port))
+        print(f"Metrics on http://{host}:{port}/metrics")
+
+
+def disable():
+    global enabled
+    enabled = False
@@ -1,29 +1,88 @@
 # network.py (Backend)
-import asyncio
-import json
 import uuid
-import redis
 import websockets
 from websockets.server import serve, WebSocketServerProtocol
-from typing import Dict, Optional
+from typing import Dict, Iterable, List, Optional, Tuple
+import metrics
+import tokens
+from auth import AuthBusy, authenticate_user_async
+from datastore import RedisStore, get_store
+from flowcontrol import MAX_STRIKES, FrameDropped, TokenBucket, outbox_for
+from gamelog import GameLog, RedisStreamLog
+from engine import NUM_PLAYERS, TEAM_OF, HokmGame, IllegalMove, hand_names
+from matchmaking import Matchmaker
+from protocol import codec_for
+from statesync import RoomSync, hands_changed
+from timerwheel import IdleTimer
+
+IDLE_TIMEOUT = 300.0  # seconds a connection may go without sending a frame, keepalives included
+EVICTIONS = metrics.Counter('hokm_evictions_total', 'Idle connections and rooms closed, by kind.',
+                            'kind')
+
+def sync_message(room_id: str, game: HokmGame, sync: RoomSync, seat: int,
+                 last_seq) -> dict:
+    """Catch-up fields for a client that last saw ``last_seq``."""
+    message = {'room_id': room_id, 'seq': sync.seq, 'seat': seat,
+               'hand': hand_names(game.hands[seat])}
+    deltas = sync.since(last_seq) if isinstance(last_seq, int) else None
+    if deltas is None:
+        message['state'] = game.public_state()
+    else:
+        message['deltas'] = deltas
+    return message
 
 class NetworkManager:
-    def __init__(self):
-        self.redis = redis.Redis(host='localhost', port=6379, db=0)
+    def __init__(self, store: Optional[RedisStore] = None, game_log: Optional[GameLog] = None):
+        self.redis = store or get_store()
+        self.game_log = game_log or GameLog(RedisStreamLog(self.redis))
+        # One queue per game type, matched in ticks (see matchmaking.py)
+        self.matchmakers: Dict[str, Matchmaker] = {
+            game_type: Matchmaker(
+                lambda player_ids, game_type=game_type: self.create_game(player_ids, game_type),
+                game_type, table_size, self.redis
+            )
+            for game_type, table_size in (('4p', 4), ('2p', 2))
+        }
         self.active_connections: Dict[str, WebSocketServerProtocol] = {}
+        self.usernames: Dict[str, str] = {}  # player id -> authenticated username
         self.player_rooms: Dict[str, str] = {}
+        self.games: Dict[str, HokmGame] = {}
+        self.game_players: Dict[str, List[str]] = {}
+        self.game_usernames: Dict[str, List[Optional[str]]] = {}  # by seat, at the start
+        self.syncs: Dict[str, RoomSync] = {}
 
     async def handle_connection(self, websocket):
         """Main WebSocket connection handler"""
         player_id = str(uuid.uuid4())
         self.active_connections[player_id] = websocket
+        bucket = TokenBucket()
+        idle = IdleTimer(IDLE_TIMEOUT, self.evict_idle, websocket)
         
         try:
             async for message in websocket:
-                await self.route_message(player_id, json.loads(message))
+                idle.touch()
+                if await self.rate_limited(websocket, bucket):
+                    continue
+                try:
+                    data = codec_for(websocket).decode(message)
+                except ValueError:
+                    metrics.MALFORMED.inc()
+                    await self.send(player_id, {'type': 'error', 'message': 'Malformed message'})
+                    continue
+                await self.route_message(player_id, data)
         except websockets.ConnectionClosed:
+            pass
+        finally:
+            # A clean close ends the loop without raising
+            idle.cancel()
             await self.handle_disconnect(player_id)
 
+    @staticmethod
+    async def evict_idle(websocket):
+        """Close a connection that went IDLE_TIMEOUT without a frame."""
+        EVICTIONS.inc('connection')
+        await websocket.close(1001, 'Idle timeout')
+
     async def route_message(self, player_id: str, data: dict):
         """Route incoming messages to appropriate handlers"""
         msg_type = data.get('type')
@@ -31,79 +90,155 @@ class NetworkManager:
             'authenticate': self.handle_auth,
             'join_queue': self.handle_queue,
             'play_card': self.handle_game_action,
-            'keepalive': lambda pid, d: None
+            'choose_trump': self.handle_game_action,
+            'sync': self.handle_sync,
+            'keepalive': self.handle_keepalive
         }.get(msg_type)
         
         if handler:
-            await handler(player_id, data)
+            with metrics.timed(msg_type):
+                await handler(player_id, data)
         else:
             await self.send(player_id, {'type': 'error', 'message': 'Invalid message type'})
 
+    async def handle_keepalive(self, player_id: str, data: dict):
+        """Nothing to do: every frame already counts as activity"""
+
     async def handle_auth(self, player_id: str, data: dict):
-        """Authentication handler"""
-        # Implement your actual auth logic here
-        success = True  # Replace with real auth check
+        """Log in with a session token, or with a password for a new token"""
+        session = tokens.verify(data.get('token'))
+        if session is not None:
+            # Checked locally: no bcrypt and no user store round trip
+            self.usernames[player_id] = session.username
+            await self.send(player_id, {'type': 'auth_success', 'token': data['token']})
+            return
+        username, password = data.get('username'), data.get('password')
+        if not isinstance(username, str) or not isinstance(password, str):
+            await self.send(player_id, {'type': 'auth_failed'})
+            return
+        try:
+            success = await authenticate_user_async(username, password)
+        except AuthBusy:
+            await self.send(player_id, {'type': 'error', 'message': 'Server busy, try again'})
+            return
         if success:
-            await self.send(player_id, {
-                'type': 'auth_success',
-                'token': 'generated_jwt_token'
-            })
+            self.usernames[player_id] = username
+            await self.send(player_id, {'type': 'auth_success', 'token': tokens.issue(username)})
         else:
             await self.send(player_id, {'type': 'auth_failed'})
 
     async def handle_queue(self, player_id: str, data: dict):
-        """Matchmaking queue handler"""
-        game_type = data.get('game_type', '4p')
-        lobby_key = f'lobby:{game_type}'
-        
-        # Add to Redis queue
-        self.redis.rpush(lobby_key, player_id)
-        
-        # Check if ready to start game
-        queue_size = self.redis.llen(lobby_key)
-        if queue_size >= (4 if game_type == '4p' else 2):
-            players = [self.redis.lpop(lobby_key).decode() for _ in range(queue_size)]
-            await self.create_game(players, game_type)
+        """Matchmaking queue handler; the table is formed on a later tick"""
+        matchmaker = self.matchmakers.get(data.get('game_type', '4p'))
+        if matchmaker is None:
+            await self.send(player_id, {'type': 'error', 'message': 'Unknown game type'})
+            return
+        matchmaker.enqueue(player_id, self.usernames.get(player_id))
+
+    async def handle_disconnect(self, player_id: str):
+        """Forget a closed connection, take it out of any queue and drop its table once empty"""
+        self.active_connections.pop(player_id, None)
+        self.usernames.pop(player_id, None)
+        for matchmaker in self.matchmakers.values():
+            matchmaker.cancel(player_id)
+        room_id = self.player_rooms.pop(player_id, None)
+        if room_id is not None and not any(
+            pid in self.active_connections for pid in self.game_players.get(room_id, ())
+        ):
+            self.close_game(room_id)
+
+    def close_game(self, room_id: str):
+        """Forget a finished or abandoned table"""
+        for pid in self.game_players.pop(room_id, ()):
+            if self.player_rooms.get(pid) == room_id:
+                del self.player_rooms[pid]
+        self.game_usernames.pop(room_id, None)
+        self.games.pop(room_id, None)
+        self.syncs.pop(room_id, None)
+        self.game_log.finish(room_id)
 
     async def create_game(self, player_ids: list, game_type: str):
         """Initialize new game room"""
         room_id = str(uuid.uuid4())[:8]
-        game_state = {
-            'players': player_ids,
-            'status': 'starting',
-            'trump_suit': None,
-            'current_turn': 0
-        }
-        
-        # Store in Redis
-        self.redis.hset(f'game:{room_id}', mapping=game_state)
-        
-        # Notify players
         for pid in player_ids:
             self.player_rooms[pid] = room_id
-            await self.send(pid, {
-                'type': 'game_start',
+        self.game_players[room_id] = player_ids
+
+        if len(player_ids) != NUM_PLAYERS:
+            self.game_log.open(room_id, players=player_ids, game_type=game_type)
+            connections = [ws for ws in self.connections_for(player_ids) if ws is not None]
+            await self.broadcast(connections, 'game_start', {
                 'room_id': room_id,
                 'players': player_ids
             })
+            return
+
+        game = HokmGame()
+        sync = RoomSync()
+        self.games[room_id] = game
+        self.game_usernames[room_id] = [self.usernames.get(pid) for pid in player_ids]
+        self.syncs[room_id] = sync
+        # Persisted as an append-only log; the write happens off the request path
+        self.game_log.open(room_id, game, players=player_ids, game_type=game_type)
+        events = game.start_hand()
+        self.game_log.append(room_id, None, {'type': 'start_hand'}, game)
+        await self.broadcast_game(
+            self.connections_for(player_ids), room_id, game, events, sync.record(events),
+            message_type='game_start', extra={'players': player_ids}, snapshot=True
+        )
 
     async def handle_game_action(self, player_id: str, data: dict):
         """Handle in-game actions"""
         room_id = self.player_rooms.get(player_id)
-        if not room_id:
+        game = self.games.get(room_id)
+        if game is None:
             return
-            
-        # Validate game state
-        game_state = self.redis.hgetall(f'game:{room_id}')
-        if not game_state:
+
+        # The engine is authoritative: reject anything the rules do not allow
+        player_ids = self.game_players[room_id]
+        seat = player_ids.index(player_id)
+        try:
+            events = game.apply(seat, data)
+        except IllegalMove as e:
+            await self.send(player_id, {'type': 'error', 'message': str(e)})
+            return
+        self.game_log.append(room_id, seat, data, game)
+
+        seq = self.syncs[room_id].record(events)
+        await self.broadcast_game(self.connections_for(player_ids), room_id, game, events, seq)
+        if game.phase == 'match_over':
+            self.rate_game(self.game_usernames[room_id], events[-1]['team'])
+            self.close_game(room_id)
+
+    def rate_game(self, usernames: List[Optional[str]], winning_team: int):
+        """Queue the Elo update for a finished game; signed-in players only"""
+        teams = ([], [])
+        for seat, username in enumerate(usernames):
+            if username is not None:
+                teams[TEAM_OF[seat] != winning_team].append(username)
+        self.matchmakers['4p'].record_result(*teams)
+
+    async def handle_sync(self, player_id: str, data: dict):
+        """Resend the deltas a client missed, or a snapshot"""
+        room_id = self.player_rooms.get(player_id)
+        game = self.games.get(room_id)
+        if game is None:
             return
+        seat = self.game_players[room_id].index(player_id)
+        await self.send(player_id, {'type': 'sync', **sync_message(
+            room_id, game, self.syncs[room_id], seat, data.get('last_seq', 0)
+        )})
 
-        # Broadcast to other players
-        for pid in json.loads(game_state[b'players']):
-            if pid != player_id:
-                await self.send(pid, {
-                    'type': 'game_update'
-                })
+    def connections_for(self, player_ids: List[str]) -> List[Optional[WebSocketServerProtocol]]:
+        return [self.active_connections.get(pid) for pid in player_ids]
+
+    async def send(self, player_id: str, message: dict):
+        """Send a message to a connected player by id"""
+        websocket = self.active_connections.get(player_id)
+        if websocket is None:
+            return
+        message = dict(message)
+        await self.send_message(websocket, message.pop('type'), message)
 
     @staticmethod
     async def send_message(
@@ -111,23 +246,114 @@ class NetworkManager:
         message_type: str,
         data: dict = None
     ):
-        """Send a JSON message over the websocket."""
-        message = {"type": message_type}
-        if data:
-            message.update(data)
-        try:
-            await websocket.send(json.dumps(message))
-        except websockets.ConnectionClosed:
-            print("Connection closed while sending message")
+        """Queue a message in the encoding negotiated for the websocket.
+
+        Frames go through the websocket's outbox (see flowcontrol.py), so
+        this returns without waiting for the client to read them.
+        """
+        outbox_for(websocket).put(message_type, codec_for(websocket).encode(message_type, data))
+
+    @staticmethod
+    async def rate_limited(websocket: WebSocketServerProtocol, bucket: TokenBucket) -> bool:
+        """Charge an inbound frame to ``bucket``; True if it must be dropped undecoded."""
+        if bucket.take():
+            return False
+        metrics.RATE_LIMITED.inc()
+        if bucket.strikes == 1:
+            await NetworkManager.send_message(websocket, 'error', {
+                'message': 'Too many messages, slow down.'
+            })
+        elif bucket.strikes == MAX_STRIKES:
+            await websocket.close(1008, 'Rate limit exceeded')
+        return True
+
+    @staticmethod
+    async def broadcast(
+        connections: Iterable[WebSocketServerProtocol],
+        message_type: str,
+        data: dict = None,
+        per_recipient: Optional[List[dict]] = None
+    ) -> List[Tuple[WebSocketServerProtocol, Exception]]:
+        """Queue one message for many websockets.
+
+        The shared part of the frame is serialized once per encoding in
+        use. ``per_recipient``, if given, holds one dict of extra fields per
+        websocket (for example ``player_number``); those fields are appended
+        to the shared frame and must not repeat keys from ``data``.
+
+        Returns a list of ``(websocket, FrameDropped)`` for frames that
+        could not be queued instead of raising. Each outbox reports the
+        frames it later fails to write in the send failure metrics.
+        """
+        connections = list(connections)
+        if not connections:
+            return []
+        codecs = [codec_for(ws) for ws in connections]
+        heads = {}
+        for codec in codecs:
+            if codec not in heads:
+                heads[codec] = codec.encode_head(message_type, data)
+        if per_recipient is None:
+            finished = {codec: codec.finish(head) for codec, head in heads.items()}
+            frames = [finished[codec] for codec in codecs]
+        else:
+            frames = [
+                codec.finish(heads[codec], extra)
+                for codec, extra in zip(codecs, per_recipient)
+            ]
+        failed = []
+        for ws, frame in zip(connections, frames):
+            reason = outbox_for(ws).put(message_type, frame)
+            if reason is not None:
+                failed.append((ws, FrameDropped(reason)))
+        return failed
+
+    @staticmethod
+    async def broadcast_game(
+        connections: List[Optional[WebSocketServerProtocol]],
+        room_id: str,
+        game: HokmGame,
+        events: List[dict],
+        seq: int,
+        message_type: str = 'game_update',
+        extra: dict = None,
+        snapshot: bool = False,
+        per_seat: Optional[Dict[int, dict]] = None
+    ) -> List[Tuple[WebSocketServerProtocol, Exception]]:
+        """Send a numbered delta of game events to the seats of a table.
+
+        ``connections`` is indexed by seat; ``None`` entries are skipped.
+        The public state is only included when ``snapshot`` is set, and a
+        seat's hand only when it changed in a way the client cannot derive.
+        ``per_seat`` adds further private fields for individual seats.
+        """
+        data = {'room_id': room_id, 'seq': seq, 'events': events}
+        if snapshot:
+            data['state'] = game.public_state()
+        if extra:
+            data.update(extra)
+        send_hands = snapshot or hands_changed(events)
+        seats = [seat for seat, ws in enumerate(connections) if ws is not None]
+        per_recipient = []
+        for seat in seats:
+            fields = {'seat': seat}
+            if send_hands:
+                fields['hand'] = hand_names(game.hands[seat])
+            if per_seat and seat in per_seat:
+                fields.update(per_seat[seat])
+            per_recipient.append(fields)
+        return await NetworkManager.broadcast(
+            [connections[seat] for seat in seats], message_type, data, per_recipient
+        )
 
     @staticmethod
     async def receive_message(websocket):
         try:
             message = await websocket.recv()
-            return json.loads(message)
+            return codec_for(websocket).decode(message)
         except websockets.ConnectionClosed:
             print("Connection closed while receiving message")
             return None
-        except json.JSONDecodeError:
-            print("Invalid JSON received")
+        except ValueError:
+            print("Malformed message received")
             return None
@@ -1,13 +1,26 @@
 # player.py
+import sys
 from dataclasses import dataclass
 from typing import Optional
 import websockets
 
-@dataclass
+@dataclass(slots=True)
 class Player:
+    # Slotted: one of these lives for every open connection, so no __dict__
     player_id: str
     wsconnection: websockets.WebSocketServerProtocol
     username: Optional[str] = None
     currentgame: Optional[str] = None
-    hand: list = None
+    hand: int = 0  # 52-bit card mask, see engine.py
     isready: bool = False
+    is_bot: bool = False
+    current_room: Optional[str] = None
+    seat: int = -1  # index into rooms[current_room], -1 when not seated
+
+    def __post_init__(self):
+        self.username = intern_name(self.username)
+
+
+def intern_name(username: Optional[str]) -> Optional[str]:
+    """Share one string object between every session with the same name."""
+    return sys.intern(username) if isinstance(username, str) else username
@@ -0,0 +1,266 @@
+# protocol.py
+"""Wire encodings, negotiated per connection as a websocket subprotocol.
+
+``hokm.json`` is the plain JSON every client understands. ``hokm.bin1`` is
+a compact binary form of the same messages:
+
+    frame := type_id:u8 [type:str if type_id == 0] field*
+    field := key value
+    key   := key_id:u8 | 0xFF str
+
+Known message types and keys become one byte, cards one byte, hands a
+7-byte mask. Fields are self-delimiting, so a shared frame and
+per-recipient fields can be encoded separately and concatenated.
+Connections that negotiate no subprotocol fall back to JSON.
+"""
+import json
+import struct
+from typing import Union
+
+from engine import CARD_INDEX, CARD_NAMES, cards_of, mask_of
+
+JSON_SUBPROTOCOL = 'hokm.json'
+BINARY_SUBPROTOCOL = 'hokm.bin1'
+# Server preference order
+SUBPROTOCOLS = [BINARY_SUBPROTOCOL, JSON_SUBPROTOCOL]
+
+MESSAGE_TYPES = [
+    None,  # 0: type name follows as a string
+    'error', 'room_full', 'room_joined', 'room_status', 'game_start',
+    'game_update', 'join_room', 'create_room', 'choose_trump', 'play_card',
+    'add_bots', 'keepalive', 'authenticate', 'auth_success', 'auth_failed',
+    'join_queue', 'sync', 'resume', 'resumed', 'spectate', 'spectating',
+]
+KEYS = [
+    None,  # 0: unused
+    'message', 'room_id', 'room_code', 'username', 'usernames',
+    'player_number', 'total_players', 'players', 'events', 'state', 'seat',
+    'hand', 'event', 'card', 'suit', 'hakem', 'turn', 'trick', 'tricks',
+    'scores', 'phase', 'trump', 'team', 'points', 'hand_number', 'token',
+    'game_type', 'seq', 'deltas', 'last_seq', 'resume_token', 'viewers',
+]
+TYPE_IDS = {name: i for i, name in enumerate(MESSAGE_TYPES) if name}
+KEY_IDS = {name: i for i, name in enumerate(KEYS) if name}
+RAW_KEY = 0xFF
+
+# Value tags
+T_NONE, T_FALSE, T_TRUE, T_INT, T_FLOAT, T_STR, T_LIST, T_DICT, T_CARD, T_CARDS, T_MASK = range(11)
+MASK_MIN_CARDS = 8  # below this a plain card list is smaller than a mask
+
+
+def _varint(n: int, out: bytearray):
+    while n > 0x7F:
+        out.append((n & 0x7F) | 0x80)
+        n >>= 7
+    out.append(n)
+
+
+def _str(s: str, out: bytearray):
+    raw = s.encode()
+    _varint(len(raw), out)
+    out += raw
+
+
+def _value(v, out: bytearray):
+    if v is None:
+        out.append(T_NONE)
+    elif v is True:
+        out.append(T_TRUE)
+    elif v is False:
+        out.append(T_FALSE)
+    elif isinstance(v, int):
+        out.append(T_INT)
+        _varint(v << 1 if v >= 0 else (-v << 1) - 1, out)  # zigzag
+    elif isinstance(v, float):
+        out.append(T_FLOAT)
+        out += struct.pack('<d', v)
+    elif isinstance(v, str):
+        card = CARD_INDEX.get(v)
+        if card is not None:
+            out.append(T_CARD)
+            out.append(card)
+        else:
+            out.append(T_STR)
+            _str(v, out)
+    elif isinstance(v, (list, tuple)):
+        _list(v, out)
+    elif isinstance(v, dict):
+        out.append(T_DICT)
+        _varint(len(v), out)
+        _fields(v, out)
+    else:
+        raise TypeError(f"Cannot encode {type(v).__name__}")
+
+
+def _list(items, out: bytearray):
+    cards = [CARD_INDEX.get(v) if isinstance(v, str) else None for v in items]
+    if items and None not in cards:
+        if len(cards) >= MASK_MIN_CARDS and all(a < b for a, b in zip(cards, cards[1:])):
+            # Sorted hands without repeats round-trip exactly through a mask
+            out.append(T_MASK)
+            out += mask_of(cards).to_bytes(7, 'little')
+        else:
+            out.append(T_CARDS)
+            _varint(len(cards), out)
+            out += bytes(cards)
+        return
+    out.append(T_LIST)
+    _varint(len(items), out)
+    for item in items:
+        _value(item, out)
+
+
+def _fields(data: dict, out: bytearray):
+    for key, value in data.items():
+        key_id = KEY_IDS.get(key)
+        if key_id is None:
+            out.append(RAW_KEY)
+            _str(key, out)
+        else:
+            out.append(key_id)
+        _value(value, out)
+
+
+class _Reader:
+    __slots__ = ('buf', 'pos')
+
+    def __init__(self, buf: bytes):
+        self.buf = buf
+        self.pos = 0
+
+    def byte(self) -> int:
+        b = self.buf[self.pos]
+        self.pos += 1
+        return b
+
+    def varint(self) -> int:
+        shift = n = 0
+        while True:
+            b = self.byte()
+            n |= (b & 0x7F) << shift
+            if b < 0x80:
+                return n
+            shift += 7
+
+    def take(self, size: int) -> bytes:
+        chunk = self.buf[self.pos:self.pos + size]
+        if len(chunk) < size:
+            raise IndexError(f"{size} bytes wanted, {len(chunk)} left")
+        self.pos += size
+        return chunk
+
+    def text(self) -> str:
+        return self.take(self.varint()).decode()
+
+    def key(self) -> str:
+        key_id = self.byte()
+        return self.text() if key_id == RAW_KEY else KEYS[key_id]
+
+    def value(self):
+        tag = self.byte()
+        if tag == T_NONE:
+            return None
+        if tag == T_TRUE:
+            return True
+        if tag == T_FALSE:
+            return False
+        if tag == T_INT:
+            n = self.varint()
+            return (n >> 1) ^ -(n & 1)
+        if tag == T_FLOAT:
+            return struct.unpack('<d', self.take(8))[0]
+        if tag == T_STR:
+            return self.text()
+        if tag == T_CARD:
+            return CARD_NAMES[self.byte()]
+        if tag == T_CARDS:
+            return [CARD_NAMES[c] for c in self.take(self.varint())]
+        if tag == T_MASK:
+            return [CARD_NAMES[c] for c in cards_of(int.from_bytes(self.take(7), 'little'))]
+        if tag == T_LIST:
+            return [self.value() for _ in range(self.varint())]
+        if tag == T_DICT:
+            return {self.key(): self.value() for _ in range(self.varint())}
+        raise ValueError(f"Unknown value tag {tag}")
+
+
+def _json_message(raw: Union[str, bytes]) -> dict:
+    try:
+        message = json.loads(raw)
+    except RecursionError:
+        raise ValueError("JSON frame nested too deeply") from None
+    if not isinstance(message, dict):
+        # Valid JSON, but handlers call message.get()
+        raise ValueError(f"Expected a JSON object, got {type(message).__name__}")
+    return message
+
+
+class JsonCodec:
+    subprotocol = JSON_SUBPROTOCOL
+
+    def encode(self, message_type: str, data: dict = None) -> str:
+        message = {"type": message_type}
+        if data:
+            message.update(data)
+        return json.dumps(message)
+
+    def encode_head(self, message_type: str, data: dict = None) -> str:
+        # Frame without its closing brace, ready for per-recipient fields
+        return self.encode(message_type, data)[:-1]
+
+    def finish(self, head: str, extra: dict = None) -> str:
+        if not extra:
+            return head + "}"
+        return head + ", " + json.dumps(extra)[1:]
+
+    def decode(self, raw: Union[str, bytes]) -> dict:
+        return _json_message(raw)
+
+
+class BinaryCodec:
+    subprotocol = BINARY_SUBPROTOCOL
+
+    def encode(self, message_type: str, data: dict = None) -> bytes:
+        return self.finish(self.encode_head(message_type, data))
+
+    def encode_head(self, message_type: str, data: dict = None) -> bytes:
+        out = bytearray()
+        type_id = TYPE_IDS.get(message_type, 0)
+        out.append(type_id)
+        if not type_id:
+            _str(message_type, out)
+        if data:
+            _fields(data, out)
+        return bytes(out)
+
+    def finish(self, head: bytes, extra: dict = None) -> bytes:
+        if not extra:
+            return head
+        out = bytearray(head)
+        _fields(extra, out)
+        return bytes(out)
+
+    def decode(self, raw: Union[str, bytes]) -> dict:
+        if isinstance(raw, str):
+            # Peers may still send text frames; those are always JSON
+            return _json_message(raw)
+        reader = _Reader(raw)
+        try:
+            type_id = reader.byte()
+            message = {'type': reader.text() if not type_id else MESSAGE_TYPES[type_id]}
+            while reader.pos < len(raw):
+                key = reader.key()
+                message[key] = reader.value()
+        except (IndexError, UnicodeDecodeError, struct.error, RecursionError) as e:
+            raise ValueError(f"Malformed binary frame: {e}") from None
+        return message
+
+
+JSON = JsonCodec()
+BINARY = BinaryCodec()
+CODECS = {JSON_SUBPROTOCOL: JSON, BINARY_SUBPROTOCOL: BINARY}
+
+
+def codec_for(websocket) -> Union[JsonCodec, BinaryCodec]:
+    """Codec negotiated for a connection, JSON if none was."""
+    return CODECS.get(getattr(websocket, 'subprotocol', None), JSON)
@@ -0,0 +1,149 @@
+# roomcodes.py
+"""Room code allocation and the index of rooms still waiting for players.
+
+RoomCodeAllocator hands out codes in random order without ever repeating
+a live one. It runs a lazy Fisher-Yates shuffle over the code space, so
+memory grows only with the number of codes drawn. Freed codes go to a
+free list that is used once the fresh codes run out. Allocation and
+release are O(1) at any occupancy. A code space can be split into
+partitions (``code % partitions``) so each cluster worker draws only
+codes it owns. Codes are ROOM_CODE_DIGITS wide, set with the
+HOKM_ROOM_CODE_DIGITS environment variable.
+
+OpenRoomIndex keeps rooms that are not yet full, bucketed by player
+count, so quick match can pick the fullest open room in O(1).
+"""
+import os
+import random
+from collections import deque
+from typing import Dict, List, Optional
+
+ROOM_CODE_DIGITS_ENV = 'HOKM_ROOM_CODE_DIGITS'
+ROOM_CODE_DIGITS = int(os.environ.get(ROOM_CODE_DIGITS_ENV) or 6)  # 900,000 codes
+if ROOM_CODE_DIGITS < 1:
+    raise ValueError(f"{ROOM_CODE_DIGITS_ENV} must be at least 1, got {ROOM_CODE_DIGITS}")
+
+
+class RoomCodesExhausted(RuntimeError):
+    """Every code in the allocator's space is in use."""
+
+
+class RoomCodeAllocator:
+    def __init__(self, digits: int = ROOM_CODE_DIGITS, partition: int = 0,
+                 partitions: int = 1, rng: random.Random = None):
+        low, high = 10 ** (digits - 1), 10 ** digits - 1
+        # First code in [low, high] that belongs to this partition
+        self.first = low + (partition - low) % partitions
+        self.step = partitions
+        self.size = max(0, (high - self.first) // partitions + 1)
+        self.remaining = self.size  # fresh codes not yet drawn
+        self.swaps: Dict[int, int] = {}  # displaced slots of the lazy shuffle
+        self.free = deque()
+        self.in_use = set()
+        self.skip = set()  # reserved codes still among the fresh ones
+        self.rng = rng or random.Random()
+
+    def allocate(self) -> str:
+        while self.remaining:
+            i = self.rng.randrange(self.remaining)
+            last = self.remaining - 1
+            index = self.swaps.pop(i, i)
+            if i != last:
+                self.swaps[i] = self.swaps.pop(last, last)
+            self.remaining = last
+            code = str(self.first + index * self.step)
+            if code in self.skip:
+                # Reserved, and now drawn: from here on it is only on the free list
+                self.skip.remove(code)
+                continue
+            break
+        else:
+            if not self.free:
+                raise RoomCodesExhausted(f"All {self.size} room codes are in use")
+            code = self.free.popleft()
+        self.in_use.add(code)
+        return code
+
+    def reserve(self, code: str):
+        """Mark a code in use without drawing it, e.g. a room restored after a restart.
+
+        Only for codes not yet drawn or released by this allocator.
+        """
+        if code not in self.in_use:
+            self.in_use.add(code)
+            self.skip.add(code)
+
+    def release(self, code: str):
+        """Return a code to the free list; unknown codes are ignored."""
+        if code in self.in_use:
+            self.in_use.remove(code)
+            self.free.append(code)
+
+    def __len__(self) -> int:
+        return len(self.in_use)
+
+
+class _IndexedSet:
+    """Set with O(1) add, remove and pick, backed by a list."""
+
+    __slots__ = ('items', 'positions')
+
+    def __init__(self):
+        self.items: List[str] = []
+        self.positions: Dict[str, int] = {}
+
+    def add(self, item: str):
+        if item not in self.positions:
+            self.positions[item] = len(self.items)
+            self.items.append(item)
+
+    def discard(self, item: str):
+        pos = self.positions.pop(item, None)
+        if pos is None:
+            return
+        last = self.items.pop()
+        if last != item:
+            self.items[pos] = last
+            self.positions[last] = pos
+
+    def pick(self) -> Optional[str]:
+        return self.items[0] if self.items else None
+
+    def __len__(self) -> int:
+        return len(self.items)
+
+
+class OpenRoomIndex:
+    """Rooms with free seats, bucketed by how many players they have."""
+
+    def __init__(self, room_size: int):
+        self.room_size = room_size
+        self.buckets = [_IndexedSet() for _ in range(room_size)]
+        self.counts: Dict[str, int] = {}
+
+    def update(self, room_code: str, players: int):
+        """Record a room's player count; full rooms leave the index."""
+        old = self.counts.get(room_code)
+        if old is not None:
+            self.buckets[old].discard(room_code)
+        if 0 <= players < self.room_size:
+            self.counts[room_code] = players
+            self.buckets[players].add(room_code)
+        else:
+            self.counts.pop(room_code, None)
+
+    def remove(self, room_code: str):
+        self.update(room_code, self.room_size)
+
+    def pick(self) -> Optional[str]:
+        """The fullest open room, so tables start as soon as possible."""
+        for bucket in reversed(self.buckets):
+            if bucket:
+                return bucket.pick()
+        return None
+
+    def __contains__(self, room_code: str) -> bool:
+        return room_code in self.counts
+
+    def __len__(self) -> int:
+        return len(self.counts)
@@ -0,0 +1,294 @@
+# selfplay.py
+"""Headless self-play: full Hokm matches on the server's rules engine.
+
+Each match is a HokmGame, the same object the servers drive, played to
+match_over by a simple policy per team with no network or event loop.
+Matches are split into chunks across a process pool, each chunk folds its
+matches into a Stats, and the chunks are merged. Match ``i`` uses seed
+``(seed << 32) | i`` for both the deal and its policies, so results do
+not depend on the worker count and any match can be replayed alone.
+
+Policies:
+    random  random legal card, random trump
+    greedy  trump is the longest suit in the first five cards; win the
+            trick as cheaply as possible unless the partner already is
+    bot     the Monte Carlo bot (bot.py) with --bot-budget per decision,
+            far slower; for checking bot changes against greedy
+
+    python selfplay.py --matches 20000 --workers 4
+    python selfplay.py --matches 200 --team0 bot --team1 greedy --bot-budget 0.01
+"""
+import argparse
+import json
+import os
+import random
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, Optional
+
+from engine import (
+    NUM_PLAYERS, RANK_OF, STRENGTH, SUIT_MASKS, SUIT_OF, SUITS, TEAM_OF, HokmGame,
+    cards_of, parse_card, parse_suit
+)
+
+CHUNK = 250  # matches per pool task
+POLICIES = ('random', 'greedy', 'bot')
+
+
+def random_trump(game: HokmGame, seat: int, rng: random.Random, budget) -> int:
+    return rng.randrange(4)
+
+
+def random_card(game: HokmGame, seat: int, rng: random.Random, budget) -> int:
+    return rng.choice(cards_of(game.legal_moves(seat)))
+
+
+def greedy_trump(game: HokmGame, seat: int, rng: random.Random, budget) -> int:
+    hand = game.hands[seat]
+    # Most cards, then highest ranks
+    return max(range(4), key=lambda s: (
+        (hand & SUIT_MASKS[s]).bit_count(),
+        sum(RANK_OF[c] for c in cards_of(hand & SUIT_MASKS[s]))
+    ))
+
+
+# The greedy policy works on masks: within a suit a higher bit is a higher
+# rank, so the cheapest or strongest card is one bit operation, not a scan.
+# Ties between suits go to the lowest suit.
+
+def _lowest(mask: int) -> int:
+    return (mask & -mask).bit_length() - 1
+
+
+def _above(mask: int, suit: int, rank: int) -> int:
+    """Cards of ``suit`` in ``mask`` ranked above ``rank`` (-1 for all of them)."""
+    if rank >= 12:
+        return 0
+    return mask & SUIT_MASKS[suit] & -(1 << (13 * suit + max(rank, -1) + 1))
+
+
+def greedy_card(game: HokmGame, seat: int, rng: random.Random, budget) -> int:
+    legal = game.legal_moves(seat)
+    if not legal & (legal - 1):
+        return legal.bit_length() - 1
+    trump, trick = game.trump, game.trick
+    if not trick:
+        # Lead the highest card outside trumps, if any
+        plain = legal & ~SUIT_MASKS[trump] or legal
+        best, card = -1, 0
+        for suit in range(4):
+            top = (plain & SUIT_MASKS[suit]).bit_length() - 1
+            if top - 13 * suit > best:
+                best, card = top - 13 * suit, top
+        return card
+    lead = SUIT_OF[trick[0]]
+    base = (trump * 4 + lead) * 52
+    strengths = [STRENGTH[base + c] for c in trick]
+    best = max(strengths)
+    partner_winning = game.trick_seats[strengths.index(best)] == (seat + 2) % NUM_PLAYERS
+    if legal & SUIT_MASKS[lead]:
+        # Following suit: the lowest card is the cheapest
+        if partner_winning:
+            return _lowest(legal)
+        winners = _above(legal, lead, best - (32 if lead == trump else 16))
+        return _lowest(winners or legal)
+    # Void: discard the lowest rank outside trumps, else the lowest trump
+    trumps = legal & SUIT_MASKS[trump]
+    cheapest, low = _lowest(trumps), 13
+    for suit in range(4):
+        if suit != trump and legal & SUIT_MASKS[suit]:
+            card = _lowest(legal & SUIT_MASKS[suit])
+            if card - 13 * suit < low:
+                cheapest, low = card, card - 13 * suit
+    if partner_winning or lead == trump:
+        return cheapest
+    winners = _above(trumps, trump, best - 32)
+    return _lowest(winners) if winners else cheapest
+
+
+def bot_trump(game: HokmGame, seat: int, rng: random.Random, budget) -> int:
+    from bot import bot_view, decide
+    return parse_suit(decide(bot_view(game, seat), budget)['suit'])
+
+
+def bot_card(game: HokmGame, seat: int, rng: random.Random, budget) -> int:
+    from bot import bot_view, decide
+    return parse_card(decide(bot_view(game, seat), budget)['card'])
+
+
+PLAYERS = {
+    'random': (random_trump, random_card),
+    'greedy': (greedy_trump, greedy_card),
+    'bot': (bot_trump, bot_card),
+}
+
+
+class Stats:
+    """Aggregates over many matches; chunks from workers merge with ``+=``."""
+
+    def __init__(self):
+        self.matches = 0
+        self.hands = 0
+        self.cards = 0
+        self.seconds = 0.0  # time spent playing, summed over workers
+        self.match_wins = [0, 0]
+        self.hands_per_match: Dict[int, int] = {}
+        self.hakem_hands = [0, 0]  # by hakem team
+        self.hakem_wins = [0, 0]
+        self.trump_hands = [0] * 4  # by suit chosen
+        self.trump_wins = [0] * 4  # hakem's team won the hand
+        self.trump_length_hands: Dict[int, int] = {}  # trumps among the first five cards
+        self.trump_length_wins: Dict[int, int] = {}
+        self.points: Dict[int, int] = {}  # 1 normal, 2 kot by the hakem's team, 3 kot against
+
+    def __iadd__(self, other: 'Stats') -> 'Stats':
+        for name, value in vars(other).items():
+            mine = getattr(self, name)
+            if isinstance(value, list):
+                setattr(self, name, [a + b for a, b in zip(mine, value)])
+            elif isinstance(value, dict):
+                for k, v in value.items():
+                    mine[k] = mine.get(k, 0) + v
+            else:
+                setattr(self, name, mine + value)
+        return self
+
+    def report(self) -> dict:
+        rate = lambda wins, hands: round(wins / hands, 4) if hands else None
+        return {
+            'matches': self.matches,
+            'hands': self.hands,
+            'match_wins': self.match_wins,
+            'hands_per_match': {
+                'mean': round(self.hands / self.matches, 2) if self.matches else None,
+                'histogram': dict(sorted(self.hands_per_match.items())),
+            },
+            'hakem_win_rate': {f"team{t}": rate(self.hakem_wins[t], self.hakem_hands[t])
+                               for t in (0, 1)},
+            'trump_win_rate': {SUITS[s]: rate(self.trump_wins[s], self.trump_hands[s])
+                               for s in range(4)},
+            'trump_length_win_rate': {
+                k: rate(self.trump_length_wins.get(k, 0), n)
+                for k, n in sorted(self.trump_length_hands.items())
+            },
+            'points': dict(sorted(self.points.items())),
+            'matches_per_core_second': round(self.matches / self.seconds, 1)
+            if self.seconds else None,
+            'hands_per_core_second': round(self.hands / self.seconds, 1)
+            if self.seconds else None,
+            'cards_per_core_second': round(self.cards / self.seconds, 1)
+            if self.seconds else None,
+        }
+
+
+def match_seed(seed: int, index: int) -> int:
+    return (seed << 32) | index
+
+
+def play_match(seed: int, teams, stats: Stats, budget: float = 0.01) -> HokmGame:
+    """Play one match to the end, adding it to ``stats``."""
+    game = HokmGame(seed=seed)
+    rng = random.Random(f"{seed}:policy")
+    # Card policy by seat, looked up once instead of per card
+    card_policies = [teams[TEAM_OF[seat]][1] for seat in range(NUM_PLAYERS)]
+    game.start_hand()
+    hands = 0
+    while game.phase != 'match_over':
+        if game.phase == 'trump':
+            seat = game.hakem
+            hakem_team = TEAM_OF[seat]
+            first_five = game.hands[seat]
+            trump = teams[hakem_team][0](game, seat, rng, budget)
+            game.choose_trump(seat, trump)
+            stats.hakem_hands[hakem_team] += 1
+            stats.trump_hands[trump] += 1
+            length = (first_five & SUIT_MASKS[trump]).bit_count()
+            stats.trump_length_hands[length] = stats.trump_length_hands.get(length, 0) + 1
+            continue
+        seat = game.turn
+        events = game.play(seat, card_policies[seat](game, seat, rng, budget))
+        stats.cards += 1
+        if len(events) < 3:
+            continue  # no hand ended
+        won = events[2]  # card_played, trick_won, hand_won, ...
+        hands += 1
+        if won['team'] == hakem_team:
+            stats.hakem_wins[hakem_team] += 1
+            stats.trump_wins[trump] += 1
+            stats.trump_length_wins[length] = stats.trump_length_wins.get(length, 0) + 1
+        stats.points[won['points']] = stats.points.get(won['points'], 0) + 1
+    stats.matches += 1
+    stats.hands += hands
+    stats.match_wins[0 if game.scores[0] > game.scores[1] else 1] += 1
+    stats.hands_per_match[hands] = stats.hands_per_match.get(hands, 0) + 1
+    return game
+
+
+def play_chunk(seed: int, start: int, count: int, team_names, budget: float) -> Stats:
+    teams = [PLAYERS[name] for name in team_names]
+    stats = Stats()
+    started = time.perf_counter()
+    for index in range(start, start + count):
+        play_match(match_seed(seed, index), teams, stats, budget)
+    stats.seconds = time.perf_counter() - started
+    return stats
+
+
+def run(matches: int, workers: int, seed: int, team_names, budget: float = 0.01,
+        chunk: int = CHUNK) -> Stats:
+    chunks = [(seed, start, min(chunk, matches - start), team_names, budget)
+              for start in range(0, matches, chunk)]
+    total = Stats()
+    if workers <= 1:
+        for args in chunks:
+            total += play_chunk(*args)
+        return total
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        for stats in pool.map(play_chunk, *zip(*chunks)):
+            total += stats
+    return total
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--matches', type=int, default=10000)
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1,
+                        help='processes; 1 plays inline (default: one per CPU)')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--team0', choices=POLICIES, default='greedy')
+    parser.add_argument('--team1', choices=POLICIES, default='greedy')
+    parser.add_argument('--bot-budget', type=float, default=0.01,
+                        help='seconds per decision for the bot policy')
+    parser.add_argument('--chunk', type=int, default=CHUNK)
+    parser.add_argument('--output', default=None, help='also write the report as JSON')
+    args = parser.parse_args(argv)
+
+    started = time.perf_counter()
+    stats = run(args.matches, args.workers, args.seed, (args.team0, args.team1),
+                args.bot_budget, args.chunk)
+    elapsed = time.perf_counter() - started
+    report = stats.report()
+    report.update(
+        teams=[args.team0, args.team1], seed=args.seed, workers=args.workers,
+        seconds=round(elapsed, 3), matches_per_second=round(stats.matches / elapsed, 1),
+        hands_per_second=round(stats.hands / elapsed, 1),
+    )
+
+    print(f"{stats.matches} matches, {stats.hands} hands in {elapsed:.2f}s on "
+          f"{args.workers} worker(s): {report['matches_per_second']:,.0f} matches/s, "
+          f"{report['hands_per_second']:,.0f} hands/s "
+          f"({report['hands_per_core_second']:,.0f} hands/s per core)")
+    print(f"match wins  {args.team0} (team 0) {stats.match_wins[0]}, "
+          f"{args.team1} (team 1) {stats.match_wins[1]}")
+    print(f"hands/match mean {report['hands_per_match']['mean']}")
+    print(f"hakem wins  {report['hakem_win_rate']}")
+    print(f"by trump    {report['trump_win_rate']}")
+    print(f"by trumps in first five {report['trump_length_win_rate']}")
+    print(f"points      {report['points']}")
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
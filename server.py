@@ -1,162 +1,780 @@
 # server.py
 
 import asyncio
+import signal
+import time
 import websockets
-import json
 import uuid
-import random
-from player import Player
-from network import NetworkManager
+import argparse
+import metrics
+import handoff
+import flowcontrol
+import spectators
+from player import Player, intern_name
+from network import EVICTIONS, IDLE_TIMEOUT, NetworkManager, sync_message
+from engine import HokmGame, IllegalMove
+from bot import BotPool, bot_view
+from protocol import SUBPROTOCOLS, codec_for
+from statesync import RoomSync
+from roomcodes import OpenRoomIndex, RoomCodeAllocator
+from gamelog import FileLog, GameLog, RedisStreamLog
+from timerwheel import IdleTimer, wheel
 
 ROOM_SIZE = 4
+BOT_FILL_DELAY = 30  # seconds a room waits for humans before bots take the empty seats
+VIEWER_STATUS_DELAY = 1.0  # seconds to gather viewer joins and leaves into one room_status
+TURN_TIMEOUT = 30.0  # seconds a human has to move before a bot moves for them; 0 waits forever
+ROOM_IDLE_TIMEOUT = 600.0  # seconds without joins, leaves or moves before a room is closed
+RESUME_GRACE = 120.0  # seconds a game with no human left waits for one to resume
 
 # In-memory structures for demo; use Redis for production
 rooms = {}
+games = {}
+room_syncs = {}
+bot_tasks = {}
+# Timers on the shared wheel (timerwheel.py), all cancelled by close_room
+bot_fill_timers = {}
+turn_timers = {}
+room_idle_timers = {}
+resume_timers = {}  # games whose last human dropped, closed unless someone resumes
+# Restarts (handoff.py): rooms the last run handed off, restored when a player resumes
+handed_off = set()
+restoring = {}  # room code -> task restoring it, shared by players resuming at once
+room_handoff = None  # off unless main() is given --handoff
+draining = False
+viewer_status_pending = set()  # rooms with a viewer-count room_status coming up
+bot_pool = BotPool()
+game_log = GameLog()  # off unless main() is given --game-log
+room_codes = RoomCodeAllocator()
+open_rooms = OpenRoomIndex(ROOM_SIZE)  # rooms still waiting for players, for quick match
+# Read at scrape time only
+metrics.Gauge('hokm_rooms', 'Rooms, open or playing.', callback=lambda: {None: len(rooms)})
+metrics.Gauge('hokm_open_rooms', 'Rooms waiting for players.',
+              callback=lambda: {None: len(open_rooms)})
+metrics.Gauge('hokm_games', 'Games in progress.', callback=lambda: {None: len(games)})
+
+def send_buffer_sizes():
+    sizes = [
+        p.wsconnection.transport.get_write_buffer_size()
+        for players in rooms.values() for p in players
+        if not p.is_bot and getattr(p.wsconnection, 'transport', None)
+    ]
+    return {'total': sum(sizes), 'max': max(sizes, default=0)}
+
+metrics.Gauge('hokm_send_buffer_bytes', 'Bytes queued in seated players\' sockets.', 'stat',
+              callback=send_buffer_sizes)
+metrics.Gauge('hokm_spectators', 'Spectators connected to this process.',
+              callback=spectators.local_viewers)
+metrics.Gauge('hokm_timers', 'Timers on the timing wheel.', callback=lambda: {None: len(wheel)})
+TURN_TIMEOUTS = metrics.Counter('hokm_turn_timeouts_total', 'Turns a bot played for a slow human.')
+HANDOFFS = metrics.Counter('hokm_handoff_rooms_total',
+                           'Rooms snapshotted on drain, restored or expired after a restart.', 'op')
+RESTORE_SECONDS = metrics.Histogram('hokm_handoff_restore_seconds',
+                                    'Time to rebuild a handed-off room on its first resume.',
+                                    buckets=(0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.5))
+metrics.Gauge('hokm_outbox_frames', 'Frames waiting in per-connection outboxes.', 'stat',
+              callback=flowcontrol.queued_frames)
+# A room lives on the worker whose id is room_code % worker_count
+worker_id, worker_count = 0, 1
+
+def configure_worker(new_worker_id, new_worker_count):
+    """Called by cluster.py so this process only allocates codes it owns."""
+    global worker_id, worker_count, room_codes
+    worker_id, worker_count = new_worker_id, new_worker_count
+    room_codes = RoomCodeAllocator(partition=worker_id, partitions=worker_count)
 
 def generate_room_code():
-    return f"{random.randint(1000, 9999)}"
+    return room_codes.allocate()
+
+def create_room():
+    room_code = generate_room_code()
+    rooms[room_code] = []
+    open_rooms.update(room_code, 0)
+    bot_fill_timers[room_code] = wheel.call_later(BOT_FILL_DELAY, fill_with_bots, room_code)
+    room_idle_timers[room_code] = IdleTimer(ROOM_IDLE_TIMEOUT, reap_room, room_code)
+    print(f"New room created: {room_code}")
+    return room_code
+
+async def enter_room(player, room_code):
+    """Seat a player in a room; a missing code means quick match."""
+    websocket = player.wsconnection
+    if room_code is None:
+        room_code = open_rooms.pick() or create_room()
+    # A code from the client may be any JSON value, and lists cannot be looked up
+    if not isinstance(room_code, str) or room_code not in rooms:
+        await NetworkManager.send_message(websocket, "error", {
+            "message": "Room does not exist. Please check the room code."
+        })
+        # Don't return, keep connection open for retry
+    elif len(rooms[room_code]) >= ROOM_SIZE:
+        await NetworkManager.send_message(websocket, "room_full", {
+            "message": "Room is already full. Do you want to create a new room? (y/n)"
+        })
+        # Don't close connection yet; wait for client response!
+    else:
+        player.current_room = room_code
+        player.seat = len(rooms[room_code])
+        rooms[room_code].append(player)
+        player_number = player.seat + 1
+        open_rooms.update(room_code, player_number)
+        room_active(room_code)
+        print(f"Player {player_number}: {player.username} entered room [{room_code}]")
+
+        # Broadcast updated room status to all players in the room
+        await broadcast_room_status(room_code)
+
+        await NetworkManager.send_message(websocket, "room_joined", {
+            "room_id": room_code,
+            "player_number": player_number,
+            "total_players": player_number
+        })
+
+        # Notify all players if room is full
+        if player_number == ROOM_SIZE:
+            print(f"Room {room_code} is full, ready to play!")
+            await start_game(room_code)
 
 async def handle_connection(websocket, path):
+    metrics.CONNECTIONS.inc()
+    try:
+        await serve_player(websocket)
+    finally:
+        metrics.CONNECTIONS.dec()
+
+async def serve_player(websocket):
+    # Closed when silent too long, the first message included; a seated
+    # player then leaves the room as for any disconnect
+    idle = IdleTimer(IDLE_TIMEOUT, NetworkManager.evict_idle, websocket)
+    try:
+        await serve_session(websocket, idle)
+        await flowcontrol.flush(websocket)
+    finally:
+        idle.cancel()
+
+async def serve_session(websocket, idle):
     # Receive join/create message
     join_msg = await NetworkManager.receive_message(websocket)
     if not join_msg:
         return
+    idle.touch()
     username = join_msg.get("username", "Anonymous")
     action = join_msg.get("type")
     room_code = join_msg.get("room_code")
 
+    if action == "spectate":
+        idle.cancel()  # watch_room keeps its own
+        await watch_room(websocket, room_code)
+        return
+
+    if draining:
+        await NetworkManager.send_message(websocket, "error", {
+            "message": "Server restarting, try again shortly."
+        })
+        # After the error frame, which the outbox may not have written yet
+        flowcontrol.outbox_for(websocket).close(1012, "Server restarting")
+        return
+
     player_id = str(uuid.uuid4())
     player = Player(player_id=player_id, wsconnection=websocket, username=username)
-    player.current_room = None
 
-    # Room creation or joining
-    if action == "create_room":
-        room_code = generate_room_code()
-        rooms[room_code] = []
-        print(f"New room created: {room_code}")
+    with metrics.timed(action):
+        # Room creation or joining
+        if action == "create_room":
+            room_code = create_room()
 
-    if action in ("join_room", "create_room"):
-        if room_code not in rooms:
-            await NetworkManager.send_message(websocket, "error", {
-                "message": "Room does not exist. Please check the room code."
-            })
-            # Don't return, keep connection open for retry
-        elif len(rooms[room_code]) >= ROOM_SIZE:
-            await NetworkManager.send_message(websocket, "room_full", {
-                "message": "Room is already full. Do you want to create a new room? (y/n)"
-            })
-            # Don't close connection yet; wait for client response!
-        else:
-            player.current_room = room_code
-            rooms[room_code].append(player)
-            player_number = len(rooms[room_code])
-            print(f"Player {player_number}: {username} entered room [{room_code}]")
-
-            # Broadcast updated room status to all players in the room
-            await broadcast_room_status(room_code)
-
-            await NetworkManager.send_message(websocket, "room_joined", {
-                "room_id": room_code,
-                "player_number": player_number,
-                "total_players": player_number
-            })
+        if action in ("join_room", "create_room"):
+            await enter_room(player, room_code)
 
-            # Notify all players if room is full
-            if player_number == ROOM_SIZE:
-                print(f"Room {room_code} is full, ready to play!")
-                for p in rooms[room_code]:
-                    await NetworkManager.send_message(
-                        p.wsconnection,
-                        "game_start",
-                        {
-                            "room_id": room_code,
-                            "players": [pl.username for pl in rooms[room_code]]
-                        }
-                    )
+        elif action == "resume":
+            await resume_session(player, join_msg)
 
-    else:
-        await NetworkManager.send_message(websocket, "error", {
-            "message": "Invalid action."
-        })
+        else:
+            await NetworkManager.send_message(websocket, "error", {
+                "message": "Invalid action."
+            })
 
     # Keep connection open for future game logic
+    bucket = flowcontrol.TokenBucket()
     try:
         while True:
             msg = await websocket.recv()
-            data = json.loads(msg)
+            idle.touch()
+            if await NetworkManager.rate_limited(websocket, bucket):
+                continue
+            try:
+                data = codec_for(websocket).decode(msg)
+            except ValueError:
+                metrics.MALFORMED.inc()
+                await NetworkManager.send_message(websocket, "error", {
+                    "message": "Malformed message."
+                })
+                continue
             
-            # Handle new join attempts
-            if data.get('type') in ('join_room', 'create_room'):
-                room_code = data.get('room_code')
-                if data.get('type') == 'create_room':
-                    room_code = generate_room_code()
-                    rooms[room_code] = []
-                    print(f"New room created: {room_code}")
-                
-                if room_code not in rooms:
+            with metrics.timed(data.get('type')):
+                # Handle new join attempts
+                if data.get('type') in ('join_room', 'create_room') and draining:
                     await NetworkManager.send_message(websocket, "error", {
-                        "message": "Room does not exist. Please check the room code."
-                    })
-                elif len(rooms[room_code]) >= ROOM_SIZE:
-                    await NetworkManager.send_message(websocket, "room_full", {
-                        "message": "Room is already full. Do you want to create a new room? (y/n)"
+                        "message": "Server restarting, try again shortly."
                     })
-                else:
-                    player.current_room = room_code
-                    rooms[room_code].append(player)
-                    player_number = len(rooms[room_code])
-                    print(f"Player {player_number}: {username} entered room [{room_code}]")
-                    await broadcast_room_status(room_code)
-                    await NetworkManager.send_message(websocket, "room_joined", {
-                        "room_id": room_code,
-                        "player_number": player_number,
-                        "total_players": player_number
-                    })
-                    if player_number == ROOM_SIZE:
-                        print(f"Room {room_code} is full, ready to play!")
-                        for p in rooms[room_code]:
-                            await NetworkManager.send_message(
-                                p.wsconnection,
-                                "game_start",
-                                {
-                                    "room_id": room_code,
-                                    "players": [pl.username for pl in rooms[room_code]]
-                                }
-                            )
-            elif data.get('type') == 'room_status':
-                await broadcast_room_status(data.get('room_id'))
-            elif data.get('type') == 'room_full':
-                print(data.get('message'))
-            elif data.get('type') == 'error':
-                print("Error:", data.get('message'))
+                elif data.get('type') in ('join_room', 'create_room'):
+                    room_code = data.get('room_code')
+                    if data.get('type') == 'create_room':
+                        room_code = create_room()
+                    await enter_room(player, room_code)
+                elif data.get('type') in ('choose_trump', 'play_card'):
+                    await handle_game_action(player, data)
+                elif data.get('type') == 'sync':
+                    await resend_missed(player, data)
+                elif data.get('type') == 'keepalive':
+                    pass  # any frame counts as activity; this one has nothing else to say
+                elif data.get('type') == 'add_bots':
+                    await fill_with_bots(player.current_room)
+                elif data.get('type') == 'room_status':
+                    room_code = data.get('room_id', player.current_room)
+                    if isinstance(room_code, str) and room_code in rooms:
+                        await broadcast_room_status(room_code)
+                elif data.get('type') == 'room_full':
+                    print(data.get('message'))
+                elif data.get('type') == 'error':
+                    print("Error:", data.get('message'))
+    except websockets.ConnectionClosed:
+        print(f"Player {player.username} disconnected.")
+        await leave_room(player)
+
+async def watch_room(websocket, room_code, remote=False):
+    """Follow a table without a seat until the connection or the room closes.
+
+    ``remote`` is set by cluster.py when another worker owns the room; the
+    owner then sends the snapshot and relays the frames.
+    """
+    if not remote:
+        snapshot = spectator_snapshot(room_code)
+        if snapshot is None:
+            await NetworkManager.send_message(websocket, "error", {
+                "message": "Room does not exist. Please check the room code."
+            })
+            return
+    audience = spectators.audience(room_code, remote)
+    audience.add(websocket)
+    if not remote:
+        audience.publish("spectating", snapshot, snapshot["seq"], spectators.SNAPSHOT)
+    # Viewers only send keepalives, and one that stops is closed like a player
+    idle = IdleTimer(IDLE_TIMEOUT, NetworkManager.evict_idle, websocket)
+    try:
+        while True:
+            await websocket.recv()  # reading also keeps pings flowing
+            idle.touch()
     except websockets.ConnectionClosed:
-        print(f"Player {username} disconnected.")
-        if player.current_room and player in rooms.get(player.current_room, []):
-            rooms[player.current_room].remove(player)
-            if not rooms[player.current_room]:
-                del rooms[player.current_room]
-            else:
-                # Broadcast updated room status to remaining players
-                await broadcast_room_status(player.current_room)
+        pass
+    finally:
+        idle.cancel()
+        audience.remove(websocket)
+
+def spectator_snapshot(room_code):
+    """Everything public about a room, or None if there is no such room."""
+    if not isinstance(room_code, str) or room_code not in rooms:
+        return None
+    data = room_status_data(room_code)
+    data["seq"] = 0
+    game = games.get(room_code)
+    if game is not None:
+        data["seq"] = room_syncs[room_code].seq
+        data["state"] = game.public_state()
+    return data
+
+def viewers_changed(room_code):
+    if room_code in rooms and room_code not in viewer_status_pending:
+        viewer_status_pending.add(room_code)
+        wheel.call_later(VIEWER_STATUS_DELAY, announce_viewers, room_code)
+
+async def announce_viewers(room_code):
+    viewer_status_pending.discard(room_code)
+    if room_code in rooms:
+        await broadcast_room_status(room_code)
+
+spectators.on_change = viewers_changed
+
+def is_seated(player):
+    """False for players who left or whose seat was reclaimed by a resume."""
+    players = rooms.get(player.current_room)
+    return bool(players) and 0 <= player.seat < len(players) and players[player.seat] is player
+
+async def leave_room(player):
+    room_code = player.current_room
+    if not is_seated(player) or draining:
+        # While draining the rooms are already handed off: leave them as they were
+        return
+    players = rooms[room_code]
+    room_active(room_code)
+    game = games.get(room_code)
+    if game is not None and game.phase != 'match_over':
+        # Keep the table alive: a bot plays the seat from here on
+        seat = player.seat
+        players[seat] = make_bot(room_code, seat, f"{player.username} (bot)")
+        players[seat].hand = player.hand
+        if all(p.is_bot for p in players):
+            # Keep the seat and its resume token for a while; bots wait meanwhile
+            resume_timers[room_code] = wheel.call_later(RESUME_GRACE, abandon_room, room_code)
+            return
+        await broadcast_room_status(room_code)
+        schedule_bots(room_code)
+        return
+
+    players.pop(player.seat)
+    for seat, p in enumerate(players):
+        p.seat = seat
+    games.pop(room_code, None)
+    room_syncs.pop(room_code, None)
+    if not players:
+        close_room(room_code)
+    else:
+        open_rooms.update(room_code, len(players))
+        # Broadcast updated room status to remaining players
+        await broadcast_room_status(room_code)
+
+def close_room(room_code):
+    if rooms.pop(room_code, None) is not None:
+        room_codes.release(room_code)
+    open_rooms.remove(room_code)
+    games.pop(room_code, None)
+    room_syncs.pop(room_code, None)
+    game_log.finish(room_code)
+    spectators.close(room_code)
+    task = bot_tasks.pop(room_code, None)
+    if task is not None:
+        task.cancel()
+    for timers in (bot_fill_timers, turn_timers, room_idle_timers, resume_timers):
+        timer = timers.pop(room_code, None)
+        if timer is not None:
+            timer.cancel()
+
+def abandon_room(room_code):
+    """Nobody resumed within RESUME_GRACE of the last human leaving."""
+    resume_timers.pop(room_code, None)
+    players = rooms.get(room_code)
+    if players is not None and all(p.is_bot for p in players):
+        close_room(room_code)
+
+def room_active(room_code):
+    """Push back the room's reaping; a dict lookup and a clock read."""
+    timer = room_idle_timers.get(room_code)
+    if timer is not None:
+        timer.touch()
+
+async def reap_room(room_code):
+    """Close a room nobody has joined, left or played in for ROOM_IDLE_TIMEOUT."""
+    room_idle_timers.pop(room_code, None)
+    players = rooms.get(room_code)
+    if players is None:
+        return
+    EVICTIONS.inc('room')
+    print(f"Room {room_code} closed after {ROOM_IDLE_TIMEOUT:g}s without activity")
+    failed = await NetworkManager.broadcast(
+        [p.wsconnection for p in players if not p.is_bot], "error",
+        {"room_id": room_code, "message": "Room closed for inactivity."}
+    )
+    report_failed_sends(failed)
+    close_room(room_code)
+
+def report_failed_sends(failed):
+    for websocket, error in failed:
+        print(f"Failed to send to {websocket.remote_address}: {error!r}")
+
+def room_status_data(room_code):
+    players = rooms[room_code]
+    return {
+        "room_id": room_code,
+        "total_players": len(players),
+        "usernames": [pl.username for pl in players],
+        "viewers": spectators.viewer_count(room_code)
+    }
 
 async def broadcast_room_status(room_code):
     players = rooms[room_code]
-    for idx, p in enumerate(players):
-        await NetworkManager.send_message(
-            p.wsconnection,
-            "room_status",
-            {
-                "room_id": room_code,
-                "player_number": idx + 1,
-                "total_players": len(players),
-                "usernames": [pl.username for pl in players]
-            }
+    humans = [idx for idx, p in enumerate(players) if not p.is_bot]
+    data = room_status_data(room_code)
+    failed = await NetworkManager.broadcast(
+        [players[idx].wsconnection for idx in humans],
+        "room_status",
+        data,
+        per_recipient=[{"player_number": idx + 1} for idx in humans]
+    )
+    report_failed_sends(failed)
+    spectators.publish(room_code, "room_status", data)
+
+async def start_game(room_code):
+    players = rooms[room_code]
+    game = HokmGame()
+    sync = RoomSync()
+    games[room_code] = game
+    room_syncs[room_code] = sync
+    game_log.open(room_code, game, players=[p.username for p in players])
+    events = game.start_hand()
+    game_log.append(room_code, None, {'type': 'start_hand'}, game)
+    sync_hands(room_code)
+    # Each human gets a token to reclaim their seat after a dropped connection
+    tokens = {
+        seat: {"resume_token": sync.issue_token(seat, p.username)}
+        for seat, p in enumerate(players) if not p.is_bot
+    }
+    seq = sync.record(events)
+    usernames = [pl.username for pl in players]
+    failed = await NetworkManager.broadcast_game(
+        [p.wsconnection for p in players], room_code, game, events, seq,
+        message_type="game_start",
+        extra={"players": usernames},
+        snapshot=True,
+        per_seat=tokens
+    )
+    report_failed_sends(failed)
+    # Viewers get the public part only: no hands, no resume tokens
+    spectators.publish(room_code, "game_start", {
+        "room_id": room_code, "seq": seq, "events": events,
+        "state": game.public_state(), "players": usernames
+    }, seq)
+    schedule_bots(room_code)
+    arm_turn_timer(room_code)
+
+async def publish_events(room_code, game, events):
+    seq = room_syncs[room_code].record(events)
+    sync_hands(room_code)
+    failed = await NetworkManager.broadcast_game(
+        [p.wsconnection for p in rooms[room_code]], room_code, game, events, seq
+    )
+    report_failed_sends(failed)
+    spectators.publish(room_code, "game_update", {
+        "room_id": room_code, "seq": seq, "events": events
+    }, seq)
+    room_active(room_code)
+    arm_turn_timer(room_code)
+
+def sync_hands(room_code):
+    for seat, p in enumerate(rooms[room_code]):
+        p.hand = games[room_code].hands[seat]
+
+async def handle_game_action(player, data):
+    room_code = player.current_room
+    game = games.get(room_code)
+    if draining:
+        return  # after the snapshot; the restarted server replays nothing it missed
+    if game is None or not is_seated(player):
+        await NetworkManager.send_message(player.wsconnection, "error", {
+            "message": "Game has not started."
+        })
+        return
+    try:
+        events = game.apply(player.seat, data)
+    except IllegalMove as e:
+        await NetworkManager.send_message(player.wsconnection, "error", {
+            "message": str(e)
+        })
+        return
+    game_log.append(room_code, player.seat, data, game)
+    await publish_events(room_code, game, events)
+    schedule_bots(room_code)
+
+async def resume_session(player, data):
+    """Put a reconnecting player back in their seat and catch them up."""
+    room_code = data.get("room_id")
+    if not isinstance(room_code, str):
+        await NetworkManager.send_message(player.wsconnection, "error", {
+            "message": "Session expired."
+        })
+        return
+    if room_code in handed_off or room_code in restoring:
+        await restored(room_code)
+    sync = room_syncs.get(room_code)
+    claim = sync.claim(data.get("resume_token")) if sync else None
+    if claim is None:
+        await NetworkManager.send_message(player.wsconnection, "error", {
+            "message": "Session expired."
+        })
+        return
+    seat, username = claim
+    players = rooms[room_code]
+    timer = resume_timers.pop(room_code, None)
+    if timer is not None:
+        timer.cancel()
+    previous = players[seat]
+    player.username = intern_name(username)
+    player.current_room = room_code
+    player.seat = seat
+    player.hand = previous.hand
+    players[seat] = player
+    if not previous.is_bot:
+        # A stale connection for the same seat; its handler finds it no longer seated
+        await previous.wsconnection.close()
+    print(f"Player {username} resumed seat {seat + 1} in room [{room_code}]")
+    await NetworkManager.send_message(player.wsconnection, "resumed", sync_message(
+        room_code, games[room_code], sync, seat, data.get("last_seq", 0)
+    ))
+    await broadcast_room_status(room_code)
+    schedule_bots(room_code)
+    arm_turn_timer(room_code)
+
+async def restored(room_code):
+    """Rebuild a handed-off room, once however many of its players resume together."""
+    task = restoring.get(room_code)
+    if task is None:
+        task = restoring[room_code] = asyncio.create_task(restore_room(room_code))
+        task.add_done_callback(lambda _: restoring.pop(room_code, None))
+    await task
+
+async def restore_room(room_code):
+    started = time.perf_counter()
+    handed_off.discard(room_code)
+    try:
+        raw = await room_handoff.take(room_code)
+    except Exception as e:
+        # Keep the code reserved so the next resume tries again
+        print(f"Restoring room {room_code} failed: {e!r}")
+        handed_off.add(room_code)
+        return
+    if raw is None:
+        room_codes.release(room_code)  # expired, or taken by an earlier run
+        return
+    snapshot = handoff.load_room(raw)
+    game = snapshot['game']
+    # Nobody is connected yet: each seat plays as a bot until its player resumes
+    players = rooms[room_code] = [
+        make_bot(room_code, seat, username if is_bot else f"{username} (bot)")
+        for seat, (username, is_bot) in enumerate(snapshot['players'])
+    ]
+    for seat, p in enumerate(players):
+        p.hand = game.hands[seat]
+    games[room_code] = game
+    room_syncs[room_code] = snapshot['sync']
+    if snapshot['log'] and game_log.backend is not None:
+        log_id, logged = snapshot['log']
+        game_log.ids[room_code] = log_id
+        game_log.counts[log_id] = logged
+    room_idle_timers[room_code] = IdleTimer(ROOM_IDLE_TIMEOUT, reap_room, room_code)
+    HANDOFFS.inc('restored')
+    RESTORE_SECONDS.observe_since(started)
+    print(f"Room {room_code} restored from handoff, seq {snapshot['sync'].seq}")
+
+async def load_handoff():
+    """Reserve the codes of rooms the last run handed off; they are restored lazily."""
+    for room_code in await room_handoff.codes():
+        if int(room_code) % worker_count == worker_id:
+            room_codes.reserve(room_code)
+            handed_off.add(room_code)
+    if handed_off:
+        print(f"{len(handed_off)} rooms handed off by the last run, waiting for their players")
+        wheel.call_later(handoff.HANDOFF_TTL, expire_handoff)
+
+def expire_handoff():
+    for room_code in handed_off:
+        room_codes.release(room_code)
+    HANDOFFS.inc('expired', len(handed_off))
+    handed_off.clear()
+
+def snapshot_rooms():
+    """Snapshots of every game in progress with a human left to resume it."""
+    snapshots = {}
+    for room_code, game in games.items():
+        players = rooms[room_code]
+        if game.phase == 'match_over' or (all(p.is_bot for p in players)
+                                          and room_code not in resume_timers):
+            continue
+        log_id = game_log.ids.get(room_code)
+        snapshots[room_code] = handoff.snapshot_room(
+            game, room_syncs[room_code], players, log_id, game_log.counts.get(log_id, 0)
         )
+    return snapshots
+
+async def drain(ws_server=None):
+    """Stop taking rooms, hand off the games in progress and disconnect everyone."""
+    global draining
+    draining = True
+    started = time.perf_counter()
+    # One pass with no await in it: no move lands between two rooms' snapshots
+    snapshots = snapshot_rooms()
+    for task in bot_tasks.values():
+        task.cancel()
+    # No bot moves from here on; its processes would also keep a cluster
+    # worker from exiting, as multiprocessing joins them at exit
+    bot_pool.shutdown()
+    snapshotted = time.perf_counter()
+    if room_handoff is not None and snapshots:
+        try:
+            await room_handoff.save(snapshots)
+            HANDOFFS.inc('saved', len(snapshots))
+        except Exception as e:
+            print(f"Handoff write failed, {len(snapshots)} games are lost: {e!r}")
+    await game_log.flush()
+    written = time.perf_counter()
+    # 1012: clients reconnect, and resume against the restarted server
+    closing = [p.wsconnection for players in rooms.values() for p in players if not p.is_bot]
+    if ws_server is not None:
+        # Everyone else too: waiting rooms, spectators, unfinished logins
+        closing = list(set(closing).union(ws_server.websockets))
+    await asyncio.gather(*(ws.close(1012, "Server restarting") for ws in closing),
+                         return_exceptions=True)
+    done = time.perf_counter()
+    size = sum(len(raw) for raw in snapshots.values())
+    print(f"Drained in {(done - started) * 1000:.0f} ms: {len(snapshots)} games "
+          f"({size / 1024:.0f} KiB) snapshotted in {(snapshotted - started) * 1000:.0f} ms, "
+          f"written in {(written - snapshotted) * 1000:.0f} ms, "
+          f"{len(closing)} connections closed in {(done - written) * 1000:.0f} ms")
+
+async def resend_missed(player, data):
+    room_code = player.current_room
+    game = games.get(room_code)
+    if game is None or not is_seated(player):
+        return
+    await NetworkManager.send_message(player.wsconnection, "sync", sync_message(
+        room_code, game, room_syncs[room_code], player.seat, data.get("last_seq", 0)
+    ))
 
-async def main():
+def make_bot(room_code, seat, username):
+    return Player(player_id=f"bot-{uuid.uuid4()}", wsconnection=None, username=username,
+                  is_bot=True, current_room=room_code, seat=seat)
+
+async def fill_with_bots(room_code):
+    bot_fill_timers.pop(room_code, None)
+    players = rooms.get(room_code)
+    if not players or room_code in games or len(players) >= ROOM_SIZE:
+        return
+    while len(players) < ROOM_SIZE:
+        players.append(make_bot(room_code, len(players), f"Bot {len(players) + 1}"))
+    open_rooms.remove(room_code)
+    print(f"Room {room_code} filled with bots, ready to play!")
+    await broadcast_room_status(room_code)
+    await start_game(room_code)
+
+def schedule_bots(room_code):
+    task = bot_tasks.get(room_code)
+    if task is None or task.done():
+        bot_tasks[room_code] = asyncio.create_task(play_bot_turns(room_code))
+
+def arm_turn_timer(room_code):
+    """Give the human whose turn it is TURN_TIMEOUT seconds to move."""
+    timer = turn_timers.pop(room_code, None)
+    if timer is not None:
+        timer.cancel()
+    game = games.get(room_code)
+    if not TURN_TIMEOUT or game is None or game.phase not in ('trump', 'play'):
+        return
+    seat = game.hakem if game.phase == 'trump' else game.turn
+    if rooms[room_code][seat].is_bot:
+        return
+    turn_timers[room_code] = wheel.call_later(
+        TURN_TIMEOUT, turn_timed_out, room_code, game, seat, room_syncs[room_code].seq
+    )
+
+async def turn_timed_out(room_code, game, seat, seq):
+    """The human on turn let the clock run out: a bot makes this one move for them."""
+    turn_timers.pop(room_code, None)
+    player = rooms[room_code][seat]
+    if player.is_bot or draining:
+        return
+    action = await bot_pool.decide(bot_view(game, seat))
+    # They may have moved, left or been replaced while the bot was thinking
+    if games.get(room_code) is not game or room_syncs[room_code].seq != seq or draining:
+        return
+    TURN_TIMEOUTS.inc()
+    print(f"{player.username} ran out of time in room [{room_code}], a bot moved for them")
+    events = game.apply(seat, action)
+    game_log.append(room_code, seat, action, game)
+    await publish_events(room_code, game, events)
+    schedule_bots(room_code)
+
+async def play_bot_turns(room_code):
+    """Play for bot seats until it is a human's turn or the game ends."""
+    while True:
+        game = games.get(room_code)
+        if game is None or game.phase not in ('trump', 'play'):
+            return
+        seat = game.hakem if game.phase == 'trump' else game.turn
+        if not rooms[room_code][seat].is_bot or room_code in resume_timers:
+            # A human's turn, or no human left to play for: wait for a resume
+            return
+        started = metrics.start()
+        action = await bot_pool.decide(bot_view(game, seat))
+        metrics.BOT_SECONDS.observe_since(started)
+        # A human may have reclaimed the seat while the bot was thinking
+        if games.get(room_code) is not game or not rooms[room_code][seat].is_bot:
+            continue
+        try:
+            events = game.apply(seat, action)
+        except IllegalMove as e:
+            print(f"Bot in room {room_code} made an illegal move: {e}")
+            return
+        game_log.append(room_code, seat, action, game)
+        await publish_events(room_code, game, events)
+
+async def main(metrics_port=None, profile_handler=None, profile_rate=0.01, log_to=None,
+               outbox_policy=None, outbox_limit=None, inbound_rate=None, inbound_burst=None,
+               spectator_delay=None, turn_timeout=None, idle_timeout=None,
+               room_idle_timeout=None, handoff_to=None):
+    global game_log, room_handoff, TURN_TIMEOUT, IDLE_TIMEOUT, ROOM_IDLE_TIMEOUT
+    flowcontrol.configure(outbox_policy, outbox_limit, inbound_rate, inbound_burst)
+    if turn_timeout is not None:
+        TURN_TIMEOUT = turn_timeout
+    if idle_timeout is not None:
+        IDLE_TIMEOUT = idle_timeout
+    if room_idle_timeout is not None:
+        ROOM_IDLE_TIMEOUT = room_idle_timeout
+    spectators.configure(spectator_delay)
+    if log_to is not None:
+        game_log = GameLog(RedisStreamLog() if log_to == 'redis' else FileLog(log_to))
+    if handoff_to is not None:
+        room_handoff = (handoff.RedisHandoff() if handoff_to == 'redis'
+                        else handoff.FileHandoff(handoff_to))
+        await load_handoff()
+    if metrics_port is not None:
+        await metrics.enable(metrics_port)
+    metrics.profile_handler(profile_handler, profile_rate)
     print("Starting Hokm WebSocket server on ws://0.0.0.0:8765")
-    async with websockets.serve(handle_connection, "0.0.0.0", 8765):
-        await asyncio.Future()  # Run forever
+    async with websockets.serve(handle_connection, "0.0.0.0", 8765, subprotocols=SUBPROTOCOLS,
+                                max_size=flowcontrol.MAX_INBOUND_FRAME) as ws_server:
+        await stop_requested()
+        await drain(ws_server)
+
+async def stop_requested():
+    """Wait for SIGTERM or Ctrl-C."""
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        loop.add_signal_handler(sig, stop.set)
+    await stop.wait()
 
 if __name__ == "__main__":
-    asyncio.run(main())
+    parser = argparse.ArgumentParser(description="Hokm WebSocket server")
+    parser.add_argument('--metrics-port', type=int, default=None,
+                        help='serve Prometheus metrics on this port (default: off)')
+    parser.add_argument('--profile-handler', default=None,
+                        help='message type to sample under cProfile, see /profile')
+    parser.add_argument('--profile-rate', type=float, default=0.01)
+    parser.add_argument('--game-log', default=None,
+                        help="'redis' or a directory for the game event log (default: off)")
+    parser.add_argument('--outbox-policy', choices=flowcontrol.POLICIES, default=None,
+                        help=f'what to do when a client falls behind '
+                             f'(default: {flowcontrol.OUTBOX_POLICY})')
+    parser.add_argument('--outbox-limit', type=int, default=None,
+                        help=f'frames queued per connection (default: {flowcontrol.OUTBOX_LIMIT})')
+    parser.add_argument('--inbound-rate', type=float, default=None,
+                        help=f'messages per second per connection, 0 for no limit '
+                             f'(default: {flowcontrol.INBOUND_RATE:g})')
+    parser.add_argument('--inbound-burst', type=int, default=None,
+                        help=f'messages allowed at once (default: {flowcontrol.INBOUND_BURST})')
+    parser.add_argument('--spectator-delay', type=float, default=None,
+                        help='seconds spectators lag behind the table (default: 0)')
+    parser.add_argument('--turn-timeout', type=float, default=None,
+                        help=f'seconds before a bot moves for a slow human, 0 for never '
+                             f'(default: {TURN_TIMEOUT:g})')
+    parser.add_argument('--idle-timeout', type=float, default=None,
+                        help=f'seconds a connection may stay silent (default: {IDLE_TIMEOUT:g})')
+    parser.add_argument('--room-idle-timeout', type=float, default=None,
+                        help=f'seconds before a room without activity is closed '
+                             f'(default: {ROOM_IDLE_TIMEOUT:g})')
+    parser.add_argument('--handoff', default=None,
+                        help="'redis' or a file to hand games in progress to the next run "
+                             "on SIGTERM (default: off)")
+    args = parser.parse_args()
+    asyncio.run(main(args.metrics_port, args.profile_handler, args.profile_rate,
+                     args.game_log, args.outbox_policy, args.outbox_limit,
+                     args.inbound_rate, args.inbound_burst, args.spectator_delay,
+                     args.turn_timeout, args.idle_timeout, args.room_idle_timeout,
+                     args.handoff))
@@ -0,0 +1,200 @@
+# spectators.py
+"""Spectators: many read-only viewers per table, fed from one shared path.
+
+Every worker keeps an Audience per room it has viewers for. The room's
+owner publishes each public frame once (no hands, no resume tokens); the
+Audience encodes it once per codec in use and puts the same frame object
+into every viewer's outbox (flowcontrol.py). Delivery runs in the
+Audience's own task, after the seated players' frames are queued, so
+viewers never delay the table.
+
+With a delay, frames are held in the Audience's FIFO until they are
+``delay`` seconds old, so a viewer cannot relay a game to a seated player
+in real time.
+
+A new viewer waits for a snapshot frame (``spectating``). Frames queued
+before the snapshot skip it, as do deltas the snapshot already covers,
+so frames published around the join never arrive twice or out of order.
+
+Across workers (cluster.py) viewers connect to any worker. That worker
+reports its viewer count for the room to the owner, which relays each
+public frame once per watching worker rather than once per viewer and
+sums the counts for ``room_status``.
+"""
+import asyncio
+import json
+from collections import deque
+from typing import Callable, Dict, Optional
+
+from flowcontrol import outbox_for
+from protocol import codec_for
+
+SPECTATOR_DELAY = 0.0  # seconds frames are held back from viewers
+# Frame kinds: FRAME for everyone in sync, SNAPSHOT for viewers still waiting
+# for one (an error snapshot turns them away), FINAL to everyone, then close
+FRAME, SNAPSHOT, FINAL = 'frame', 'snapshot', 'final'
+
+audiences: Dict[str, 'Audience'] = {}
+remote_viewers: Dict[str, Dict[int, int]] = {}  # room -> worker id -> viewers there
+
+# Set by cluster.py; None on a single worker
+relay: Optional[Callable[[int, bytes], None]] = None  # send a relay payload to a worker
+report: Optional[Callable[[str, int, bool], None]] = None  # tell the owner our count
+# Set by server.py: called on the owner when a room's viewer count changes
+on_change: Optional[Callable[[str], None]] = None
+
+
+def configure(delay: float = None):
+    global SPECTATOR_DELAY
+    if delay is not None:
+        SPECTATOR_DELAY = delay
+
+
+class Audience:
+    """Local viewers of one room and the delayed frames still owed to them."""
+
+    def __init__(self, room_code: str, remote: bool = False, delay: float = None):
+        self.room_code = room_code
+        self.remote = remote  # the room lives on another worker
+        self.delay = SPECTATOR_DELAY if delay is None else delay
+        # websocket -> last seq it has, None until its snapshot is delivered
+        self.viewers: Dict[object, Optional[int]] = {}
+        self.pending = deque()  # (due, message_type, data, seq, kind)
+        self.task: Optional[asyncio.Task] = None
+
+    def __len__(self):
+        return len(self.viewers)
+
+    def add(self, websocket):
+        self.viewers[websocket] = None
+        self._changed(snapshot=True)
+
+    def remove(self, websocket):
+        if websocket not in self.viewers:
+            return
+        del self.viewers[websocket]
+        self._changed(snapshot=False)
+        if not self.viewers and not self.pending and audiences.get(self.room_code) is self:
+            del audiences[self.room_code]
+
+    def _changed(self, snapshot: bool):
+        if self.remote:
+            if report is not None:
+                report(self.room_code, len(self.viewers), snapshot)
+        elif on_change is not None:
+            on_change(self.room_code)
+
+    def publish(self, message_type: str, data: dict, seq: int = None, kind: str = FRAME):
+        """Queue a frame for the viewers, see FRAME, SNAPSHOT and FINAL."""
+        loop = asyncio.get_running_loop()
+        self.pending.append((loop.time() + self.delay, message_type, data, seq, kind))
+        if self.task is None:
+            self.task = loop.create_task(self._run())
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        try:
+            while self.pending:
+                # Always yield first: the seated players' frames go out before ours
+                await asyncio.sleep(max(0.0, self.pending[0][0] - loop.time()))
+                self._deliver(*self.pending.popleft()[1:])
+        finally:
+            self.task = None
+            if not self.viewers and audiences.get(self.room_code) is self:
+                del audiences[self.room_code]
+
+    def _deliver(self, message_type: str, data: dict, seq: Optional[int], kind: str):
+        frames = {}  # codec -> the one frame for every viewer using it
+        closing = []
+        for websocket, has in self.viewers.items():
+            if kind == SNAPSHOT:
+                if has is not None:
+                    continue
+                if message_type == 'error':
+                    closing.append(websocket)
+                else:
+                    self.viewers[websocket] = seq or 0
+            elif kind == FINAL:
+                closing.append(websocket)
+            elif has is None or (seq is not None and seq <= has):
+                continue  # queued before its snapshot, or covered by it
+            codec = codec_for(websocket)
+            frame = frames.get(codec)
+            if frame is None:
+                frame = frames[codec] = codec.encode(message_type, data)
+            outbox_for(websocket).put(message_type, frame)
+        for websocket in closing:
+            del self.viewers[websocket]
+            outbox_for(websocket).close()
+        if closing:
+            self._changed(snapshot=False)
+
+
+def audience(room_code: str, remote: bool = False) -> Audience:
+    current = audiences.get(room_code)
+    if current is None:
+        current = audiences[room_code] = Audience(room_code, remote)
+    return current
+
+
+def viewer_count(room_code: str) -> int:
+    """Viewers of a room this worker owns, on every worker."""
+    local = audiences.get(room_code)
+    return (len(local) if local else 0) + sum(remote_viewers.get(room_code, {}).values())
+
+
+def local_viewers() -> dict:
+    """Viewers connected to this worker, for the metrics gauge."""
+    return {None: sum(len(a) for a in audiences.values())}
+
+
+def relay_payload(room_code: str, message_type: str, data: dict, seq=None,
+                  kind: str = FRAME) -> bytes:
+    return json.dumps({'room': room_code, 'type': message_type, 'data': data,
+                       'seq': seq, 'kind': kind}, separators=(',', ':')).encode()
+
+
+def publish(room_code: str, message_type: str, data: dict, seq: int = None):
+    """Owner side: send a public frame to the room's viewers on every worker."""
+    local = audiences.get(room_code)
+    if local is not None and not local.remote:
+        local.publish(message_type, data, seq)
+    watchers = remote_viewers.get(room_code)
+    if watchers and relay is not None:
+        payload = relay_payload(room_code, message_type, data, seq)
+        for worker in watchers:
+            relay(worker, payload)
+
+
+def close(room_code: str, message: str = 'Room closed.'):
+    """Owner side: the room is gone; viewers everywhere are told and dropped."""
+    data = {'room_id': room_code, 'message': message}
+    local = audiences.get(room_code)
+    if local is not None and not local.remote:
+        local.publish('error', data, kind=FINAL)
+    watchers = remote_viewers.pop(room_code, None)
+    if watchers and relay is not None:
+        payload = relay_payload(room_code, 'error', data, kind=FINAL)
+        for worker in watchers:
+            relay(worker, payload)
+
+
+def on_relay(payload: bytes):
+    """Edge side: a frame relayed by the owner for our local viewers."""
+    message = json.loads(payload)
+    local = audiences.get(message['room'])
+    if local is not None:
+        local.publish(message['type'], message['data'], message['seq'], message['kind'])
+
+
+def on_report(room_code: str, worker: int, count: int):
+    """Owner side: a worker's viewer count for one of our rooms."""
+    watchers = remote_viewers.setdefault(room_code, {})
+    if count:
+        watchers[worker] = count
+    else:
+        watchers.pop(worker, None)
+        if not watchers:
+            del remote_viewers[room_code]
+    if on_change is not None:
+        on_change(room_code)
@@ -0,0 +1,104 @@
+# statesync.py
+"""Sequenced game deltas, replay buffers and session resume.
+
+The server numbers every batch of game events per room and keeps the most
+recent ones in a bounded buffer. Clients apply deltas in order with
+GameView; a client that reconnects (or notices a gap) presents its last
+sequence number and gets only the deltas it missed, or a snapshot if the
+buffer has moved past it.
+"""
+import secrets
+from collections import deque
+from typing import Dict, List, Optional, Tuple
+
+from engine import NUM_PLAYERS
+
+REPLAY_BUFFER = 256  # deltas kept per room
+
+
+class RoomSync:
+    """Sequence counter, replay buffer and resume tokens for one room."""
+
+    def __init__(self, max_deltas: int = REPLAY_BUFFER):
+        self.seq = 0
+        self.deltas = deque(maxlen=max_deltas)  # (seq, events)
+        self.tokens: Dict[str, Tuple[int, str]] = {}  # token -> (seat, username)
+
+    def record(self, events: List[dict]) -> int:
+        self.seq += 1
+        self.deltas.append((self.seq, events))
+        return self.seq
+
+    def since(self, last_seq: int) -> Optional[List[dict]]:
+        """Deltas after ``last_seq``, or None if a snapshot is needed."""
+        if last_seq >= self.seq:
+            return []
+        if last_seq < 0 or not self.deltas or last_seq < self.deltas[0][0] - 1:
+            return None
+        return [
+            {'seq': seq, 'events': events}
+            for seq, events in self.deltas if seq > last_seq
+        ]
+
+    def issue_token(self, seat: int, username: str) -> str:
+        token = secrets.token_urlsafe(16)
+        self.tokens[token] = (seat, username)
+        return token
+
+    def claim(self, token: str) -> Optional[Tuple[int, str]]:
+        return self.tokens.get(token)
+
+
+def hands_changed(events: List[dict]) -> bool:
+    """Deals and trump selection hand out cards clients cannot derive."""
+    return any(e['event'] in ('deal', 'trump') for e in events)
+
+
+class GameView:
+    """Client-side copy of the public game state, kept current by deltas."""
+
+    def __init__(self, seat: Optional[int] = None):
+        self.seat = seat
+        self.seq = 0
+        self.state: dict = {}
+        self.hand: List[str] = []
+
+    def load_snapshot(self, seq: int, state: dict, hand: List[str] = None):
+        self.seq = seq
+        self.state = dict(state, trick=list(state['trick']),
+                          tricks=list(state['tricks']), scores=list(state['scores']))
+        if hand is not None:
+            self.hand = list(hand)
+
+    def apply(self, seq: int, events: List[dict], hand: List[str] = None) -> bool:
+        """Apply one delta; False means a gap, so the client must resync."""
+        if seq <= self.seq:
+            return True  # already applied
+        if seq != self.seq + 1:
+            return False
+        for event in events:
+            self._apply_event(event)
+        if hand is not None:
+            self.hand = list(hand)
+        self.seq = seq
+        return True
+
+    def _apply_event(self, event: dict):
+        state = self.state
+        kind = event['event']
+        if kind == 'deal':
+            state.update(phase='trump', hakem=event['hakem'], turn=event['hakem'],
+                         trump=None, trick=[], tricks=[0, 0])
+        elif kind == 'trump':
+            state.update(trump=event['suit'], phase='play')
+        elif kind == 'card_played':
+            state['trick'].append(event['card'])
+            state['turn'] = (event['seat'] + 1) % NUM_PLAYERS
+            if event['seat'] == self.seat and event['card'] in self.hand:
+                self.hand.remove(event['card'])
+        elif kind == 'trick_won':
+            state.update(trick=[], turn=event['seat'], tricks=list(event['tricks']))
+        elif kind == 'hand_won':
+            state.update(scores=list(event['scores']), phase='hand_over')
+        elif kind == 'match_won':
+            state['phase'] = 'match_over'
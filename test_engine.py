@@ -0,0 +1,166 @@
+# test_engine.py
+import pytest
+
+from engine import (
+    HokmGame, IllegalMove, cards_of, hand_points, legal_mask, mask_of, parse_card, parse_suit,
+    trick_winner, SUIT_MASKS
+)
+
+S, H, D, C = range(4)
+
+
+def card(name):
+    return parse_card(name)
+
+
+def test_cards_and_masks_round_trip():
+    cards = [card('2S'), card('AS'), card('TD'), card('KC')]
+    assert cards_of(mask_of(cards)) == sorted(cards)
+    assert cards_of(0) == []
+
+
+def test_parse_rejects_unknown_names():
+    assert parse_card('as') == card('AS')
+    with pytest.raises(IllegalMove):
+        parse_card('1S')
+    with pytest.raises(IllegalMove):
+        parse_card(None)
+    assert parse_suit('h') == H
+    with pytest.raises(IllegalMove):
+        parse_suit('X')
+    with pytest.raises(IllegalMove):
+        parse_suit(['S'])
+
+
+def test_legal_mask_follows_suit_when_possible():
+    hand = mask_of([card('2S'), card('KS'), card('3H')])
+    assert legal_mask(hand, None) == hand
+    assert legal_mask(hand, S) == hand & SUIT_MASKS[S]
+    assert legal_mask(hand, D) == hand  # void: anything goes
+
+
+def test_trick_winner():
+    # Highest of the led suit wins; off-suit discards never do
+    assert trick_winner([card('5H'), card('KH'), card('AS'), card('2H')], trump=D) == 1
+    # Any trump beats the led suit, the highest trump wins
+    assert trick_winner([card('AH'), card('2D'), card('KH'), card('3D')], trump=D) == 3
+
+
+def test_hand_points_kot():
+    assert hand_points(winning_team=0, losing_tricks=3, hakem_team=0) == 1
+    assert hand_points(winning_team=0, losing_tricks=0, hakem_team=0) == 2  # kot by the hakem's team
+    assert hand_points(winning_team=1, losing_tricks=0, hakem_team=0) == 3  # kot against it
+
+
+def dealt_game(seed=1):
+    game = HokmGame(hakem=0, seed=seed)
+    game.start_hand()
+    game.choose_trump(0, S)
+    return game
+
+
+def test_deal():
+    game = HokmGame(hakem=2, seed=5)
+    assert game.start_hand()[0] == {'event': 'deal', 'hand_number': 1, 'hakem': 2}
+    assert game.phase == 'trump'
+    assert game.hands[2].bit_count() == 5 and game.hands[0] == 0
+    with pytest.raises(IllegalMove):
+        game.choose_trump(0, S)  # only the hakem
+    game.choose_trump(2, H)
+    assert [hand.bit_count() for hand in game.hands] == [13] * 4
+    assert not (game.hands[0] & game.hands[1] & game.hands[2] & game.hands[3])
+    assert game.hands[0] | game.hands[1] | game.hands[2] | game.hands[3] == (1 << 52) - 1
+
+
+def test_same_seed_same_deal():
+    assert dealt_game(seed=9).hands == dealt_game(seed=9).hands
+
+
+def test_play_validates_turn_cards_and_suit():
+    game = dealt_game()
+    with pytest.raises(IllegalMove):
+        game.play(1, cards_of(game.hands[1])[0])  # not their turn
+    with pytest.raises(IllegalMove):
+        game.play(0, cards_of(game.hands[1])[0])  # not their card
+    lead = cards_of(game.hands[0])[0]
+    game.play(0, lead)
+    suit = lead // 13
+    if game.hands[1] & SUIT_MASKS[suit] and game.hands[1] & ~SUIT_MASKS[suit]:
+        with pytest.raises(IllegalMove):
+            game.play(1, cards_of(game.hands[1] & ~SUIT_MASKS[suit])[0])
+    game.play(1, cards_of(game.legal_moves(1))[0])
+    assert game.turn == 2
+
+
+def test_must_follow_suit():
+    game = dealt_game()
+    game.hands[0] = mask_of([card('AH')])
+    game.hands[1] = mask_of([card('2H'), card('KS')])
+    game.play(0, card('AH'))
+    assert game.legal_moves(1) == mask_of([card('2H')])
+    with pytest.raises(IllegalMove, match='follow suit'):
+        game.play(1, card('KS'))
+    game.play(1, card('2H'))
+    assert game.voids[1] == 0
+
+
+def test_void_is_recorded():
+    for seed in range(2, 200):
+        # Find a deal where seat 1 cannot follow seat 0's lead
+        game = dealt_game(seed)
+        lead = next((c for c in cards_of(game.hands[0])
+                     if not game.hands[1] & SUIT_MASKS[c // 13]), None)
+        if lead is not None:
+            break
+    game.play(0, lead)
+    game.play(1, cards_of(game.hands[1])[0])
+    assert game.voids[1] == 1 << (lead // 13)
+
+
+def play_out_hand(game):
+    events = []
+    while game.phase == 'play':
+        seat = game.turn
+        events += game.play(seat, cards_of(game.legal_moves(seat))[0])
+    return events
+
+
+def test_hand_ends_at_seven_tricks_and_scores():
+    game = dealt_game()
+    events = play_out_hand(game)
+    tricks = [e for e in events if e['event'] == 'trick_won']
+    assert max(tricks[-1]['tricks']) == 7
+    won = next(e for e in events if e['event'] == 'hand_won')
+    assert game.scores[won['team']] == won['points']
+    # The next hand is dealt straight away
+    assert game.phase == 'trump' and game.hand_number == 2
+
+
+def test_match_over_at_seven_points():
+    game = HokmGame(seed=3)
+    game.start_hand()
+    while game.phase != 'match_over':
+        if game.phase == 'trump':
+            game.choose_trump(game.hakem, S)
+        play_out_hand(game)
+    assert max(game.scores) >= 7
+    with pytest.raises(IllegalMove):
+        game.start_hand()
+
+
+def test_state_round_trip():
+    game = dealt_game()
+    game.play(0, cards_of(game.legal_moves(0))[0])
+    copy = HokmGame.from_state(game.to_state())
+    assert copy.to_state() == game.to_state()
+    seat = copy.turn
+    card_ = cards_of(copy.legal_moves(seat))[0]
+    assert copy.play(seat, card_) == game.play(seat, card_)
+
+
+def test_apply_parses_client_messages():
+    game = HokmGame(hakem=0, seed=1)
+    game.start_hand()
+    assert game.apply(0, {'type': 'choose_trump', 'suit': 'H'})[0]['suit'] == 'H'
+    with pytest.raises(IllegalMove):
+        game.apply(0, {'type': 'bid'})
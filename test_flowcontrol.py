@@ -0,0 +1,173 @@
+# test_flowcontrol.py
+import asyncio
+
+import websockets
+
+import flowcontrol
+from flowcontrol import COALESCE, DISCONNECT, DROP, Outbox, TokenBucket
+
+
+class FakeWebsocket:
+    """Records frames; ``send`` waits while ``moving`` is clear, like a client that stopped reading."""
+
+    def __init__(self):
+        self.sent = []
+        self.closed = None
+        self.moving = asyncio.Event()
+        self.moving.set()
+
+    async def send(self, frame):
+        await self.moving.wait()
+        if self.closed is not None:
+            raise websockets.ConnectionClosedOK(None, None)
+        self.sent.append(frame)
+
+    async def close(self, code=1000, reason=''):
+        self.closed = (code, reason)
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+def test_frames_are_written_in_order():
+    async def main():
+        websocket = FakeWebsocket()
+        outbox = Outbox(websocket)
+        for i in range(5):
+            assert outbox.put('game_update', f'frame {i}') is None
+        await outbox.task
+        return websocket.sent
+    assert run(main()) == [f'frame {i}' for i in range(5)]
+
+
+def test_drop_when_full():
+    async def main():
+        websocket = FakeWebsocket()
+        websocket.moving.clear()
+        outbox = Outbox(websocket, limit=2, policy=DROP)
+        results = [outbox.put('game_update', i) for i in range(4)]
+        await asyncio.sleep(0)  # the writer takes the first frame and stalls on it
+        results.append(outbox.put('game_update', 4))
+        websocket.moving.set()
+        await outbox.task
+        return results, websocket.sent
+    results, sent = run(main())
+    assert results == [None, None, 'outbox full', 'outbox full', None]
+    assert sent == [0, 1, 4]
+
+
+def test_coalesce_replaces_queued_status():
+    async def main():
+        websocket = FakeWebsocket()
+        websocket.moving.clear()
+        outbox = Outbox(websocket, limit=3, policy=COALESCE)
+        outbox.put('game_update', 'move')
+        await asyncio.sleep(0)  # 'move' is being written
+        outbox.put('room_status', 'status 1')
+        outbox.put('game_update', 'move 2')
+        outbox.put('room_status', 'status 2')  # replaces status 1 in place
+        queued = len(outbox)
+        websocket.moving.set()
+        await outbox.task
+        return queued, websocket.sent
+    queued, sent = run(main())
+    assert queued == 2
+    assert sent == ['move', 'status 2', 'move 2']
+
+
+def test_coalesce_after_status_was_sent():
+    async def main():
+        websocket = FakeWebsocket()
+        outbox = Outbox(websocket, policy=COALESCE)
+        outbox.put('room_status', 'status 1')
+        await outbox.task
+        outbox.put('room_status', 'status 2')  # nothing queued to replace
+        await outbox.task
+        return websocket.sent
+    assert run(main()) == ['status 1', 'status 2']
+
+
+def test_disconnect_when_full():
+    async def main():
+        websocket = FakeWebsocket()
+        websocket.moving.clear()
+        outbox = Outbox(websocket, limit=1, policy=DISCONNECT)
+        outbox.put('game_update', 0)
+        await asyncio.sleep(0)
+        outbox.put('game_update', 1)
+        result = outbox.put('game_update', 2)
+        await asyncio.sleep(0)  # the close runs without waiting for the stalled send
+        return result, websocket.closed, outbox.put('game_update', 3), len(outbox)
+    result, closed, after, queued = run(main())
+    assert result == 'disconnected, too slow'
+    assert closed == (1013, 'Too slow to keep up')
+    assert after == 'connection closed'
+    assert queued == 0
+
+
+def test_close_after_queued_frames():
+    async def main():
+        websocket = FakeWebsocket()
+        outbox = Outbox(websocket)
+        outbox.put('error', 'last words')
+        outbox.close(1012, 'Server restarting')
+        await outbox.task
+        return websocket.sent, websocket.closed
+    assert run(main()) == (['last words'], (1012, 'Server restarting'))
+
+
+def test_send_to_closed_connection_stops_the_writer():
+    async def main():
+        websocket = FakeWebsocket()
+        websocket.closed = (1000, '')
+        outbox = Outbox(websocket)
+        outbox.put('game_update', 'a')
+        outbox.put('game_update', 'b')
+        await outbox.task
+        return outbox.closed, len(outbox), outbox.put('game_update', 'c')
+    assert run(main()) == (True, 0, 'connection closed')
+
+
+def test_flush_waits_for_registered_outbox():
+    async def main():
+        websocket = FakeWebsocket()
+        flowcontrol.outbox_for(websocket).put('error', 'bye')
+        await flowcontrol.flush(websocket)
+        return websocket.sent
+    assert run(main()) == ['bye']
+
+
+def test_outbox_for_is_per_connection():
+    first, second = FakeWebsocket(), FakeWebsocket()
+    assert flowcontrol.outbox_for(first) is flowcontrol.outbox_for(first)
+    assert flowcontrol.outbox_for(first) is not flowcontrol.outbox_for(second)
+
+
+def test_token_bucket_burst_then_rate(monkeypatch):
+    now = [0.0]
+    monkeypatch.setattr(flowcontrol.time, 'monotonic', lambda: now[0])
+    bucket = TokenBucket(rate=10, burst=3)
+    assert [bucket.take() for _ in range(4)] == [True, True, True, False]
+    assert bucket.strikes == 1
+    now[0] += 0.125  # a token and a quarter back
+    assert bucket.take() and not bucket.take()
+    now[0] += 10  # refills up to the burst, no further
+    assert [bucket.take() for _ in range(4)] == [True, True, True, False]
+
+
+def test_token_bucket_strikes_reset_on_success(monkeypatch):
+    now = [0.0]
+    monkeypatch.setattr(flowcontrol.time, 'monotonic', lambda: now[0])
+    bucket = TokenBucket(rate=1, burst=1)
+    bucket.take()
+    for _ in range(5):
+        bucket.take()
+    assert bucket.strikes == 5
+    now[0] += 1
+    assert bucket.take() and bucket.strikes == 0
+
+
+def test_token_bucket_unlimited():
+    bucket = TokenBucket(rate=0, burst=1)
+    assert all(bucket.take() for _ in range(1000))
@@ -0,0 +1,125 @@
+# test_handoff.py
+import asyncio
+import json
+import os
+from collections import namedtuple
+
+import handoff
+from datastore import RedisStore
+from engine import HokmGame, cards_of
+from handoff import FileHandoff, RedisHandoff, load_room, snapshot_room
+from statesync import RoomSync
+
+Seat = namedtuple('Seat', 'username is_bot')
+SEATS = [Seat('sara', False), Seat('bot 2', True), Seat('ali', False), Seat('bot 4', True)]
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+def game_in_progress():
+    game = HokmGame(hakem=0, seed=11)
+    game.start_hand()
+    game.choose_trump(0, 1)
+    for _ in range(6):
+        seat = game.turn
+        game.play(seat, cards_of(game.legal_moves(seat))[0])
+    sync = RoomSync()
+    for _ in range(8):
+        sync.record([{'event': 'card_played'}])
+    tokens = {seat: sync.issue_token(seat, p.username) for seat, p in enumerate(SEATS)}
+    return game, sync, tokens
+
+
+def test_snapshot_round_trip():
+    game, sync, tokens = game_in_progress()
+    snapshot = load_room(snapshot_room(game, sync, SEATS, 'log-1', 14))
+    assert snapshot['game'].to_state() == game.to_state()
+    assert snapshot['sync'].seq == 8
+    assert snapshot['sync'].claim(tokens[2]) == (2, 'ali')
+    assert snapshot['players'] == [[p.username, p.is_bot] for p in SEATS]
+    assert snapshot['log'] == ['log-1', 14]
+    # The replay buffer is not carried over: the first sync is a full snapshot
+    assert snapshot['sync'].since(5) is None
+
+
+def test_restored_game_plays_on():
+    game, sync, _ = game_in_progress()
+    restored = load_room(snapshot_room(game, sync, SEATS))['game']
+    assert restored is not game
+    seat = game.turn
+    card = cards_of(game.legal_moves(seat))[0]
+    assert restored.play(seat, card) == game.play(seat, card)
+    assert restored.to_state() == game.to_state()
+
+
+def test_snapshot_without_log():
+    game, sync, _ = game_in_progress()
+    assert load_room(snapshot_room(game, sync, SEATS))['log'] is None
+
+
+def test_redis_handoff():
+    async def main():
+        store = RedisStore.fake()
+        backend = RedisHandoff(store)
+        await backend.save({})  # nothing to write
+        assert await store.exists(handoff.HANDOFF_KEY) == 0
+        await backend.save({'123456': '{"a":1}', '234567': '{"b":2}'})
+        ttl = await store.ttl(handoff.HANDOFF_KEY)
+        codes = sorted(await backend.codes())
+        first = await backend.take('123456')
+        again = await backend.take('123456')
+        missing = await backend.take('999999')
+        return ttl, codes, first, again, missing, await backend.codes()
+    ttl, codes, first, again, missing, left = run(main())
+    assert 0 < ttl <= handoff.HANDOFF_TTL
+    assert codes == ['123456', '234567']
+    assert json.loads(first) == {'a': 1}
+    assert again is None and missing is None  # restored once only
+    assert left == ['234567']
+
+
+def test_file_handoff(tmp_path):
+    path = str(tmp_path / 'handoff.jsonl')
+
+    async def main():
+        await FileHandoff(path).save({'123456': '{"a":1}', '234567': '{"b":2}'})
+        assert os.path.exists(path)
+        backend = FileHandoff(path)
+        codes = sorted(await backend.codes())
+        return codes, await backend.take('234567'), await backend.take('234567')
+    codes, raw, again = run(main())
+    assert codes == ['123456', '234567']
+    assert json.loads(raw) == {'b': 2} and again is None
+    assert not os.path.exists(path)  # read once, then deleted
+
+
+def test_file_handoff_ignores_stale_files(tmp_path):
+    path = str(tmp_path / 'handoff.jsonl')
+
+    async def main():
+        await FileHandoff(path).save({'123456': '{}'})
+        old = os.path.getmtime(path) - handoff.HANDOFF_TTL - 1
+        os.utime(path, (old, old))
+        return await FileHandoff(path).codes()
+    assert run(main()) == []
+    assert not os.path.exists(path)
+
+
+def test_file_handoff_without_file(tmp_path):
+    assert run(FileHandoff(str(tmp_path / 'missing.jsonl')).codes()) == []
+
+
+def test_file_handoff_real_snapshot(tmp_path):
+    game, sync, tokens = game_in_progress()
+    path = str(tmp_path / 'handoff.jsonl')
+
+    async def main():
+        await FileHandoff(path).save({'123456': snapshot_room(game, sync, SEATS)})
+        backend = FileHandoff(path)
+        await backend.codes()
+        return load_room(await backend.take('123456'))
+    snapshot = run(main())
+    assert snapshot['game'].to_state() == game.to_state()
+    assert snapshot['sync'].claim(tokens[0]) == (0, 'sara')
@@ -0,0 +1,91 @@
+# test_lobby.py
+import asyncio
+
+import pytest
+
+import datastore
+import lobby
+from datastore import RedisStore
+from lobby import assign_player_to_room, get_room_players, leave_room, release_room
+
+
+@pytest.fixture
+def store(monkeypatch):
+    store = RedisStore.fake()
+    monkeypatch.setattr(datastore, '_store', store)
+    return store
+
+
+@pytest.fixture
+def two_codes(monkeypatch):
+    monkeypatch.setattr(lobby, 'FIRST_CODE', 100000)
+    monkeypatch.setattr(lobby, 'CODE_COUNT', 2)
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+async def fill(names):
+    return [await assign_player_to_room(name) for name in names]
+
+
+def test_fills_a_room_then_opens_the_next(store):
+    async def main():
+        seats = await fill(['a', 'b', 'c', 'd', 'e'])
+        return seats, await get_room_players(seats[0][0])
+    seats, players = run(main())
+    first = seats[0][0]
+    assert len(first) == lobby.ROOM_CODE_DIGITS
+    assert seats[:4] == [(first, n) for n in range(1, 5)]
+    assert seats[4][0] != first and seats[4][1] == 1
+    assert players == ['a', 'b', 'c', 'd']
+
+
+def test_full_rooms_keep_their_players_for_the_ttl(store):
+    async def main():
+        room_code = (await fill('abcd'))[0][0]
+        return await store.ttl(f'room:{room_code}:players')
+    assert 0 < run(main()) <= lobby.FULL_ROOM_TTL
+
+
+def test_codes_run_out_until_released(store, two_codes):
+    async def main():
+        rooms = [seats[0][0] for seats in (await fill('abcd'), await fill('efgh'))]
+        with pytest.raises(Exception, match='all room codes are in use'):
+            await assign_player_to_room('late')
+        assert await release_room(rooms[0])
+        assert not await release_room(rooms[0])  # never handed out twice
+        room_code, number = await assign_player_to_room('late')
+        return rooms, room_code, number, await get_room_players(room_code)
+    rooms, room_code, number, players = run(main())
+    assert sorted(rooms) == ['100000', '100001']
+    assert (room_code, number) == (rooms[0], 1)
+    assert players == ['late']  # the old list went with the release
+
+
+def test_abandoned_room_gives_its_code_back(store, two_codes):
+    async def main():
+        room_code = (await fill('ab'))[0][0]
+        assert not await leave_room(room_code, 'a')
+        assert await get_room_players(room_code) == ['b']
+        assert await leave_room(room_code, 'b')
+        assert not await leave_room(room_code, 'b')
+        # The next player opens a new room; the code comes back once fresh ones run out
+        seats = await fill(['c', 'd', 'e', 'f', 'g'])
+        return room_code, seats
+    room_code, seats = run(main())
+    assert seats[0][0] != room_code
+    assert seats[4] == (room_code, 1)
+
+
+def test_finished_room_gives_its_code_back(store):
+    async def main():
+        room_code = (await fill('abcd'))[0][0]
+        done = [await leave_room(room_code, name) for name in 'abcd']
+        free = await store.lrange(f'{lobby.CODE_SPACE}:free', 0, -1)
+        return room_code, done, free, await store.exists(f'room:{room_code}:players')
+    room_code, done, free, players = run(main())
+    assert done == [False, False, False, True]
+    assert free == [room_code.encode()]
+    assert players == 0
@@ -0,0 +1,234 @@
+# test_matchmaking.py
+import asyncio
+
+import pytest
+
+import matchmaking
+from datastore import RedisStore
+from matchmaking import BUCKET_WIDTH, DEFAULT_RATING, RATINGS_KEY, Matchmaker
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1_700_000_000.0
+
+    def time(self):
+        return self.now
+
+    def perf_counter(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(matchmaking, 'time', clock)
+    return clock
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+def matchmaker(store, table_size=4):
+    tables = []
+
+    async def on_match(player_ids):
+        tables.append(sorted(player_ids))
+    mm = Matchmaker(on_match, table_size=table_size, store=store)
+    mm._wake = lambda: None  # ticks are driven by the test
+    return mm, tables
+
+
+async def rate(store, **ratings):
+    await store.hset(RATINGS_KEY, mapping=ratings)
+
+
+def test_same_bucket_makes_a_table(clock):
+    async def main():
+        mm, tables = matchmaker(RedisStore.fake())
+        for name in 'abcde':
+            mm.enqueue(name)
+        await mm.tick()
+        return mm, tables
+    mm, tables = run(main())
+    assert tables == [['a', 'b', 'c', 'd']]
+    assert mm.queued == 1 and list(mm.waiting) == ['e']
+
+
+def test_two_player_tables(clock):
+    async def main():
+        mm, tables = matchmaker(RedisStore.fake(), table_size=2)
+        for name in 'abcd':
+            mm.enqueue(name)
+        await mm.tick()
+        return tables
+    assert run(main()) == [['a', 'b'], ['c', 'd']]
+
+
+def test_spread_widens_with_waiting(clock):
+    async def main():
+        store = RedisStore.fake()
+        await rate(store, a=1500, b=1500, c=1500, d=1500 + 2 * BUCKET_WIDTH)
+        mm, tables = matchmaker(store)
+        for name in 'abcd':
+            mm.enqueue(name, name)
+        await mm.tick()
+        assert tables == []  # two buckets apart
+        clock.now += matchmaking.WIDEN_AFTER
+        await mm.tick()
+        assert tables == []  # one bucket allowed
+        clock.now += matchmaking.WIDEN_AFTER
+        await mm.tick()
+        return tables
+    assert run(main()) == [['a', 'b', 'c', 'd']]
+
+
+def test_never_wider_than_max_widen(clock):
+    async def main():
+        store = RedisStore.fake()
+        far = 1500 + (matchmaking.MAX_WIDEN + 1) * BUCKET_WIDTH
+        await rate(store, a=1500, b=1500, c=1500, d=far)
+        mm, tables = matchmaker(store)
+        for name in 'abcd':
+            mm.enqueue(name, name)
+        clock.now += 1000
+        await mm.tick()
+        return tables
+    assert run(main()) == []
+
+
+def test_cancel_before_and_after_reaching_redis(clock):
+    async def main():
+        store = RedisStore.fake()
+        mm, tables = matchmaker(store)
+        mm.enqueue('gone early')
+        mm.cancel('gone early')  # never sent
+        for name in 'abc':
+            mm.enqueue(name)
+        await mm.tick()
+        mm.cancel('c')  # queued in Redis: removed on the next tick
+        mm.enqueue('d')
+        await mm.tick()
+        assert tables == []  # a, b and d only
+        mm.enqueue('e')
+        await mm.tick()
+        return tables, await store.zcard(mm.key)
+    tables, left = run(main())
+    assert tables == [['a', 'b', 'd', 'e']]
+    assert left == 0
+
+
+def test_cancel_while_the_tick_runs(clock):
+    async def main():
+        mm, tables = matchmaker(RedisStore.fake())
+        for name in 'abcd':
+            mm.enqueue(name)
+        script = mm.script
+
+        async def racing_script(keys, args):
+            reply = await script(keys=keys, args=args)
+            mm.cancel('c')  # leaves after Redis matched them, before the reply arrives
+            return reply
+        mm.script = racing_script
+        await mm.tick()
+        assert tables == []
+        # The rest go back at their old place and match with the next player
+        mm.script = script
+        mm.enqueue('e')
+        await mm.tick()
+        return tables
+    assert run(main()) == [['a', 'b', 'd', 'e']]
+
+
+def test_failed_tick_is_retried(clock, capsys):
+    async def main():
+        mm, tables = matchmaker(RedisStore.fake())
+        for name in 'abcd':
+            mm.enqueue(name)
+        script = mm.script
+
+        async def broken_script(keys, args):
+            raise ConnectionError('redis went away')
+        mm.script = broken_script
+        assert await mm.tick() == []
+        mm.script = script
+        await mm.tick()
+        return tables
+    assert run(main()) == [['a', 'b', 'c', 'd']]
+    assert 'redis went away' in capsys.readouterr().out
+
+
+def test_tables_stay_in_one_process(clock):
+    async def main():
+        store = RedisStore.fake()
+        one, one_tables = matchmaker(store)
+        two, two_tables = matchmaker(store)
+        for i in range(4):
+            one.enqueue(f'one{i}')
+            two.enqueue(f'two{i}')
+        # One tick forms both tables: its own at once, the other via the mailbox
+        await one.tick()
+        assert one_tables == [['one0', 'one1', 'one2', 'one3']]
+        assert two_tables == []
+        await two.tick()
+        return two_tables, await store.zcard(one.key)
+    two_tables, left = run(main())
+    assert two_tables == [['two0', 'two1', 'two2', 'two3']]
+    assert left == 0
+
+
+def test_results_update_ratings(clock):
+    async def main():
+        store = RedisStore.fake()
+        await rate(store, a=1600, b=1600)
+        mm, _ = matchmaker(store)
+        mm.record_result(['a', 'b'], ['c', 'd'])
+        mm.record_result([], ['x'])  # ignored: nobody to rate against
+        await mm.tick()
+        return {k.decode(): float(v) for k, v in (await store.hgetall(RATINGS_KEY)).items()}
+    ratings = run(main())
+    expected = 1 / (1 + 10 ** ((DEFAULT_RATING - 1600) / 400))
+    delta = matchmaking.ELO_K * (1 - expected)
+    assert ratings['a'] == pytest.approx(1600 + delta)
+    assert ratings['c'] == pytest.approx(DEFAULT_RATING - delta)
+    assert 'x' not in ratings
+
+
+def test_tick_reads_windows_not_the_whole_queue(clock, monkeypatch):
+    monkeypatch.setattr(matchmaking, 'SEEK_SPAN', 8)
+    monkeypatch.setattr(matchmaking, 'SCAN_WINDOW', 32)
+
+    async def main():
+        store = RedisStore.fake()
+        mm, tables = matchmaker(store)
+        # Parked players, each too far from the next to ever be matched
+        gap = (matchmaking.MAX_WIDEN + 1) * BUCKET_WIDTH
+        parked = {f'parked{i}': 10000 + i * gap for i in range(500)}
+        await rate(store, **parked)
+        for name in parked:
+            mm.enqueue(name, name)
+        await mm.tick()
+        # Four joins in the middle of the queue, far from the sweep, still match at once
+        middle = 10000 + 250 * gap + gap // 2
+        await rate(store, **{f'new{i}': middle for i in range(4)})
+        for i in range(4):
+            mm.enqueue(f'new{i}', f'new{i}')
+        await mm.tick()
+        assert tables == [['new0', 'new1', 'new2', 'new3']]
+        # Players joined in different ticks, two buckets apart, are found by
+        # the sweep once their window has widened
+        late = 10000 + 400 * gap + gap // 2
+        await rate(store, w=late, x=late, y=late + BUCKET_WIDTH, z=late + 2 * BUCKET_WIDTH)
+        for name in 'wxyz':
+            mm.enqueue(name, name)
+            await mm.tick()
+        clock.now += 2 * matchmaking.WIDEN_AFTER
+        ticks = 0
+        while len(tables) < 2 and ticks < 100:
+            await mm.tick()
+            ticks += 1
+        return tables, ticks
+    tables, ticks = run(main())
+    assert tables[1] == ['w', 'x', 'y', 'z']
+    assert ticks > 1  # not in the windows around their joins: the sweep got there
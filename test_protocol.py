@@ -0,0 +1,83 @@
+# test_protocol.py
+import json
+
+import pytest
+
+from protocol import BINARY, JSON, BINARY_SUBPROTOCOL, T_LIST, TYPE_IDS, codec_for
+
+MESSAGES = [
+    ('keepalive', None),
+    ('room_joined', {'room_id': '123456', 'player_number': 2, 'total_players': 2}),
+    ('game_update', {'seq': 7, 'events': [{'event': 'card_played', 'seat': 3, 'card': 'QH'}]}),
+    ('game_start', {'hand': ['2S', '5S', 'TS', 'KS', 'AS', '3H', '9H', 'JH', '4D'],
+                    'usernames': ['ali', None, 'bot', 'sara'], 'scores': [0, -1]}),
+    ('something_new', {'unknown_key': 1.5, 'flag': True, 'off': False, 'nested': {'a': []}}),
+]
+
+
+@pytest.mark.parametrize('codec', [JSON, BINARY], ids=['json', 'binary'])
+@pytest.mark.parametrize('message_type, data', MESSAGES)
+def test_round_trip(codec, message_type, data):
+    assert codec.decode(codec.encode(message_type, data)) == {'type': message_type, **(data or {})}
+
+
+@pytest.mark.parametrize('codec', [JSON, BINARY], ids=['json', 'binary'])
+def test_head_and_per_recipient_fields(codec):
+    head = codec.encode_head('game_start', {'seat': 0})
+    frame = codec.finish(head, {'hand': ['AS', 'KS']})
+    assert codec.decode(frame) == {'type': 'game_start', 'seat': 0, 'hand': ['AS', 'KS']}
+    assert codec.decode(codec.finish(head)) == {'type': 'game_start', 'seat': 0}
+
+
+def test_binary_is_smaller():
+    data = MESSAGES[3][1]
+    assert len(BINARY.encode('game_start', data)) < len(JSON.encode('game_start', data)) / 2
+
+
+def test_binary_accepts_json_text_frames():
+    assert BINARY.decode('{"type": "keepalive"}') == {'type': 'keepalive'}
+
+
+@pytest.mark.parametrize('raw', [
+    '{"type": ',  # not JSON
+    '[1, 2]',  # JSON, but not an object
+    '"keepalive"',
+    '[' * 100000 + ']' * 100000,  # nested past the recursion limit
+])
+def test_json_decode_errors(raw):
+    with pytest.raises(ValueError):
+        JSON.decode(raw)
+
+
+@pytest.mark.parametrize('raw', [
+    b'',  # no type
+    bytes([200]),  # unknown type id
+    bytes([TYPE_IDS['sync'], 250, 0]),  # unknown key id
+    bytes([TYPE_IDS['sync'], 1]),  # key without a value
+    bytes([TYPE_IDS['sync'], 1, 99]),  # unknown value tag
+    bytes([TYPE_IDS['sync'], 1, 5, 10]) + b'abc',  # string shorter than its length
+    bytes([TYPE_IDS['sync'], 1, 5, 2]) + b'\xff\xfe',  # string not UTF-8
+    bytes([TYPE_IDS['sync'], 1, 4]) + b'\x00\x00',  # float cut short
+    bytes([TYPE_IDS['sync'], 1, 8, 60]),  # card out of range
+    bytes([TYPE_IDS['sync'], 1]) + bytes([T_LIST, 1]) * 100000,  # nested too deeply
+])
+def test_binary_decode_errors(raw):
+    with pytest.raises(ValueError):
+        BINARY.decode(raw)
+
+
+def test_unencodable_value():
+    with pytest.raises(TypeError):
+        BINARY.encode('sync', {'seq': object()})
+
+
+class FakeWebsocket:
+    def __init__(self, subprotocol):
+        self.subprotocol = subprotocol
+
+
+def test_codec_for():
+    assert codec_for(FakeWebsocket(BINARY_SUBPROTOCOL)) is BINARY
+    assert codec_for(FakeWebsocket(None)) is JSON
+    assert codec_for(object()) is JSON
+    assert json.loads(codec_for(object()).encode('keepalive')) == {'type': 'keepalive'}
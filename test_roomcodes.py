@@ -0,0 +1,77 @@
+# test_roomcodes.py
+import random
+
+import pytest
+
+from roomcodes import OpenRoomIndex, RoomCodeAllocator, RoomCodesExhausted
+
+
+def allocator(**kwargs):
+    return RoomCodeAllocator(rng=random.Random(7), **kwargs)
+
+
+def test_draws_every_code_once():
+    codes = allocator(digits=2)
+    drawn = [codes.allocate() for _ in range(90)]
+    assert sorted(drawn) == [str(n) for n in range(10, 100)]
+    assert len(codes) == 90
+    with pytest.raises(RoomCodesExhausted):
+        codes.allocate()
+
+
+def test_default_width():
+    assert len(allocator().allocate()) == 6
+
+
+def test_released_codes_are_reused_after_fresh_ones():
+    codes = allocator(digits=1)
+    drawn = [codes.allocate() for _ in range(8)]
+    codes.release(drawn[0])
+    assert codes.allocate() not in drawn  # the ninth fresh code first
+    assert codes.allocate() == drawn[0]
+
+
+def test_release_is_idempotent():
+    codes = allocator(digits=1)
+    code = codes.allocate()
+    codes.release(code)
+    codes.release(code)
+    codes.release('not a code')
+    assert list(codes.free) == [code] and len(codes) == 0
+
+
+def test_reserved_codes_are_skipped():
+    codes = allocator(digits=1)
+    codes.reserve('5')
+    codes.reserve('5')
+    drawn = [codes.allocate() for _ in range(8)]
+    assert '5' not in drawn
+    with pytest.raises(RoomCodesExhausted):
+        codes.allocate()
+    codes.release('5')
+    assert codes.allocate() == '5'
+
+
+def test_partitions_split_the_space():
+    parts = [allocator(digits=2, partition=p, partitions=3) for p in range(3)]
+    drawn = [set(part.allocate() for _ in range(part.size)) for part in parts]
+    assert [len(codes) for codes in drawn] == [30, 30, 30]
+    assert set.union(*drawn) == {str(n) for n in range(10, 100)}
+    for p, codes in enumerate(drawn):
+        assert all(int(code) % 3 == p for code in codes)
+
+
+def test_open_rooms_pick_the_fullest():
+    index = OpenRoomIndex(room_size=4)
+    assert index.pick() is None
+    index.update('a', 1)
+    index.update('b', 3)
+    index.update('c', 2)
+    assert index.pick() == 'b'
+    index.update('b', 4)  # full: leaves the index
+    assert 'b' not in index and index.pick() == 'c'
+    index.remove('c')
+    index.remove('c')
+    assert index.pick() == 'a' and len(index) == 1
+    index.update('a', 0)  # emptied, still open
+    assert index.pick() == 'a'
@@ -0,0 +1,179 @@
+# test_timerwheel.py
+import asyncio
+
+import pytest
+
+import timerwheel
+from timerwheel import IdleTimer, TimingWheel
+
+
+class Clock:
+    """Stands in for the time module; tests move ``now`` by hand."""
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(timerwheel, 'time', clock)
+    return clock
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+def step(wheel, clock, ticks):
+    """Move the clock and process the ticks by hand, as the wheel's task would."""
+    fired = 0
+    for _ in range(ticks):
+        clock.now += wheel.tick
+        fired += wheel.advance()
+    return fired
+
+
+def test_fires_on_its_tick(clock):
+    async def main():
+        wheel = TimingWheel(tick=0.125)
+        fired = []
+        wheel.call_later(0.3, fired.append, 'a')  # due at tick 3
+        assert step(wheel, clock, 2) == 0 and fired == []
+        assert step(wheel, clock, 1) == 1 and fired == ['a']
+        assert len(wheel) == 0
+    run(main())
+
+
+def test_cancel(clock):
+    async def main():
+        wheel = TimingWheel(tick=0.125)
+        fired = []
+        kept = wheel.call_later(0.25, fired.append, 'kept')
+        dropped = wheel.call_later(0.25, fired.append, 'dropped')
+        assert len(wheel) == 2
+        dropped.cancel()
+        dropped.cancel()  # twice is harmless
+        assert not dropped.active and kept.active and len(wheel) == 1
+        step(wheel, clock, 3)
+        assert fired == ['kept'] and not kept.active
+        kept.cancel()  # after firing too
+        assert len(wheel) == 0
+    run(main())
+
+
+@pytest.mark.parametrize('delay_ticks', [1, 3, 4, 5, 15, 16, 17, 63, 64, 100, 255])
+def test_higher_levels_cascade_to_the_exact_tick(clock, delay_ticks):
+    async def main():
+        # 4 slots per level, so most of these delays start above level 0
+        wheel = TimingWheel(tick=0.125, slot_bits=2, levels=4)
+        step(wheel, clock, 7)  # not aligned to a level boundary
+        fired = []
+        wheel.call_later(delay_ticks * wheel.tick, fired.append, 'due')
+        step(wheel, clock, delay_ticks - 1)
+        assert fired == []
+        step(wheel, clock, 1)
+        assert fired == ['due']
+    run(main())
+
+
+def test_cancel_after_cascade(clock):
+    async def main():
+        wheel = TimingWheel(tick=0.125, slot_bits=2, levels=3)
+        fired = []
+        timer = wheel.call_later(20 * wheel.tick, fired.append, 'x')
+        step(wheel, clock, 17)  # moved down a level or two by now
+        timer.cancel()
+        step(wheel, clock, 10)
+        assert fired == [] and len(wheel) == 0
+    run(main())
+
+
+def test_delays_past_the_horizon_are_clamped(clock):
+    async def main():
+        wheel = TimingWheel(tick=0.125, slot_bits=2, levels=2)  # 15 ticks
+        fired = []
+        wheel.call_later(1000, fired.append, 'late')
+        step(wheel, clock, 15)
+        assert fired == ['late']
+    run(main())
+
+
+def test_coroutine_callbacks_become_tasks(clock):
+    async def main():
+        wheel = TimingWheel(tick=0.125)
+        done = asyncio.Event()
+
+        async def callback():
+            done.set()
+        wheel.call_later(0.1, callback)
+        step(wheel, clock, 1)
+        await asyncio.wait_for(done.wait(), 1)
+    run(main())
+
+
+def test_a_failing_callback_does_not_stop_the_others(clock, capsys):
+    async def main():
+        wheel = TimingWheel(tick=0.125)
+        fired = []
+        wheel.call_later(0.1, lambda: 1 / 0)
+        wheel.call_later(0.1, fired.append, 'after')
+        step(wheel, clock, 1)
+        return fired
+    assert run(main()) == ['after']
+    assert 'ZeroDivisionError' in capsys.readouterr().out
+
+
+def test_idle_timer_fires_after_silence(clock):
+    async def main():
+        wheel = TimingWheel(tick=0.125)
+        fired = []
+        IdleTimer(1.0, fired.append, 'idle', wheel=wheel)
+        step(wheel, clock, 7)
+        assert fired == []
+        step(wheel, clock, 1)
+        assert fired == ['idle']
+    run(main())
+
+
+def test_idle_timer_touch_postpones(clock):
+    async def main():
+        wheel = TimingWheel(tick=0.125)
+        fired = []
+        idle = IdleTimer(1.0, fired.append, 'idle', wheel=wheel)
+        step(wheel, clock, 6)
+        idle.touch()
+        step(wheel, clock, 7)  # past the first deadline, not a second since the touch
+        assert fired == []
+        step(wheel, clock, 2)
+        assert fired == ['idle']
+    run(main())
+
+
+def test_idle_timer_cancel(clock):
+    async def main():
+        wheel = TimingWheel(tick=0.125)
+        fired = []
+        idle = IdleTimer(1.0, fired.append, 'idle', wheel=wheel)
+        step(wheel, clock, 6)
+        idle.touch()
+        step(wheel, clock, 3)  # re-armed itself by now
+        idle.cancel()
+        step(wheel, clock, 20)
+        assert fired == [] and len(wheel) == 0
+    run(main())
+
+
+def test_wheel_task_runs_timers_and_exits_when_empty():
+    async def main():
+        wheel = TimingWheel(tick=0.01)
+        done = asyncio.Event()
+        wheel.call_later(0.02, done.set)
+        assert wheel.task is not None
+        await asyncio.wait_for(done.wait(), 1)
+        await asyncio.sleep(0.05)
+        return wheel.task
+    assert run(main()) is None
@@ -0,0 +1,142 @@
+# test_tokens.py
+import pytest
+
+import tokens
+from tokens import TokenSigner
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1_700_000_000.0
+
+    def time(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(tokens, 'time', clock)
+    return clock
+
+
+@pytest.fixture
+def signer(clock):
+    return TokenSigner({'k1': b'first secret'}, 'k1', ttl=3600)
+
+
+def test_issue_and_verify(signer, clock):
+    token = signer.issue('sara')
+    assert token.startswith('k1.')
+    session = signer.verify(token)
+    assert session.username == 'sara'
+    assert session.expires == int(clock.now) + 3600
+    assert session.issued == int(clock.now * 1000)
+
+
+def test_usernames_are_utf8(signer):
+    assert signer.verify(signer.issue('سارا')).username == 'سارا'
+
+
+def test_token_ids_are_unique(signer):
+    assert signer.verify(signer.issue('a')).token_id != signer.verify(signer.issue('a')).token_id
+
+
+@pytest.mark.parametrize('token', [None, 42, ['k1'], '', 'k1.abc', 'k1.a.b.c', 'nokey.abc.def'])
+def test_malformed_tokens(signer, token):
+    assert signer.verify(token) is None
+
+
+def test_tampering_is_detected(signer):
+    kid, payload, signature = signer.issue('sara').split('.')
+    other = signer.issue('admin').split('.')[1]
+    assert signer.verify(f"{kid}.{other}.{signature}") is None
+    flipped = signature[:-1] + ('A' if signature[-1] != 'A' else 'B')
+    assert signer.verify(f"{kid}.{payload}.{flipped}") is None
+    # Same payload and signature under another key id
+    signer.rotate('k2', b'second secret')
+    assert signer.verify(f"k2.{payload}.{signature}") is None
+
+
+def test_other_secret_does_not_verify(signer):
+    impostor = TokenSigner({'k1': b'guessed secret'}, 'k1')
+    assert signer.verify(impostor.issue('sara')) is None
+
+
+def test_expiry(signer, clock):
+    token = signer.issue('sara')
+    short = signer.issue('sara', ttl=10)
+    clock.now += 10
+    assert signer.verify(short) is None
+    assert signer.verify(token) is not None
+    clock.now += 3600
+    assert signer.verify(token) is None
+
+
+def test_rotate_then_retire(signer):
+    old = signer.issue('sara')
+    signer.rotate('k2', b'second secret')
+    new = signer.issue('sara')
+    assert new.startswith('k2.')
+    assert signer.verify(old) and signer.verify(new)
+    with pytest.raises(ValueError):
+        signer.retire('k2')  # still current
+    signer.retire('k1')
+    assert signer.verify(old) is None
+    assert signer.verify(new) is not None
+    signer.retire('k1')  # already gone: harmless
+
+
+def test_revoke(signer, clock):
+    token, other = signer.issue('sara'), signer.issue('sara')
+    assert signer.revoke(token)
+    assert signer.verify(token) is None
+    assert signer.verify(other) is not None
+    assert not signer.revoke(token)  # already revoked
+    assert not signer.revoke('garbage')
+
+
+def test_revoked_ids_are_forgotten_once_expired(signer, clock):
+    signer.revoke(signer.issue('a', ttl=10))
+    clock.now += 20
+    signer.revoke(signer.issue('b'))
+    assert len(signer.revoked) == 1
+
+
+def test_revoke_user(signer, clock):
+    before = signer.issue('sara')
+    bystander = signer.issue('ali')
+    clock.now += 1
+    signer.revoke_user('sara')
+    assert signer.verify(before) is None
+    assert signer.verify(bystander) is not None
+    clock.now += 1
+    assert signer.verify(signer.issue('sara')) is not None
+
+
+def test_from_env(monkeypatch):
+    monkeypatch.setenv(tokens.KEYS_ENV, 'new:s2,old:s1')
+    signer = TokenSigner.from_env()
+    assert signer.current == 'new'
+    assert signer.keys == {'new': b's2', 'old': b's1'}
+    old = TokenSigner({'old': b's1'}, 'old').issue('sara')
+    assert signer.verify(old).username == 'sara'
+
+
+@pytest.mark.parametrize('spec', ['nosecret', ':secret', 'a.b:secret', 'ok:s,bad'])
+def test_from_env_rejects_bad_entries(monkeypatch, spec):
+    monkeypatch.setenv(tokens.KEYS_ENV, spec)
+    with pytest.raises(ValueError):
+        TokenSigner.from_env()
+
+
+def test_from_env_without_keys_makes_one(monkeypatch):
+    monkeypatch.delenv(tokens.KEYS_ENV, raising=False)
+    first, second = TokenSigner.from_env(), TokenSigner.from_env()
+    assert first.verify(first.issue('sara')) is not None
+    assert second.verify(first.issue('sara')) is None  # a restart forgets the key
+
+
+def test_unknown_current_key():
+    with pytest.raises(ValueError):
+        TokenSigner({'k1': b'secret'}, 'k2')
@@ -0,0 +1,181 @@
+# timerwheel.py
+"""One hierarchical timing wheel for every timer the server keeps.
+
+Turn deadlines, idle connections, abandoned rooms, bot fills and debounced
+room_status frames all go on one wheel driven by a single task, instead
+of an asyncio timer (and often a sleeping task) per entity. The loop's
+timer heap costs O(log n) per schedule, and a cancelled handle stays in
+the heap until it is popped. On the wheel both are O(1):
+
+    timer = wheel.call_later(30, turn_timed_out, room_code)
+    timer.cancel()
+
+Time moves in ticks of TICK seconds. Level 0 has 2^SLOT_BITS slots of
+one tick each; each level above has as many slots, each as long as the
+whole level below. A timer goes in the lowest level whose span covers it. When a
+level wraps, the next slot of the level above is emptied back into the
+levels below. Each slot is a dict, so cancelling is one deletion. With
+the defaults the levels span 25.6 s, 1.8 hours, 19 days and 13 years,
+and timers are early or late by at most one tick.
+
+Callbacks run on the wheel's task. A callback that returns a coroutine
+has it scheduled as a task. While the wheel is empty the task exits, and
+the next call_later() starts it again.
+
+IdleTimer is the cheap form for deadlines that move on every message,
+like idle connections: ``touch()`` stores the time, and the timer re-arms
+itself only when it fires and finds recent activity.
+"""
+import asyncio
+import math
+import time
+from typing import Callable, Dict, List, Optional
+
+TICK = 0.1  # seconds per tick
+SLOT_BITS = 8  # 256 slots per level
+LEVELS = 4
+
+
+class Timer:
+    __slots__ = ('wheel', 'due', 'callback', 'args', 'slot')
+
+    def __init__(self, wheel: 'TimingWheel', due: int, callback: Callable, args: tuple):
+        self.wheel = wheel
+        self.due = due  # tick
+        self.callback = callback
+        self.args = args
+        self.slot: Optional[dict] = None  # the slot holding us, None once fired or cancelled
+
+    def cancel(self):
+        slot = self.slot
+        if slot is not None:
+            del slot[self]
+            self.slot = None
+            self.wheel.count -= 1
+
+    @property
+    def active(self) -> bool:
+        return self.slot is not None
+
+
+class TimingWheel:
+    def __init__(self, tick: float = TICK, slot_bits: int = SLOT_BITS, levels: int = LEVELS):
+        self.tick = tick
+        self.bits = slot_bits
+        self.mask = (1 << slot_bits) - 1
+        self.levels: List[List[Dict[Timer, None]]] = [
+            [{} for _ in range(1 << slot_bits)] for _ in range(levels)
+        ]
+        self.horizon = (1 << (slot_bits * levels)) - 1  # ticks; later timers are clamped
+        self.origin = time.monotonic()
+        self.current = 0  # the last tick processed
+        self.count = 0
+        self.task: Optional[asyncio.Task] = None
+
+    def __len__(self):
+        return self.count
+
+    def now(self) -> int:
+        """The tick the clock is in, processed or not."""
+        return int((time.monotonic() - self.origin) / self.tick)
+
+    def call_later(self, delay: float, callback: Callable, *args) -> Timer:
+        if self.task is None:
+            # Idle, so nothing is due: skip the ticks slept through
+            self.current = max(self.current, self.now())
+            self.task = asyncio.get_running_loop().create_task(self._run())
+        due = math.ceil((time.monotonic() + delay - self.origin) / self.tick)
+        # Never the tick being fired now, or it would wait a whole rotation
+        due = min(max(due, self.current + 1), self.current + self.horizon)
+        timer = Timer(self, due, callback, args)
+        self._place(timer)
+        self.count += 1
+        return timer
+
+    def _place(self, timer: Timer):
+        delta = timer.due - self.current
+        level = 0
+        while delta >> (self.bits * (level + 1)) and level < len(self.levels) - 1:
+            level += 1
+        slot = self.levels[level][(timer.due >> (self.bits * level)) & self.mask]
+        slot[timer] = None
+        timer.slot = slot
+
+    def advance(self) -> int:
+        """Process the next tick; returns how many timers fired."""
+        t = self.current = self.current + 1
+        # Levels whose slot turns over on this tick, highest first: a timer
+        # moved down from level 2 may land in the level 1 slot emptied next
+        turning = []
+        shifted, level = t, 1
+        while level < len(self.levels) and not shifted & self.mask:
+            shifted >>= self.bits
+            turning.append((level, shifted & self.mask))
+            level += 1
+        for level, index in reversed(turning):
+            slot = self.levels[level][index]
+            if slot:
+                self.levels[level][index] = {}
+                for timer in slot:
+                    self._place(timer)
+
+        index = t & self.mask
+        slot = self.levels[0][index]
+        if not slot:
+            return 0
+        self.levels[0][index] = {}
+        self.count -= len(slot)
+        for timer in slot:
+            timer.slot = None
+            try:
+                result = timer.callback(*timer.args)
+                if asyncio.iscoroutine(result):
+                    asyncio.get_running_loop().create_task(result)
+            except Exception as e:
+                print(f"Timer callback {timer.callback.__qualname__} failed: {e!r}")
+        return len(slot)
+
+    async def _run(self):
+        try:
+            while self.count:
+                target = self.now()
+                while self.current < target and self.count:
+                    self.advance()
+                await asyncio.sleep(max(0.0, self.origin + (self.current + 1) * self.tick
+                                        - time.monotonic()))
+        finally:
+            self.task = None
+
+
+class IdleTimer:
+    """Calls ``callback(*args)`` once ``touch()`` has not been called for ``timeout`` seconds."""
+
+    __slots__ = ('wheel', 'timeout', 'callback', 'args', 'last', 'timer')
+
+    def __init__(self, timeout: float, callback: Callable, *args, wheel: TimingWheel = None):
+        self.wheel = shared_wheel() if wheel is None else wheel
+        self.timeout = timeout
+        self.callback = callback
+        self.args = args
+        self.last = time.monotonic()
+        self.timer = self.wheel.call_later(timeout, self._check)
+
+    def touch(self):
+        self.last = time.monotonic()
+
+    def cancel(self):
+        self.timer.cancel()
+
+    def _check(self):
+        idle = time.monotonic() - self.last
+        if idle + self.wheel.tick < self.timeout:
+            self.timer = self.wheel.call_later(self.timeout - idle, self._check)
+            return None
+        return self.callback(*self.args)
+
+
+def shared_wheel() -> TimingWheel:
+    return wheel
+
+
+wheel = TimingWheel()
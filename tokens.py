@@ -0,0 +1,152 @@
+# tokens.py
+"""HMAC-signed, expiring session tokens.
+
+A token is issued once after a bcrypt login and then proves the session on
+later connects without hashing a password or asking the user store:
+
+    <key id>.<payload>.<signature>
+
+``payload`` is base64url of the expiry (4 bytes), a token id (issue time
+in milliseconds and 4 random bytes) and the UTF-8 username. ``signature``
+is base64url of HMAC-SHA256 over ``<key id>.<payload>`` with that key.
+Verifying is a dict lookup, one HMAC and a struct unpack, under 10 us.
+
+Keys rotate by adding a new current key with ``rotate()``: tokens signed
+with older keys stay valid until the key is ``retire()``d. ``revoke()``
+puts a token id in a small set that empties itself as tokens expire;
+``revoke_user()`` drops every token a user was issued before now. Both
+are local to the process, so a cluster has to apply them on each worker.
+
+Keys come from HOKM_TOKEN_KEYS, ``kid:secret`` pairs separated by commas
+with the current key first. Without it a random key is made at startup,
+and tokens stop verifying when the process restarts.
+"""
+import base64
+import hashlib
+import hmac
+import os
+import secrets
+import struct
+import time
+from typing import Dict, NamedTuple, Optional
+
+TOKEN_TTL = 24 * 3600  # seconds a session token stays valid
+KEYS_ENV = 'HOKM_TOKEN_KEYS'
+_HEADER = struct.Struct('>I12s')  # expiry, token id
+_ISSUED = struct.Struct('>Q')  # leading part of the token id
+
+
+class Session(NamedTuple):
+    username: str
+    token_id: bytes
+    expires: int  # unix seconds
+    issued: int  # unix milliseconds
+
+
+def _b64(data: bytes) -> str:
+    return base64.urlsafe_b64encode(data).rstrip(b'=').decode()
+
+
+def _unb64(text: str) -> bytes:
+    return base64.urlsafe_b64decode(text + '=' * (-len(text) % 4))
+
+
+class TokenSigner:
+    def __init__(self, keys: Dict[str, bytes], current: str, ttl: int = TOKEN_TTL):
+        if current not in keys:
+            raise ValueError(f"Unknown current key: {current!r}")
+        self.keys = dict(keys)
+        # Keyed HMAC states to copy, so a verify skips the key setup
+        self.macs = {kid: hmac.new(secret, digestmod=hashlib.sha256)
+                     for kid, secret in self.keys.items()}
+        self.current = current
+        self.ttl = ttl
+        self.revoked: Dict[bytes, int] = {}  # token id -> expiry
+        self.revoked_before: Dict[str, int] = {}  # username -> last revoked issue time, ms
+
+    @classmethod
+    def from_env(cls, ttl: int = TOKEN_TTL) -> 'TokenSigner':
+        spec = os.environ.get(KEYS_ENV, '')
+        keys, current = {}, None
+        for pair in filter(None, spec.split(',')):
+            kid, _, secret = pair.partition(':')
+            if not kid or not secret or '.' in kid:
+                raise ValueError(f"{KEYS_ENV} entries look like kid:secret, got {pair!r}")
+            keys[kid] = secret.encode()
+            current = current or kid
+        if not keys:
+            current = 'local'
+            keys[current] = secrets.token_bytes(32)
+        return cls(keys, current, ttl)
+
+    def rotate(self, kid: str, secret: bytes):
+        """Sign with a new key from now on; tokens under older keys still verify."""
+        self.keys[kid] = secret
+        self.macs[kid] = hmac.new(secret, digestmod=hashlib.sha256)
+        self.current = kid
+
+    def retire(self, kid: str):
+        """Stop accepting tokens signed with an old key."""
+        if kid == self.current:
+            raise ValueError("Cannot retire the current key; rotate first")
+        self.keys.pop(kid, None)
+        self.macs.pop(kid, None)
+
+    def _sign(self, kid: str, payload: str) -> str:
+        mac = self.macs[kid].copy()
+        mac.update(f"{kid}.{payload}".encode())
+        return _b64(mac.digest())
+
+    def issue(self, username: str, ttl: int = None) -> str:
+        now = time.time()
+        expires = int(now) + (self.ttl if ttl is None else ttl)
+        # The issue time rides in the token id so revoke_user() can compare it
+        token_id = _ISSUED.pack(int(now * 1000)) + secrets.token_bytes(4)
+        payload = _b64(_HEADER.pack(expires, token_id) + username.encode())
+        return f"{self.current}.{payload}.{self._sign(self.current, payload)}"
+
+    def verify(self, token) -> Optional[Session]:
+        """The session a token proves, or None if it is forged, expired or revoked."""
+        if not isinstance(token, str) or token.count('.') != 2:
+            return None
+        kid, payload, signature = token.split('.')
+        if kid not in self.keys:
+            return None
+        if not hmac.compare_digest(self._sign(kid, payload).encode(), signature.encode()):
+            return None
+        raw = _unb64(payload)
+        expires, token_id = _HEADER.unpack_from(raw)
+        if expires <= time.time() or token_id in self.revoked:
+            return None
+        username = raw[_HEADER.size:].decode()
+        issued = _ISSUED.unpack_from(token_id)[0]
+        if issued <= self.revoked_before.get(username, -1):
+            return None
+        return Session(username, token_id, expires, issued)
+
+    def revoke(self, token: str) -> bool:
+        """Reject this token from now on; False if it was not valid anyway."""
+        session = self.verify(token)
+        if session is None:
+            return False
+        now = time.time()
+        # Expired ids would fail verification anyway, so the set stays small
+        for token_id in [t for t, expires in self.revoked.items() if expires <= now]:
+            del self.revoked[token_id]
+        self.revoked[session.token_id] = session.expires
+        return True
+
+    def revoke_user(self, username: str):
+        """Reject every token issued to ``username`` until now (password change, ban)."""
+        self.revoked_before[username] = int(time.time() * 1000)
+
+
+signer = TokenSigner.from_env()
+
+
+def issue(username: str) -> str:
+    return signer.issue(username)
+
+
+def verify(token) -> Optional[Session]:
+    return signer.verify(token)